@@ -0,0 +1,223 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from data_objects.flows import SupplierWarehouseDistance, WarehouseRestaurantDistance
+from data_objects.sites import Vendor, Warehouse, Restaurant
+from data_objects.vehicles import Vehicle
+from evaluators.evaluator import Evaluator
+import logging
+import math
+from optimisers.solvers import SolverConfig
+import os
+from output.output import SupplyChain
+from readers.restaurant_reader import RestaurantReader
+from readers.supplier_warehouse_distances_reader import SupplierWarehouseDistanceReader
+from readers.supply_chain_reader import SupplyChainReader
+from readers.vehicle_reader import VehicleReader
+from readers.vendor_reader import VendorReader
+from readers.warehouse_reader import WarehouseReader
+from readers.warehouse_restaurant_distances_reader import WarehouseRestaurantDistanceReader
+import time
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class OutageScenario:
+    name: str
+    # names of the vendors and warehouses that are out, as they appear in the plan
+    inactive_sites: List[str]
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    total_cost: float
+    total_co2_emissions: float
+    # restaurant demand the plan no longer delivers
+    unmet_supply: float
+    cost_delta: float
+    co2_emissions_delta: float
+    unmet_supply_delta: float
+    error: str = None
+
+
+# each worker process receives the plan, restaurant demand and evaluator settings once, when it starts, rather than once per scenario
+shared_plan: SupplyChain = None
+shared_demand: dict[str, float] = None
+# the keyword arguments of the evaluator, and the site and route tables it would otherwise read from db
+shared_options: dict = None
+shared_data: dict = None
+
+def set_shared_data(supply_chain: SupplyChain, restaurant_demand: dict[str, float], options: dict, data: dict):
+    global shared_plan, shared_demand, shared_options, shared_data
+    shared_plan = supply_chain
+    shared_demand = restaurant_demand
+    shared_options = options
+    shared_data = data
+
+
+def evaluate_scenario(scenario: OutageScenario) -> tuple[str, float, float, float, str]:
+    '''
+    Returns the scenario's total cost, CO2 emissions and unmet supply, or the error that stopped its evaluation.
+    '''
+    evaluator = Evaluator(depots=[], suppliers=[], distributors=[], supply_chain=shared_plan, inactive_sites=scenario.inactive_sites, **shared_options)
+    for name, value in shared_data.items():
+        setattr(evaluator, name, value)
+    try:
+        supply_chain = evaluator.evaluate()
+    except Exception as e:
+        return scenario.name, math.nan, math.nan, math.nan, str(e)
+    delivered = supply_chain.get_site_amounts('distribution')
+    unmet_supply = sum(max(demand - delivered.get(name, 0.0), 0.0) for name, demand in shared_demand.items())
+    return scenario.name, supply_chain.metrics.total_cost, supply_chain.metrics.total_co2_emissions, unmet_supply, None
+
+
+class BatchEvaluator:
+    '''
+    Evaluates many outage scenarios against the published plan. The plan and site tables are read once and shared
+    with the worker processes, which evaluate the scenarios in chunks. Each scenario is compared with the plan
+    evaluated with no site out.
+    Warehouses left short by an outage only send out what they still receive, so the unmet supply is what the
+    plan can no longer deliver. With reoptimise the evaluator also re-routes the lost supply over the spare capacity,
+    and the site and route tables it needs are shared with the workers too.
+    '''
+    # chunks per worker, enough to even out scenarios of different sizes without sending each one separately
+    CHUNKS_PER_WORKER = 4
+
+    def __init__(self,
+                 supply_chain: SupplyChain = None,
+                 vendors: List[Vendor] = None,
+                 warehouses: List[Warehouse] = None,
+                 restaurants: List[Restaurant] = None,
+                 vehicles: List[Vehicle] = None,
+                 supplier_warehouse_distances: List[SupplierWarehouseDistance] = None,
+                 warehouse_restaurant_distances: List[WarehouseRestaurantDistance] = None,
+                 reoptimise=False,
+                 cost_co2_split=0.5,
+                 nearest_warehouses=5,
+                 solver_config: SolverConfig = None,
+                 max_workers=None):
+        '''
+        Anything not given is read from db.
+        '''
+        self.supply_chain = supply_chain
+        self.vendors = vendors
+        self.warehouses = warehouses
+        self.restaurants = restaurants
+        self.vehicles = vehicles
+        self.supplier_warehouse_distance = supplier_warehouse_distances
+        self.warehouse_restaurant_distance = warehouse_restaurant_distances
+        self.reoptimise = reoptimise
+        self.cost_co2_split = cost_co2_split
+        self.nearest_warehouses = nearest_warehouses
+        self.solver_config = solver_config or SolverConfig.from_env()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.baseline: ScenarioResult = None
+        self.results: List[ScenarioResult] = []
+
+    def get_data(self):
+        if self.supply_chain is None:
+            supply_chain = SupplyChainReader()
+            supply_chain.run()
+            self.supply_chain = supply_chain.data
+            logger.info(f"Read {len(self.supply_chain)} edges of the published plan from db.")
+
+        if self.vendors is None:
+            vendors = VendorReader()
+            vendors.run()
+            self.vendors = vendors.data
+            logger.info(f"Read {len(self.vendors)} vendors from db.")
+
+        if self.warehouses is None:
+            warehouses = WarehouseReader()
+            warehouses.run()
+            self.warehouses = warehouses.data
+            logger.info(f"Read {len(self.warehouses)} warehouses from db.")
+
+        if self.restaurants is None:
+            restaurants = RestaurantReader()
+            restaurants.run()
+            self.restaurants = restaurants.data
+            logger.info(f"Read {len(self.restaurants)} restaurants from db.")
+
+        if not self.reoptimise:
+            return
+
+        if self.vehicles is None:
+            vehicles = VehicleReader()
+            vehicles.run()
+            self.vehicles = vehicles.data
+            logger.info(f"Read {len(self.vehicles)} vehicles from db.")
+
+        if self.supplier_warehouse_distance is None:
+            supplier_warehouse_distances = SupplierWarehouseDistanceReader()
+            supplier_warehouse_distances.run()
+            self.supplier_warehouse_distance = supplier_warehouse_distances.data
+
+        if self.warehouse_restaurant_distance is None:
+            warehouse_restaurant_distances = WarehouseRestaurantDistanceReader()
+            warehouse_restaurant_distances.run()
+            self.warehouse_restaurant_distance = warehouse_restaurant_distances.data
+
+    def get_single_warehouse_outages(self) -> List[OutageScenario]:
+        self.get_data()
+        return [OutageScenario(f"warehouse {w.name} out", [w.name]) for w in self.warehouses]
+
+    def get_single_vendor_outages(self) -> List[OutageScenario]:
+        self.get_data()
+        return [OutageScenario(f"vendor {v.name} out", [v.name]) for v in self.vendors]
+
+    def evaluate(self, scenarios: List[OutageScenario]) -> List[ScenarioResult]:
+        '''
+        Returns a result per scenario, in the order given.
+        '''
+        start_time = time.time()
+        self.get_data()
+        restaurant_demand = {r.name: float(r.restaurant_demand) for r in self.restaurants}
+        workers = max(min(self.max_workers, len(scenarios)), 1)
+        options, data = self.get_evaluator_settings(workers)
+
+        set_shared_data(self.supply_chain, restaurant_demand, options, data)
+        _, cost, co2_emissions, unmet_supply, error = evaluate_scenario(OutageScenario("no outage", []))
+        if error:
+            raise ValueError(f"The published plan cannot be evaluated: {error}")
+        self.baseline = ScenarioResult("no outage", cost, co2_emissions, unmet_supply, 0.0, 0.0, 0.0)
+
+        chunksize = max(math.ceil(len(scenarios) / (workers * self.CHUNKS_PER_WORKER)), 1)
+        logger.info(f"Evaluating {len(scenarios)} outage scenarios in {workers} processes.")
+        with ProcessPoolExecutor(max_workers=workers, initializer=set_shared_data, initargs=(self.supply_chain, restaurant_demand, options, data)) as executor:
+            outcomes = list(executor.map(evaluate_scenario, scenarios, chunksize=chunksize))
+
+        self.results = [ScenarioResult(name=name,
+                                       total_cost=cost,
+                                       total_co2_emissions=co2_emissions,
+                                       unmet_supply=unmet_supply,
+                                       cost_delta=cost - self.baseline.total_cost,
+                                       co2_emissions_delta=co2_emissions - self.baseline.total_co2_emissions,
+                                       unmet_supply_delta=unmet_supply - self.baseline.unmet_supply,
+                                       error=error)
+                        for name, cost, co2_emissions, unmet_supply, error in outcomes]
+        for result in self.results:
+            if result.error:
+                logger.warning(f"Scenario {result.name} could not be evaluated: {result.error}")
+        logger.info(f"Evaluated {len(scenarios)} outage scenarios in {time.time() - start_time}.")
+        return self.results
+
+    def get_evaluator_settings(self, workers: int) -> tuple[dict, dict]:
+        '''
+        The evaluator's keyword arguments and the tables to give it. The cores are shared between the workers, so
+        each re-optimisation gets its share of the solver threads.
+        '''
+        options = {'reoptimise': self.reoptimise, 'scale_down_short': True}
+        if not self.reoptimise:
+            return options, {}
+        options.update(cost_co2_split=self.cost_co2_split,
+                       nearest_warehouses=self.nearest_warehouses,
+                       solver_config=replace(self.solver_config, threads=max(1, (self.solver_config.threads or 1) // workers)))
+        data = {'vendors': self.vendors,
+                'warehouses': self.warehouses,
+                'restaurants': self.restaurants,
+                'vehicles': self.vehicles,
+                'supplier_warehouse_distance': self.supplier_warehouse_distance,
+                'warehouse_restaurant_distance': self.warehouse_restaurant_distance}
+        return options, data
@@ -1,6 +1,16 @@
+from collections import defaultdict
+from dataclasses import replace
+from data_objects.flows import SupplierWarehouseDistance, WarehouseRestaurantDistance
+from data_objects.sites import Vendor, Warehouse, Restaurant
+from data_objects.vehicles import Vehicle
 import logging
+import numpy as np
+from optimisers.optimiser import SupplyChainOptimisation
+from optimisers.profit_maximiser import SupplyChainProfitMaximiser
+from optimisers.solvers import SolverConfig
 from output.output import Edge, SupplyChain
 from output.outputter import OptimisationOutputter, JSONOutputter
+from pulp import LpStatusInfeasible
 from readers.restaurant_reader import RestaurantReader
 from readers.supplier_warehouse_distances_reader import SupplierWarehouseDistanceReader
 from readers.supply_chain_reader import SupplyChainReader
@@ -10,20 +20,58 @@ from readers.warehouse_reader import WarehouseReader, WarehouseIDReader
 from readers.warehouse_restaurant_distances_reader import WarehouseRestaurantDistanceReader
 from readers.warehouse_restaurant_distances_reader import WarehouseRestaurantDistanceReader
 import time
-from typing import Dict, List
+from typing import List
 
 logger = logging.getLogger(__name__)
 
 class Evaluator:
-    def __init__(self, depots: list, suppliers: list, distributors: list):
-        self.supply_chain = self.read_db_supply_chain()
+    '''
+    Updates the previous plan for sites that became inactive. The plan is kept by column, edges are grouped by their
+    warehouse and by their route, and the flows are adjusted per group with array operations.
+    With reoptimise the supply lost to the inactive sites is re-routed instead: warehouses left short send out only
+    what they still receive, and a small cost minimising model over the restaurants that lost supply, their nearest
+    warehouses with capacity to spare and the vendors with capacity to spare delivers what it can of the loss.
+    The rest of the plan is kept as it is. With scale_down_short the warehouses left short only send out what they
+    still receive and nothing is re-routed, so no delivery is ever more than the plan's.
+    '''
+    TOLERANCE = 1e-6
+
+    def __init__(self,
+                 depots: list,
+                 suppliers: list,
+                 distributors: list,
+                 supply_chain: SupplyChain = None,
+                 inactive_sites: List[str] = None,
+                 reoptimise=False,
+                 scale_down_short=False,
+                 cost_co2_split=0.5,
+                 nearest_warehouses=5,
+                 solver_config: SolverConfig = None):
+        '''
+        A plan and inactive site names already loaded, e.g. by a batch of scenarios, are used instead of reading them from db.
+        '''
+        self.supply_chain: SupplyChain = supply_chain if supply_chain is not None else self.read_db_supply_chain()
         self.inactive_depots = depots
         self.inactive_suppliers = suppliers
         self.inactive_distributors = distributors
-        self.inactive_sites = self.get_inactive_sites()
-        self.supply_chain_updating: list = []
+        self.inactive_sites = inactive_sites if inactive_sites is not None else self.get_inactive_sites()
+        self.reoptimise = reoptimise
+        self.scale_down_short = scale_down_short
+        self.cost_co2_split = cost_co2_split
+        self.nearest_warehouses = nearest_warehouses
+        self.solver_config = solver_config or SolverConfig.from_env()
+        self.supply_chain_updating: SupplyChain = None
         self.new_supply_chain: SupplyChain = None
-        self.connector_edges: Dict[str: [Edge]] = {}
+        # the warehouse of each edge being updated, -1 for edges of any other stage
+        self.connector_nodes: np.ndarray = None
+        self.connector_names: List[str] = []
+        self.repair_optimiser: SupplyChainOptimisation = None
+        self.vendors: List[Vendor] = None
+        self.warehouses: List[Warehouse] = None
+        self.restaurants: List[Restaurant] = None
+        self.vehicles: List[Vehicle] = None
+        self.supplier_warehouse_distance: List[SupplierWarehouseDistance] = None
+        self.warehouse_restaurant_distance: List[WarehouseRestaurantDistance] = None
         self.json_output = {}
 
     def calculate_new_supply_chain(self):
@@ -31,97 +79,192 @@ class Evaluator:
         This method takes the previous supply chain and updates it based on which sites are inactive.
         It returns a new supply chain object.
         """
+        self.evaluate()
+        self.create_output()
+
+    def evaluate(self) -> SupplyChain:
+        '''
+        Updates the plan and its totals without writing any output.
+        '''
         self.remove_inactive_sites()
-        self.adjust_inflows_and_outflows()
+        if self.reoptimise:
+            self.reoptimise_lost_supply()
+        elif self.scale_down_short:
+            self.get_connector_nodes()
+            self.scale_down_short_warehouses()
+        else:
+            self.adjust_inflows_and_outflows()
         self.convert_to_supply_chain()
-        self.create_output()
+        return self.new_supply_chain
 
     def remove_inactive_sites(self):
-        for edge in self.supply_chain:
-            if self.edge_is_active(edge):
-                self.supply_chain_updating.append(edge)
+        self.supply_chain_updating = self.supply_chain.select(np.flatnonzero(self.get_active_edges()))
         logger.info(f"Removed {len(self.supply_chain) - len(self.supply_chain_updating)} edges from supply chain.")
     
     def adjust_inflows_and_outflows(self):
-        self.get_connector_edges()
+        self.get_connector_nodes()
         self.equate_amounts()
         self.replace_connector_edges()
 
-    def edge_is_active(self, edge: Edge):
-        return (edge.source_id not in self.inactive_sites) and (edge.target_id not in self.inactive_sites)
-    
+    def get_active_edges(self) -> np.ndarray:
+        '''
+        Whether each edge of the plan has neither an inactive source nor an inactive target.
+        '''
+        active = np.ones(len(self.supply_chain), dtype=bool)
+        for name in ('source_id', 'target_id'):
+            codes = self.supply_chain.category_codes[name]
+            inactive_codes = [codes[site] for site in self.inactive_sites if site in codes]
+            active &= ~np.isin(self.supply_chain.columns[name], inactive_codes)
+        return active
+
     def at_supply_stage(self, edge: Edge):
         return edge.stage == 'supply'
     
     def at_distribution_stage(self, edge: Edge):
         return edge.stage == 'distribution'
     
-    def get_connector_edges(self):
-        connector_edges = {}
-        for edge in self.supply_chain_updating:
-            connector_edges = self.add_connector_edge(edge, connector_edges)
-        self.connector_edges = connector_edges
-
-    def add_connector_edge(self, edge: Edge, connector_edges):
-        if edge.stage == 'supply':
-            if edge.target_id not in connector_edges:
-                connector_edges[edge.target_id] = [edge]
-            else:
-                connector_edges[edge.target_id].extend([edge])
-        elif edge.stage == 'distribution':
-            if edge.source_id not in connector_edges:
-                connector_edges[edge.source_id] = [edge]
-            else:
-                connector_edges[edge.source_id].extend([edge])
-        return connector_edges
-    
+    def get_connector_nodes(self):
+        '''
+        Numbers the warehouses connecting the two stages, the target of a supply edge and the source of a distribution edge.
+        '''
+        chain = self.supply_chain_updating
+        supply = chain.get_stage_mask('supply')
+        distribution = chain.get_stage_mask('distribution')
+        names = {}
+        # the source and target ids have their own category codes, both are mapped onto one numbering of the warehouses
+        target_nodes = np.array([names.setdefault(site, len(names)) for site in chain.categories['target_id']], dtype=np.int64)
+        source_nodes = np.array([names.setdefault(site, len(names)) for site in chain.categories['source_id']], dtype=np.int64)
+        nodes = np.full(len(chain), -1, dtype=np.int64)
+        nodes[supply] = target_nodes[chain.columns['target_id'][supply]]
+        nodes[distribution] = source_nodes[chain.columns['source_id'][distribution]]
+        self.connector_nodes = nodes
+        self.connector_names = list(names)
+
     def equate_amounts(self):
-        for node in self.connector_edges.values():
-            inflow = 0
-            outflow = 0
-            for edge in node:
-                if edge.stage == 'supply':
-                    inflow += edge.amount
-                elif edge.stage == 'distribution':
-                    outflow += edge.amount
-            
-            if inflow <= outflow:
-                flow_difference = inflow - outflow
-                distributed_supply_shortage = flow_difference / len(node)
-                for edge in node:
-                    if edge.stage == 'distribution':
-                        edge.amount -= distributed_supply_shortage
-            elif inflow == outflow:
-                continue
-            else:
-                raise Exception("Inflow greater than outflow.")
-            
+        '''
+        Spreads the difference between each warehouse's inflow and outflow over its distribution edges, in proportion
+        to its number of edges.
+        '''
+        chain = self.supply_chain_updating
+        amounts = chain.columns['amount']
+        supply = chain.get_stage_mask('supply')
+        distribution = chain.get_stage_mask('distribution')
+        nodes = self.connector_nodes
+        n_nodes = len(self.connector_names)
+        inflow = np.bincount(nodes[supply], weights=amounts[supply], minlength=n_nodes)
+        outflow = np.bincount(nodes[distribution], weights=amounts[distribution], minlength=n_nodes)
+        n_edges = np.bincount(nodes[supply | distribution], minlength=n_nodes)
+        if (inflow > outflow).any():
+            raise Exception("Inflow greater than outflow.")
+        with np.errstate(invalid='ignore', divide='ignore'):
+            distributed_supply_shortage = (inflow - outflow) / n_edges
+        amounts[distribution] -= distributed_supply_shortage[nodes[distribution]]
+
     def replace_connector_edges(self):
-        for edge in self.supply_chain_updating:
-            edge = self.replace_connector_edge(edge)
-
-    def replace_connector_edge(self, edge: Edge) -> Edge:
-        if edge.stage == 'distribution':
-            if edge.source_id in self.connector_edges.keys():
-                equivalent_edges = self.connector_edges[edge.source_id]
-                new_edge = self.get_matching_edge(equivalent_edges, edge)
-                edge.amount = new_edge.amount
-                return edge
-        return edge
-
-    def get_matching_edge(self, edges_list: List[Edge], edge_to_match: Edge):
-        for edge in edges_list:
-            if (edge.source_id, edge.target_id) == (edge_to_match.source_id, edge_to_match.target_id):
-                return edge
-            
+        '''
+        Gives every distribution edge the amount of the first edge on its route, as keyed by source and target.
+        '''
+        chain = self.supply_chain_updating
+        distribution = np.flatnonzero(chain.get_stage_mask('distribution'))
+        routes = chain.columns['source_id'][distribution].astype(np.int64) * len(chain.categories['target_id']) + chain.columns['target_id'][distribution]
+        _, first_edges, route_of_edge = np.unique(routes, return_index=True, return_inverse=True)
+        amounts = chain.columns['amount']
+        amounts[distribution] = amounts[distribution][first_edges][route_of_edge]
+
+    def reoptimise_lost_supply(self):
+        self.get_connector_nodes()
+        self.scale_down_short_warehouses()
+        lost_supply = self.get_lost_supply()
+        if not lost_supply:
+            logger.info("No restaurant lost supply, nothing to re-optimise.")
+            return
+        self.get_data()
+        self.get_network_data()
+        self.repair_optimiser = self.create_repair_optimiser(lost_supply)
+        if self.repair_optimiser is None:
+            logger.warning(f"No vendor or warehouse has capacity to spare for the {sum(lost_supply.values()):.1f} supply lost.")
+            return
+        self.repair_optimiser.solve()
+        if self.repair_optimiser.problem.status == LpStatusInfeasible:
+            logger.warning("The spare capacity cannot make up all supply lost, delivering what is profitable.")
+            self.repair_optimiser = SupplyChainProfitMaximiser.from_model(self.repair_optimiser)
+            self.repair_optimiser.solve()
+        if not self.repair_optimiser.solve_stats.has_solution:
+            logger.warning("No plan found to make up the supply lost.")
+            return
+        repair = OptimisationOutputter(optimiser=self.repair_optimiser).create_table_output()
+        logger.info(f"Re-routed {sum(repair.get_site_amounts('distribution').values()):.1f} of {sum(lost_supply.values()):.1f} supply lost over {len(repair)} edges.")
+        self.supply_chain_updating = SupplyChain.concatenate([self.supply_chain_updating, repair])
+
+    def scale_down_short_warehouses(self):
+        '''
+        Scales the distribution edges of warehouses that receive less than they send out, with their costs and emissions,
+        down to what the warehouse receives.
+        '''
+        chain = self.supply_chain_updating
+        supply = chain.get_stage_mask('supply')
+        distribution = chain.get_stage_mask('distribution')
+        nodes = self.connector_nodes
+        n_nodes = len(self.connector_names)
+        inflow = np.bincount(nodes[supply], weights=chain.columns['amount'][supply], minlength=n_nodes)
+        outflow = np.bincount(nodes[distribution], weights=chain.columns['amount'][distribution], minlength=n_nodes)
+        ratios = np.minimum(np.divide(inflow, outflow, out=np.ones(n_nodes), where=outflow > 0), 1.0)
+        for name in SupplyChain.NUMERIC_FIELDS:
+            chain.columns[name][distribution] *= ratios[nodes[distribution]]
+
+    def get_lost_supply(self) -> dict[str, float]:
+        '''
+        The supply each active restaurant received in the previous plan and no longer receives.
+        '''
+        previous = self.supply_chain.get_site_amounts('distribution')
+        current = self.supply_chain_updating.get_site_amounts('distribution')
+        inactive_sites = set(self.inactive_sites)
+        lost_supply = {name: amount - current.get(name, 0.0) for name, amount in previous.items() if name not in inactive_sites}
+        return {name: amount for name, amount in lost_supply.items() if amount > self.TOLERANCE}
+
+    def create_repair_optimiser(self, lost_supply: dict[str, float]) -> SupplyChainOptimisation:
+        '''
+        A cost minimising model over the restaurants that lost supply, with their demand the supply lost, and the active
+        vendors and warehouses with their capacity left over by the rest of the plan. Each restaurant is only served by
+        its nearest warehouses with spare capacity, and no vehicle has to be used.
+        '''
+        chain = self.supply_chain_updating
+        inactive_sites = set(self.inactive_sites)
+        vendor_used = chain.get_site_amounts('supply', site='source_id')
+        warehouse_used = chain.get_site_amounts('supply', site='target_id')
+        vendors = [replace(v, capacity=v.capacity - vendor_used.get(v.name, 0.0)) for v in self.vendors if v.name not in inactive_sites]
+        vendors = [v for v in vendors if v.capacity > self.TOLERANCE]
+        warehouses = {w.name: replace(w, inventory_capacity=w.inventory_capacity - warehouse_used.get(w.name, 0.0)) for w in self.warehouses if w.name not in inactive_sites}
+        warehouses = {name: w for name, w in warehouses.items() if w.inventory_capacity > self.TOLERANCE}
+        restaurants = [replace(r, restaurant_demand=lost_supply[r.name]) for r in self.restaurants if r.name in lost_supply]
+        if not vendors or not warehouses or not restaurants:
+            return None
+
+        routes = defaultdict(list)
+        for d in self.warehouse_restaurant_distance:
+            w, r = d.route_tuple
+            if w in warehouses and r in lost_supply:
+                routes[r].append(d)
+        nearby = [d for distances in routes.values() for d in sorted(distances, key=lambda d: d.distance)[:self.nearest_warehouses]]
+        nearby_warehouses = {d.route_tuple[0] for d in nearby}
+        vendor_names = {v.name for v in vendors}
+        logger.info(f"Re-optimising {len(restaurants)} restaurants from {len(nearby_warehouses)} warehouses and {len(vendors)} vendors.")
+        return SupplyChainOptimisation(cost_co2_split=self.cost_co2_split,
+                                       vendors=vendors,
+                                       warehouses=[w for name, w in warehouses.items() if name in nearby_warehouses],
+                                       restaurants=restaurants,
+                                       vehicles=[replace(ve, number_available=0) for ve in self.vehicles],
+                                       supplier_warehouse_distances=[d for d in self.supplier_warehouse_distance if d.route_tuple[0] in vendor_names and d.route_tuple[1] in nearby_warehouses],
+                                       warehouse_restaurant_distances=nearby,
+                                       solver_config=self.solver_config)
+
     def convert_to_supply_chain(self):
-        self.new_supply_chain = SupplyChain(self.supply_chain_updating)
+        self.new_supply_chain = self.supply_chain_updating
         self.new_supply_chain.get_totals()
 
     def create_output(self):
         self.get_data()
-        supply_chain_plan = self.new_supply_chain.plan_to_list()
-        json_outputter = JSONOutputter(supply_chain_plan=supply_chain_plan,
+        json_outputter = JSONOutputter(supply_chain_plan=self.new_supply_chain,
                                        vendors=self.vendors,
                                        warehouses=self.warehouses,
                                        restaurants=self.restaurants)
@@ -143,24 +286,50 @@ class Evaluator:
         return inactive_sites
 
     def get_data(self):
-        vendors = VendorReader()
-        vendors.run()
-        self.vendors = vendors.data
-        logger.info(f"Read {len(self.vendors)} vendors from db.")
+        '''
+        Reads the sites not read or given yet.
+        '''
+        if self.vendors is None:
+            vendors = VendorReader()
+            vendors.run()
+            self.vendors = vendors.data
+            logger.info(f"Read {len(self.vendors)} vendors from db.")
 
-        warehouses = WarehouseReader()
-        warehouses.run()
-        self.warehouses = warehouses.data
-        logger.info(f"Read {len(self.warehouses)} warehouses from db.")
+        if self.warehouses is None:
+            warehouses = WarehouseReader()
+            warehouses.run()
+            self.warehouses = warehouses.data
+            logger.info(f"Read {len(self.warehouses)} warehouses from db.")
 
-        restaurants = RestaurantReader()
-        restaurants.run()
-        self.restaurants = restaurants.data
-        logger.info(f"Read {len(self.restaurants)} restaurants from db.")
+        if self.restaurants is None:
+            restaurants = RestaurantReader()
+            restaurants.run()
+            self.restaurants = restaurants.data
+            logger.info(f"Read {len(self.restaurants)} restaurants from db.")
 
         logger.info("Read all data.")
 
+    def get_network_data(self):
+        '''
+        Reads the vehicles and distances the re-optimisation needs, if not read or given yet.
+        '''
+        if self.vehicles is None:
+            vehicles = VehicleReader()
+            vehicles.run()
+            self.vehicles = vehicles.data
+            logger.info(f"Read {len(self.vehicles)} vehicles from db.")
+
+        if self.supplier_warehouse_distance is None:
+            supplier_warehouse_distances = SupplierWarehouseDistanceReader()
+            supplier_warehouse_distances.run()
+            self.supplier_warehouse_distance = supplier_warehouse_distances.data
+
+        if self.warehouse_restaurant_distance is None:
+            warehouse_restaurant_distances = WarehouseRestaurantDistanceReader()
+            warehouse_restaurant_distances.run()
+            self.warehouse_restaurant_distance = warehouse_restaurant_distances.data
+
     def read_db_supply_chain(self):
         supply_chain = SupplyChainReader()
         supply_chain.run()
-        return supply_chain.data.supply_chain
\ No newline at end of file
+        return supply_chain.data
\ No newline at end of file
@@ -0,0 +1,86 @@
+from dataclasses import replace
+import logging
+from optimisers.array_model import ArrayModel, ArrayModelBuilder
+from optimisers.rounding import LPRoundingSolver
+from optimisers.solvers import SolverConfig, SolveStats
+from pulp import LpMaximize, LpSolution, LpSolutionIntegerFeasible, LpSolutionOptimal, LpStatusOptimal
+import time
+
+logger = logging.getLogger(__name__)
+
+class AnytimeSolver:
+    '''
+    Finds a feasible plan quickly with LP rounding, then solves the exact MIP from it as a MIP start for the rest of the
+    solver's time limit. The MIP's plan is kept unless it is worse, so a plan is returned even if the MIP finds no incumbent in time.
+    The reported bound is the tighter of the LP relaxation and the MIP's own bound.
+    '''
+    MIN_TIME_LIMIT = 1
+    GAP_TOLERANCE = 1e-6
+
+    def __init__(self, optimiser, restaurant_demand_sense: str = 'G'):
+        self.optimiser = optimiser
+        self.restaurant_demand_sense = restaurant_demand_sense
+        self.solver_config: SolverConfig = optimiser.solver_config
+        self.rounding_solver = LPRoundingSolver(optimiser, restaurant_demand_sense)
+
+    def get_remaining_config(self, start_time: float) -> SolverConfig:
+        if self.solver_config.time_limit is None:
+            return self.solver_config
+        remaining = max(self.solver_config.time_limit - (time.time() - start_time), self.MIN_TIME_LIMIT)
+        return replace(self.solver_config, time_limit=remaining)
+
+    def is_as_good(self, objective: float, incumbent: float) -> bool:
+        if objective is None:
+            return False
+        return objective >= incumbent if self.optimiser.problem.sense == LpMaximize else objective <= incumbent
+
+    def get_bound(self, *bounds: float) -> float:
+        bounds = [bound for bound in bounds if bound is not None]
+        if not bounds:
+            return None
+        return min(bounds) if self.optimiser.problem.sense == LpMaximize else max(bounds)
+
+    def solve_problem(self) -> SolveStats:
+        start_time = time.time()
+        problem = self.optimiser.problem
+        rounded_stats = self.rounding_solver.solve_problem()
+        if rounded_stats.solution_status != LpSolution[LpSolutionIntegerFeasible]:
+            # no rounded plan, or the rounding already fell back to the exact MIP
+            return rounded_stats
+
+        incumbent = [(variable, variable.varValue) for variable in problem.variables()]
+        stats = self.get_remaining_config(start_time).solve(problem, warm_start=True)
+        if self.is_as_good(stats.objective, rounded_stats.objective):
+            return self.get_stats(stats, self.get_bound(stats.bound, rounded_stats.bound), start_time)
+
+        logger.info("MIP did not improve on the rounded plan, keeping it.")
+        for variable, value in incumbent:
+            variable.varValue = value
+        problem.assignStatus(LpStatusOptimal, LpSolutionIntegerFeasible)
+        return self.get_stats(rounded_stats, self.get_bound(stats.bound, rounded_stats.bound), start_time)
+
+    def solve_model(self, builder: ArrayModelBuilder, model: ArrayModel) -> SolveStats:
+        start_time = time.time()
+        rounded_stats = self.rounding_solver.solve_model(builder, model)
+        if rounded_stats.solution_status != LpSolution[LpSolutionIntegerFeasible]:
+            return rounded_stats
+
+        incumbent = builder.get_initial_values()
+        status, sol_status, values, bound = model.solve(self.get_remaining_config(start_time), initial_values=incumbent)
+        builder.assign_solution(model, status, sol_status, values)
+        stats = self.solver_config.get_stats(self.optimiser.problem, bound, time.time() - start_time)
+        if self.is_as_good(stats.objective, rounded_stats.objective):
+            return self.get_stats(stats, self.get_bound(stats.bound, rounded_stats.bound), start_time)
+
+        logger.info("MIP did not improve on the rounded plan, keeping it.")
+        builder.assign_solution(model, LpStatusOptimal, LpSolutionIntegerFeasible, incumbent)
+        return self.get_stats(rounded_stats, self.get_bound(stats.bound, rounded_stats.bound), start_time)
+
+    def get_stats(self, stats: SolveStats, bound: float, start_time: float) -> SolveStats:
+        stats = replace(stats, bound=bound, wall_time=time.time() - start_time)
+        # CBC reports a MIP stopped at its relative gap as optimal, the plan is only proven once the gap to a valid bound is closed
+        if stats.gap is not None:
+            stats = replace(stats, solution_status=LpSolution[LpSolutionOptimal if stats.gap <= self.GAP_TOLERANCE else LpSolutionIntegerFeasible])
+        gap = f"{stats.gap:.2%}" if stats.gap is not None else "unknown"
+        logger.info(f"Anytime solve finished with {stats.solution_status} objective {stats.objective}, bound {stats.bound} and gap {gap}.")
+        return stats
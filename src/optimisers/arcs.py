@@ -0,0 +1,94 @@
+from collections import defaultdict
+from data_objects.vehicles import Vehicle
+import logging
+from mapper import RouteCostMapper
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+class CandidateArcBuilder:
+    '''
+    Builds the feasible (source, target, vehicle company, vehicle name) arcs for one stage of the network.
+    An arc only exists if there is a row for the route in the distance mapping and the vehicle serves the
+    location of either end of the route. Vehicles without any locations are treated as serving everywhere.
+    '''
+    def __init__(self, vehicles: List[Vehicle], route_mapper: RouteCostMapper):
+        self.vehicles = vehicles
+        self.route_mapper = route_mapper
+        self.vehicles_by_location = self.get_vehicles_by_location(vehicles)
+        self.unrestricted_vehicles = [ve for ve in vehicles if not ve.locations]
+
+    def get_vehicles_by_location(self, vehicles: List[Vehicle]) -> dict[str, List[Vehicle]]:
+        vehicles_by_location = defaultdict(list)
+        for ve in vehicles:
+            for location in ve.locations or []:
+                vehicles_by_location[location].append(ve)
+        return vehicles_by_location
+
+    def get_route_vehicles(self, source_location: str, target_location: str) -> List[Vehicle]:
+        route_vehicles = {}
+        for ve in self.vehicles_by_location.get(source_location, []) + self.vehicles_by_location.get(target_location, []) + self.unrestricted_vehicles:
+            route_vehicles[(ve.company, ve.name)] = ve
+        return list(route_vehicles.values())
+
+    def build(self, sources: list, targets: list, routes: List[tuple[str, str]] = None) -> List[tuple[str, str, str, str]]:
+        '''
+        Returns the arcs between the given sources and targets, in the order of the distance mapping.
+        If routes are given, e.g. only those to the nearest warehouses, arcs are only built for them.
+        '''
+        source_locations = {s.name: s.location for s in sources}
+        target_locations = {t.name: t.location for t in targets}
+        arcs = []
+        for (source, target) in (self.route_mapper.distance_mapping if routes is None else routes):
+            if source not in source_locations or target not in target_locations:
+                continue
+            for ve in self.get_route_vehicles(source_locations[source], target_locations[target]):
+                arcs.append((source, target, ve.company, ve.name))
+        logger.info(f"Built {len(arcs)} candidate arcs from {len(sources)} sources, {len(targets)} targets and {len(self.vehicles)} vehicles.")
+        return arcs
+
+
+class ArcIndex:
+    '''
+    Adjacency of the candidate arcs, built in a single pass over each stage so every constraint family can take
+    its terms from a slice of the index instead of scanning all arcs.
+    '''
+    def __init__(self, supply_arcs: List[tuple[str, str, str, str]], distribution_arcs: List[tuple[str, str, str, str]]):
+        self.vendor_out = defaultdict(list)
+        self.warehouse_in = defaultdict(list)
+        self.warehouse_out = defaultdict(list)
+        self.restaurant_in = defaultdict(list)
+        self.vehicle_supply = defaultdict(list)
+        self.vehicle_distribution = defaultdict(list)
+        self.supply_routes = defaultdict(list)
+        self.distribution_routes = defaultdict(list)
+
+        for arc in supply_arcs:
+            self.vendor_out[arc[0]].append(arc)
+            self.warehouse_in[arc[1]].append(arc)
+            self.vehicle_supply[(arc[2], arc[3])].append(arc)
+            self.supply_routes[(arc[0], arc[1])].append(arc)
+
+        for arc in distribution_arcs:
+            self.warehouse_out[arc[0]].append(arc)
+            self.restaurant_in[arc[1]].append(arc)
+            self.vehicle_distribution[(arc[2], arc[3])].append(arc)
+            self.distribution_routes[(arc[0], arc[1])].append(arc)
+
+    def get_vendor_out(self, vendor: str) -> List[tuple[str, str, str, str]]:
+        return self.vendor_out.get(vendor, [])
+
+    def get_warehouse_in(self, warehouse: str) -> List[tuple[str, str, str, str]]:
+        return self.warehouse_in.get(warehouse, [])
+
+    def get_warehouse_out(self, warehouse: str) -> List[tuple[str, str, str, str]]:
+        return self.warehouse_out.get(warehouse, [])
+
+    def get_restaurant_in(self, restaurant: str) -> List[tuple[str, str, str, str]]:
+        return self.restaurant_in.get(restaurant, [])
+
+    def get_vehicle_supply(self, vehicle: tuple[str, str]) -> List[tuple[str, str, str, str]]:
+        return self.vehicle_supply.get(vehicle, [])
+
+    def get_vehicle_distribution(self, vehicle: tuple[str, str]) -> List[tuple[str, str, str, str]]:
+        return self.vehicle_distribution.get(vehicle, [])
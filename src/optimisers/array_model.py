@@ -0,0 +1,314 @@
+import logging
+import numpy as np
+from optimisers.solvers import SolverConfig
+from optimisers.warm_start import WarmStartMapper
+import os
+from pulp import LpAffineExpression, LpMaximize, LpSolutionIntegerFeasible, LpSolutionNoSolutionFound, LpStatusNotSolved, PULP_CBC_CMD, PulpSolverError
+import subprocess
+import tempfile
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+class ArrayModel:
+    '''
+    A linear model held as arrays rather than PuLP expressions.
+    The constraint matrix is stored in CSR form (indptr, indices, data) with one sense ('L', 'G' or 'E')
+    and right-hand side per row. All columns are non-negative, integer columns are flagged in `integer`.
+    '''
+    MPS_CHUNK_SIZE = 100000
+    FEASIBILITY_TOLERANCE = 1e-6
+
+    def __init__(self,
+                 objective: np.ndarray,
+                 indptr: np.ndarray,
+                 indices: np.ndarray,
+                 data: np.ndarray,
+                 senses: np.ndarray,
+                 rhs: np.ndarray,
+                 integer: np.ndarray,
+                 sense: int = 1,
+                 objective_constant: float = 0.0):
+        self.objective = objective
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.senses = senses
+        self.rhs = rhs
+        self.integer = integer
+        self.sense = sense
+        self.objective_constant = objective_constant
+        self.fixed_columns = np.array([], dtype=np.int64)
+        self.fixed_values = np.array([], dtype=float)
+        # an MPS file already written for this model, e.g. by the model cache, is solved as is
+        self.mps_file: str = None
+
+    @property
+    def n_columns(self) -> int:
+        return len(self.objective)
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.rhs)
+
+    @property
+    def n_nonzeros(self) -> int:
+        return len(self.data)
+
+    def fix_columns(self, columns: np.ndarray, values: np.ndarray):
+        '''
+        Fixes the given columns to the given values, written as FX bounds in the MPS file.
+        '''
+        self.fixed_columns = np.asarray(columns, dtype=np.int64)
+        self.fixed_values = np.asarray(values, dtype=float)
+
+    def get_row_ids(self) -> np.ndarray:
+        return np.repeat(np.arange(self.n_rows), np.diff(self.indptr))
+
+    def is_feasible(self, values: np.ndarray) -> bool:
+        row_values = np.bincount(self.get_row_ids(), weights=self.data * values[self.indices], minlength=self.n_rows)
+        violation = np.where(self.senses == 'L', row_values - self.rhs,
+                             np.where(self.senses == 'G', self.rhs - row_values, np.abs(row_values - self.rhs)))
+        tolerance = self.FEASIBILITY_TOLERANCE * np.maximum(np.abs(self.rhs), 1.0)
+        return bool((violation <= tolerance).all() and (values >= -self.FEASIBILITY_TOLERANCE).all())
+
+    def get_objective_value(self, values: np.ndarray) -> float:
+        return float(self.objective @ values) + self.objective_constant
+
+    def write_mps(self, filename: str):
+        '''
+        Streams the model to a free format MPS file, writing the columns section in chunks straight from the arrays.
+        '''
+        row_names = np.array([f"R{i}" for i in range(self.n_rows)] + ["OBJ"])
+        # the objective is written as an extra row so every column appears in the COLUMNS section
+        columns = np.concatenate([self.indices, np.arange(self.n_columns)])
+        rows = np.concatenate([self.get_row_ids(), np.full(self.n_columns, self.n_rows)])
+        values = np.concatenate([self.data, self.objective])
+        order = np.argsort(columns, kind='stable')
+        columns, rows, values = columns[order], rows[order], values[order]
+
+        with open(filename, 'w') as f:
+            f.write("NAME          SupplyChain\nROWS\n N  OBJ\n")
+            for start in range(0, self.n_rows, self.MPS_CHUNK_SIZE):
+                f.write(''.join(f" {sense}  R{i}\n" for i, sense in enumerate(self.senses[start:start + self.MPS_CHUNK_SIZE].tolist(), start)))
+
+            f.write("COLUMNS\n")
+            integer_starts = np.flatnonzero(np.diff(np.concatenate([[False], self.integer, [False]]).astype(np.int8)))
+            block_boundaries = np.searchsorted(columns, integer_starts)
+            block_starts = np.concatenate([[0], block_boundaries])
+            block_ends = np.concatenate([block_boundaries, [len(columns)]])
+            for block, (block_start, block_end) in enumerate(zip(block_starts, block_ends)):
+                if block % 2 == 1:
+                    f.write("    MARKER    'MARKER'    'INTORG'\n")
+                for start in range(block_start, block_end, self.MPS_CHUNK_SIZE):
+                    end = min(start + self.MPS_CHUNK_SIZE, block_end)
+                    f.write(''.join(f"    C{column}  {row_name}  {value:.12g}\n" for column, row_name, value in zip(columns[start:end].tolist(), row_names[rows[start:end]].tolist(), values[start:end].tolist())))
+                if block % 2 == 1:
+                    f.write("    MARKER    'MARKER'    'INTEND'\n")
+
+            f.write("RHS\n")
+            for start in range(0, self.n_rows, self.MPS_CHUNK_SIZE):
+                f.write(''.join(f"    RHS  R{i}  {value:.12g}\n" for i, value in enumerate(self.rhs[start:start + self.MPS_CHUNK_SIZE].tolist(), start) if value != 0))
+
+            # integer columns without bounds are assumed binary by COIN, so write their lower bound explicitly
+            f.write("BOUNDS\n")
+            free_integer = self.integer.copy()
+            free_integer[self.fixed_columns] = False
+            f.write(''.join(f" LO BND  C{i}  0\n" for i in np.flatnonzero(free_integer).tolist()))
+            f.write(''.join(f" FX BND  C{i}  {value:.12g}\n" for i, value in zip(self.fixed_columns.tolist(), self.fixed_values.tolist())))
+            f.write("ENDATA\n")
+
+    def read_solution(self, filename: str) -> np.ndarray:
+        values = np.zeros(self.n_columns)
+        with open(filename) as f:
+            f.readline()
+            for line in f:
+                line = line.split()
+                if len(line) < 3:
+                    break
+                if line[0] == "**":
+                    line = line[1:]
+                if line[1][0] == 'C':
+                    values[int(line[1][1:])] = float(line[2])
+        return values
+
+    def write_mip_start(self, filename: str, initial_values: np.ndarray):
+        '''
+        Writes the initial values in the CBC solution file format, which CBC reads as a MIP start.
+        '''
+        with open(filename, 'w') as f:
+            f.write("Stopped on time - objective value 0\n")
+            f.write(''.join(f"{i:>7} C{i} {value:>15} {0:>23}\n" for i, value in enumerate(initial_values.tolist())))
+
+    def solve(self, solver_config: SolverConfig = None, initial_values: np.ndarray = None, mip: bool = True):
+        '''
+        Solves the model with the CBC binary bundled with PuLP and the configured options, starting from the initial values if given.
+        With mip set to False the integer columns are relaxed and only the LP is solved.
+        Returns the PuLP status, the PuLP solution status, the column values and the best bound if CBC stopped early.
+        '''
+        solver_config = solver_config or SolverConfig()
+        solver = PULP_CBC_CMD()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            solution_file = os.path.join(tmp_dir, "model.sol")
+            log_file = os.path.join(tmp_dir, "cbc.log")
+            # the cached file may have been evicted by another planner sharing the cache since it was loaded
+            if self.mps_file and not len(self.fixed_columns) and os.path.exists(self.mps_file):
+                mps_file = self.mps_file
+            else:
+                mps_file = os.path.join(tmp_dir, "model.mps")
+                self.write_mps(mps_file)
+
+            args = [solver.path, mps_file]
+            if self.sense == LpMaximize:
+                args.append("max")
+            if initial_values is not None:
+                start_file = os.path.join(tmp_dir, "model.mst")
+                self.write_mip_start(start_file, initial_values)
+                args.extend(["mips", start_file])
+            args.extend(solver_config.get_cbc_args())
+            args.extend(["branch" if mip and self.integer.any() else "initialSolve", "printingOptions", "all", "solution", solution_file])
+            with open(log_file, 'w') as pipe:
+                result = subprocess.run(args, stdout=pipe, stderr=pipe)
+            if result.returncode != 0 or not os.path.exists(solution_file):
+                raise PulpSolverError(f"Pulp: Error while executing {solver.path}")
+
+            status, sol_status = solver.get_status(solution_file)
+            values = self.read_solution(solution_file)
+            # CBC stopped on its time limit can write out a node's solution instead of its incumbent
+            if sol_status == LpSolutionIntegerFeasible and not self.is_feasible(values):
+                logger.warning("CBC stopped with a solution that breaks the constraints, discarding it.")
+                status, sol_status = LpStatusNotSolved, LpSolutionNoSolutionFound
+            bound = solver_config.read_cbc_bound(log_file)
+            if bound is not None:
+                # CBC reports the bound without the objective's constant term
+                bound += self.objective_constant
+            if initial_values is not None:
+                WarmStartMapper.log_solver_start(log_file)
+            solver_config.echo_log(log_file)
+        return status, sol_status, values, bound
+
+
+class ArrayModelBuilder:
+    '''
+    Builds the constraint matrix of an ArrayModel from the candidate arcs of an optimiser, the objective
+    coefficients come from the ObjectiveCompiler. Supply arcs are columns 0..S-1 and distribution arcs are columns S..S+D-1.
+    '''
+    def __init__(self, optimiser):
+        self.optimiser = optimiser
+        self.supply_arcs = optimiser.supply_arcs
+        self.distribution_arcs = optimiser.distribution_arcs
+        self.n_supply = len(self.supply_arcs)
+        self.n_distribution = len(self.distribution_arcs)
+
+    def index_sites(self):
+        '''
+        Maps every arc end, vehicle and site limit to array positions. Only building needs them, a model loaded from the cache does not.
+        '''
+        optimiser = self.optimiser
+        vendor_index = {v.name: i for i, v in enumerate(optimiser.vendors)}
+        warehouse_index = {w.name: i for i, w in enumerate(optimiser.warehouses)}
+        restaurant_index = {r.name: i for i, r in enumerate(optimiser.restaurants)}
+        vehicle_index = {(ve.company, ve.name): i for i, ve in enumerate(optimiser.vehicles)}
+
+        self.supply_vendor = self.get_arc_index(self.supply_arcs, 0, vendor_index)
+        self.supply_warehouse = self.get_arc_index(self.supply_arcs, 1, warehouse_index)
+        self.supply_vehicle = np.fromiter((vehicle_index[(arc[2], arc[3])] for arc in self.supply_arcs), dtype=np.int64, count=self.n_supply)
+
+        self.distribution_warehouse = self.get_arc_index(self.distribution_arcs, 0, warehouse_index)
+        self.distribution_restaurant = self.get_arc_index(self.distribution_arcs, 1, restaurant_index)
+        self.distribution_vehicle = np.fromiter((vehicle_index[(arc[2], arc[3])] for arc in self.distribution_arcs), dtype=np.int64, count=self.n_distribution)
+
+        self.vendor_capacity = np.array([v.capacity for v in optimiser.vendors], dtype=float)
+        self.warehouse_capacity = np.array([w.inventory_capacity for w in optimiser.warehouses], dtype=float)
+        self.restaurant_demand = np.array([r.restaurant_demand for r in optimiser.restaurants], dtype=float)
+        self.vehicle_capacity = np.array([ve.capacity for ve in optimiser.vehicles], dtype=float)
+        self.vehicle_number_available = np.array([ve.number_available for ve in optimiser.vehicles], dtype=float)
+
+    def get_restaurant_rows(self) -> np.ndarray:
+        '''
+        Rows of the restaurant demand constraints, after the vendor limit and the two warehouse blocks built first.
+        '''
+        optimiser = self.optimiser
+        start = len(optimiser.vendors) + 2 * len(optimiser.warehouses)
+        return np.arange(start, start + len(optimiser.restaurants))
+
+    def get_arc_index(self, arcs: List[tuple], position: int, site_index: dict[str, int]) -> np.ndarray:
+        return np.fromiter((site_index[arc[position]] for arc in arcs), dtype=np.int64, count=len(arcs))
+
+    def build(self,
+              supply_objective: np.ndarray,
+              distribution_objective: np.ndarray,
+              restaurant_demand_sense: str = 'G',
+              sense: int = 1,
+              objective_constant: float = 0.0) -> ArrayModel:
+        '''
+        Builds the same constraint families as the PuLP path, one block of rows at a time in COO form, then converts to CSR.
+        '''
+        self.index_sites()
+        supply_columns = np.arange(self.n_supply)
+        distribution_columns = np.arange(self.n_supply, self.n_supply + self.n_distribution)
+        n_vendors, n_warehouses, n_restaurants = len(self.vendor_capacity), len(self.warehouse_capacity), len(self.restaurant_demand)
+        blocks = []
+        senses = []
+        rhs = []
+        row_offset = [0]
+
+        def add_block(rows, columns, values, n_rows, sense, block_rhs):
+            blocks.append((rows + row_offset[0], columns, values))
+            senses.append(np.full(n_rows, sense))
+            rhs.append(np.asarray(block_rhs, dtype=float))
+            row_offset[0] += n_rows
+
+        # vendor limit
+        add_block(self.supply_vendor, supply_columns, np.ones(self.n_supply), n_vendors, 'L', self.vendor_capacity)
+        # warehouse capacity
+        add_block(self.supply_warehouse, supply_columns, np.ones(self.n_supply), n_warehouses, 'L', self.warehouse_capacity)
+        # warehouse supply, distribution out of a warehouse cannot exceed supply into it
+        add_block(np.concatenate([self.distribution_warehouse, self.supply_warehouse]),
+                  np.concatenate([distribution_columns, supply_columns]),
+                  np.concatenate([np.ones(self.n_distribution), -np.ones(self.n_supply)]),
+                  n_warehouses, 'L', np.zeros(n_warehouses))
+        # restaurant demand
+        add_block(self.distribution_restaurant, distribution_columns, np.ones(self.n_distribution), n_restaurants, restaurant_demand_sense, self.restaurant_demand)
+        # vendor and warehouse logistics, one row per route
+        supply_routes, supply_route_ids = np.unique(self.supply_vendor * n_warehouses + self.supply_warehouse, return_inverse=True)
+        add_block(supply_route_ids.ravel(), supply_columns, 1 - self.vehicle_capacity[self.supply_vehicle], len(supply_routes), 'L', np.zeros(len(supply_routes)))
+        distribution_routes, distribution_route_ids = np.unique(self.distribution_warehouse * n_restaurants + self.distribution_restaurant, return_inverse=True)
+        add_block(distribution_route_ids.ravel(), distribution_columns, 1 - self.vehicle_capacity[self.distribution_vehicle], len(distribution_routes), 'L', np.zeros(len(distribution_routes)))
+        # vehicle availability, only for vehicles with arcs on the stage
+        supply_vehicles, supply_vehicle_ids = np.unique(self.supply_vehicle, return_inverse=True)
+        add_block(supply_vehicle_ids.ravel(), supply_columns, np.ones(self.n_supply), len(supply_vehicles), 'G', self.vehicle_number_available[supply_vehicles])
+        distribution_vehicles, distribution_vehicle_ids = np.unique(self.distribution_vehicle, return_inverse=True)
+        add_block(distribution_vehicle_ids.ravel(), distribution_columns, np.ones(self.n_distribution), len(distribution_vehicles), 'G', self.vehicle_number_available[distribution_vehicles])
+
+        rows = np.concatenate([block[0] for block in blocks]).astype(np.int64)
+        columns = np.concatenate([block[1] for block in blocks]).astype(np.int64)
+        values = np.concatenate([block[2] for block in blocks]).astype(float)
+        rhs = np.concatenate(rhs)
+        order = np.argsort(rows, kind='stable')
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(rhs)))])
+
+        return ArrayModel(objective=np.concatenate([supply_objective, distribution_objective]).astype(float),
+                          indptr=indptr,
+                          indices=columns[order],
+                          data=values[order],
+                          senses=np.concatenate(senses),
+                          rhs=rhs,
+                          integer=np.concatenate([np.zeros(self.n_supply, dtype=bool), np.ones(self.n_distribution, dtype=bool)]),
+                          sense=sense,
+                          objective_constant=objective_constant)
+
+    def get_initial_values(self) -> np.ndarray:
+        variables = [self.optimiser.supply[arc] for arc in self.supply_arcs] + [self.optimiser.distribution[arc] for arc in self.distribution_arcs]
+        return np.array([variable.varValue or 0 for variable in variables], dtype=float)
+
+    def assign_solution(self, model: ArrayModel, status: int, sol_status: int, values: np.ndarray):
+        '''
+        Writes the array solution back onto the optimiser's PuLP variables and problem so the outputters work unchanged.
+        '''
+        problem = self.optimiser.problem
+        variables = [self.optimiser.supply[arc] for arc in self.supply_arcs] + [self.optimiser.distribution[arc] for arc in self.distribution_arcs]
+        for variable, value in zip(variables, values.tolist()):
+            variable.varValue = value
+        problem.objective = LpAffineExpression(zip(variables, model.objective.tolist()), constant=model.objective_constant)
+        problem.assignStatus(status, sol_status)
@@ -0,0 +1,297 @@
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from data_objects.flows import SupplierWarehouseDistance, WarehouseRestaurantDistance
+from data_objects.sites import Vendor, Warehouse, Restaurant
+from data_objects.vehicles import Vehicle
+import logging
+from mapper import RouteCostMapper
+from optimisers.arcs import CandidateArcBuilder
+import time
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+class MaxFlow:
+    '''
+    Dinic's maximum flow over an edge list, each edge stored next to its reverse so edge i ^ 1 is the reverse of edge i.
+    '''
+    TOLERANCE = 1e-9
+
+    def __init__(self, n_nodes: int):
+        self.n_nodes = n_nodes
+        self.adjacency = [[] for _ in range(n_nodes)]
+        self.targets = []
+        self.capacities = []
+
+    def add_edge(self, source: int, target: int, capacity: float) -> int:
+        edge = len(self.targets)
+        self.adjacency[source].append(edge)
+        self.targets.append(target)
+        self.capacities.append(float(capacity))
+        self.adjacency[target].append(edge + 1)
+        self.targets.append(source)
+        self.capacities.append(0.0)
+        return edge
+
+    def get_levels(self, source: int, sink: int) -> List[int]:
+        levels = [-1] * self.n_nodes
+        levels[source] = 0
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for edge in self.adjacency[node]:
+                target = self.targets[edge]
+                if levels[target] < 0 and self.capacities[edge] > self.TOLERANCE:
+                    levels[target] = levels[node] + 1
+                    queue.append(target)
+        return levels
+
+    def push(self, source: int, sink: int, levels: List[int], next_edge: List[int]) -> float:
+        '''
+        Finds one augmenting path in the level graph without recursion and pushes its bottleneck along it.
+        '''
+        path = []
+        node = source
+        while node != sink:
+            while next_edge[node] < len(self.adjacency[node]):
+                edge = self.adjacency[node][next_edge[node]]
+                target = self.targets[edge]
+                if self.capacities[edge] > self.TOLERANCE and levels[target] == levels[node] + 1:
+                    break
+                next_edge[node] += 1
+            else:
+                # a dead end, never look at it again in this phase
+                if node == source:
+                    return 0.0
+                levels[node] = -1
+                node = self.targets[path.pop() ^ 1]
+                continue
+            path.append(edge)
+            node = target
+        amount = min(self.capacities[edge] for edge in path)
+        for edge in path:
+            self.capacities[edge] -= amount
+            self.capacities[edge ^ 1] += amount
+        return amount
+
+    def solve(self, source: int, sink: int) -> float:
+        flow = 0.0
+        while True:
+            levels = self.get_levels(source, sink)
+            if levels[sink] < 0:
+                return flow
+            next_edge = [0] * self.n_nodes
+            while True:
+                amount = self.push(source, sink, levels, next_edge)
+                if amount <= self.TOLERANCE:
+                    break
+                flow += amount
+
+    def get_reachable(self, source: int) -> set[int]:
+        '''
+        The source side of a minimum cut, once solved.
+        '''
+        reachable = {source}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for edge in self.adjacency[node]:
+                target = self.targets[edge]
+                if target not in reachable and self.capacities[edge] > self.TOLERANCE:
+                    reachable.add(target)
+                    queue.append(target)
+        return reachable
+
+
+@dataclass
+class FeasibilityReport:
+    # False only when the strict model is certainly infeasible, True means it can be feasible
+    feasible: bool
+    max_flow: float
+    demand: float
+    # the vendors and warehouses on the minimum cut, the restaurants whose demand cannot be met and the vehicles that cannot be used enough
+    bottlenecks: List[str] = field(default_factory=list)
+    # input problems that do not make the model infeasible but would otherwise go unnoticed
+    warnings: List[str] = field(default_factory=list)
+    wall_time: float = 0.0
+
+    @property
+    def shortfall(self) -> float:
+        return max(self.demand - self.max_flow, 0.0)
+
+
+class FeasibilityAnalyser:
+    '''
+    Checks before the model is built whether the cost minimising model can be feasible, with a maximum flow from the vendors
+    through the warehouses to the restaurants. Vendor capacities, warehouse inventory capacities and restaurant demands
+    bound the flow, and a route carries flow if it has a distance and at least one vehicle. The flow relaxes the integer
+    and vehicle constraints, so a shortfall proves the model infeasible, and a full flow only that it can be feasible.
+    Vehicles that must carry more than can reach their routes are checked separately.
+    '''
+    TOLERANCE = 1e-6
+    # names listed per warning, the rest are only counted
+    MAX_NAMES = 10
+
+    def __init__(self,
+                 vendors: List[Vendor],
+                 warehouses: List[Warehouse],
+                 restaurants: List[Restaurant],
+                 vehicles: List[Vehicle],
+                 supplier_warehouse_distances: List[SupplierWarehouseDistance],
+                 warehouse_restaurant_distances: List[WarehouseRestaurantDistance]):
+        self.vendors = vendors
+        self.warehouses = warehouses
+        self.restaurants = restaurants
+        self.vehicles = vehicles
+        self.supplier_warehouse_mapper = RouteCostMapper(supplier_warehouse_distances)
+        self.warehouse_restaurant_mapper = RouteCostMapper(warehouse_restaurant_distances)
+
+    def analyse(self) -> FeasibilityReport:
+        start_time = time.time()
+        warnings = self.get_input_warnings()
+        vendor_warehouses, supply_vehicle_ends = self.get_stage(self.supplier_warehouse_mapper, self.vendors, self.warehouses, warehouse_position=1)
+        restaurant_warehouses, distribution_vehicle_ends = self.get_stage(self.warehouse_restaurant_mapper, self.warehouses, self.restaurants, warehouse_position=0)
+        # sites with the same warehouses share a hub node, so the network has an edge per hub and warehouse rather than per route
+        vendor_hubs = self.get_hubs(vendor_warehouses)
+        restaurant_hubs = self.get_hubs(restaurant_warehouses)
+
+        # nodes are the source, vendors, warehouse inflows, warehouse outflows, restaurants, hubs and the sink, in that order
+        n_vendors, n_warehouses, n_restaurants = len(self.vendors), len(self.warehouses), len(self.restaurants)
+        vendor_node = {v.name: 1 + i for i, v in enumerate(self.vendors)}
+        warehouse_in_node = {w.name: 1 + n_vendors + i for i, w in enumerate(self.warehouses)}
+        warehouse_out_node = {w.name: 1 + n_vendors + n_warehouses + i for i, w in enumerate(self.warehouses)}
+        restaurant_node = {r.name: 1 + n_vendors + 2 * n_warehouses + i for i, r in enumerate(self.restaurants)}
+        hub_offset = 1 + n_vendors + 2 * n_warehouses + n_restaurants
+        source, sink = 0, hub_offset + len(vendor_hubs) + len(restaurant_hubs)
+        network = MaxFlow(sink + 1)
+        unbounded = sum(max(float(v.capacity), 0.0) for v in self.vendors) + 1
+
+        for v in self.vendors:
+            network.add_edge(source, vendor_node[v.name], max(float(v.capacity), 0.0))
+        for w in self.warehouses:
+            network.add_edge(warehouse_in_node[w.name], warehouse_out_node[w.name], max(float(w.inventory_capacity), 0.0))
+        for i, (warehouses, vendors) in enumerate(vendor_hubs.items()):
+            for v in vendors:
+                network.add_edge(vendor_node[v], hub_offset + i, unbounded)
+            for w in warehouses:
+                network.add_edge(hub_offset + i, warehouse_in_node[w], unbounded)
+        hub_offset += len(vendor_hubs)
+        for i, (warehouses, restaurants) in enumerate(restaurant_hubs.items()):
+            for w in warehouses:
+                network.add_edge(warehouse_out_node[w], hub_offset + i, unbounded)
+            for r in restaurants:
+                network.add_edge(hub_offset + i, restaurant_node[r], unbounded)
+        demand_edges = {r.name: network.add_edge(restaurant_node[r.name], sink, max(float(r.restaurant_demand), 0.0)) for r in self.restaurants}
+
+        max_flow = network.solve(source, sink)
+        demand = sum(max(float(r.restaurant_demand), 0.0) for r in self.restaurants)
+        bottlenecks = []
+        if max_flow < demand - self.TOLERANCE:
+            reachable = network.get_reachable(source)
+            bottlenecks.extend(f"vendor {v.name}" for v in self.vendors if vendor_node[v.name] not in reachable)
+            bottlenecks.extend(f"warehouse {w.name}" for w in self.warehouses if warehouse_in_node[w.name] in reachable and warehouse_out_node[w.name] not in reachable)
+            bottlenecks.extend(f"restaurant {r.name} short by {network.capacities[demand_edges[r.name]]:.1f}" for r in self.restaurants
+                               if network.capacities[demand_edges[r.name]] > self.TOLERANCE)
+        vehicle_bottlenecks = self.get_vehicle_bottlenecks(supply_vehicle_ends, distribution_vehicle_ends)
+        bottlenecks.extend(vehicle_bottlenecks)
+
+        report = FeasibilityReport(feasible=max_flow >= demand - self.TOLERANCE and not vehicle_bottlenecks,
+                                   max_flow=max_flow,
+                                   demand=demand,
+                                   bottlenecks=bottlenecks,
+                                   warnings=warnings,
+                                   wall_time=time.time() - start_time)
+        for warning in warnings:
+            logger.warning(warning)
+        if report.feasible:
+            logger.info(f"Feasibility check passed in {report.wall_time * 1000:.0f} ms, the network can carry all {demand:.1f} demand.")
+        else:
+            logger.warning(f"Feasibility check failed in {report.wall_time * 1000:.0f} ms, the network carries {max_flow:.1f} of {demand:.1f} demand. "
+                           f"{len(bottlenecks)} bottlenecks, e.g. {', '.join(bottlenecks[:self.MAX_NAMES])}.")
+        return report
+
+    def get_stage(self, route_mapper: RouteCostMapper, sources: list, targets: list, warehouse_position: int):
+        '''
+        Walks the routes CandidateArcBuilder would build arcs for, those between known sites that at least one vehicle serves.
+        Returns the warehouses each vendor or restaurant has a route with, and the sources and targets of the routes of
+        each set of vehicles. The vehicles are looked up once per pair of locations.
+        '''
+        builder = CandidateArcBuilder(self.vehicles, route_mapper)
+        source_locations = {s.name: s.location for s in sources}
+        target_locations = {t.name: t.location for t in targets}
+        location_vehicles = {}
+        site_warehouses = defaultdict(list)
+        vehicle_ends = defaultdict(lambda: (set(), set()))
+        for route in route_mapper.distance_mapping:
+            source, target = route
+            if source not in source_locations or target not in target_locations:
+                continue
+            locations = (source_locations[source], target_locations[target])
+            if locations not in location_vehicles:
+                location_vehicles[locations] = tuple((ve.company, ve.name) for ve in builder.get_route_vehicles(*locations))
+            route_vehicles = location_vehicles[locations]
+            if not route_vehicles:
+                continue
+            site_warehouses[route[1 - warehouse_position]].append(route[warehouse_position])
+            sources_served, targets_served = vehicle_ends[route_vehicles]
+            sources_served.add(source)
+            targets_served.add(target)
+        return site_warehouses, vehicle_ends
+
+    def get_hubs(self, site_warehouses: dict[str, List[str]]) -> dict[frozenset, List[str]]:
+        hubs = defaultdict(list)
+        for site, warehouses in site_warehouses.items():
+            hubs[frozenset(warehouses)].append(site)
+        return hubs
+
+    def get_vehicle_bottlenecks(self, supply_vehicle_ends: dict, distribution_vehicle_ends: dict) -> List[str]:
+        '''
+        Every vehicle with arcs must carry at least its number available on each stage. On supply it can carry no more than
+        the vendors, or the warehouses, at the ends of its routes can hold, on distribution no more than the warehouses.
+        '''
+        vendor_capacity = {v.name: max(float(v.capacity), 0.0) for v in self.vendors}
+        warehouse_capacity = {w.name: max(float(w.inventory_capacity), 0.0) for w in self.warehouses}
+        vehicle_lookup = {(ve.company, ve.name): ve for ve in self.vehicles}
+        bottlenecks = []
+        for stage, vehicle_ends in (('supply', supply_vehicle_ends), ('distribution', distribution_vehicle_ends)):
+            sources, targets = defaultdict(set), defaultdict(set)
+            for route_vehicles, (sources_served, targets_served) in vehicle_ends.items():
+                for key in route_vehicles:
+                    sources[key].update(sources_served)
+                    targets[key].update(targets_served)
+            for key in sources:
+                if stage == 'supply':
+                    reach = min(sum(vendor_capacity[v] for v in sources[key]), sum(warehouse_capacity[w] for w in targets[key]))
+                else:
+                    reach = sum(warehouse_capacity[w] for w in sources[key])
+                ve = vehicle_lookup[key]
+                if ve.number_available > reach + self.TOLERANCE:
+                    bottlenecks.append(f"vehicle {ve.company} {ve.name} must carry {ve.number_available} on {stage} but at most {reach:.1f} can reach its routes")
+        return bottlenecks
+
+    def get_input_warnings(self) -> List[str]:
+        '''
+        Routes are sparse, so a pair of sites without a distance is only a route that does not exist. Sites without any
+        route and distances for unknown sites are reported, found in a single pass over the routes.
+        '''
+        warnings = []
+        for name, route_mapper, (source_label, sources), (target_label, targets) in (('vendor to warehouse', self.supplier_warehouse_mapper, ('vendors', self.vendors), ('warehouses', self.warehouses)),
+                                                                                     ('warehouse to restaurant', self.warehouse_restaurant_mapper, ('warehouses', self.warehouses), ('restaurants', self.restaurants))):
+            source_names = {s.name for s in sources}
+            target_names = {t.name for t in targets}
+            routed_sources = {route[0] for route in route_mapper.distance_mapping}
+            routed_targets = {route[1] for route in route_mapper.distance_mapping}
+            for label, sites, routed in ((source_label, sources, routed_sources), (target_label, targets, routed_targets)):
+                unrouted = [(site.name,) for site in sites if site.name not in routed]
+                if unrouted:
+                    warnings.append(f"{len(unrouted)} {label} have no {name} route, e.g. {self.get_names(unrouted)}.")
+            unknown = [route for route in route_mapper.distance_mapping if route[0] not in source_names or route[1] not in target_names]
+            if unknown:
+                warnings.append(f"{len(unknown)} {name} distances are for unknown sites, e.g. {self.get_names(unknown)}.")
+        unavailable = [(ve.company, ve.name) for ve in self.vehicles if ve.number_available <= 0]
+        if unavailable:
+            warnings.append(f"{len(unavailable)} vehicles have none available but can still be used, {self.get_names(unavailable)}.")
+        return warnings
+
+    def get_names(self, keys: list) -> str:
+        return ', '.join(' '.join(key) for key in keys[:self.MAX_NAMES])
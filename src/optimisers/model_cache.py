@@ -0,0 +1,119 @@
+from dataclasses import astuple
+import hashlib
+import logging
+import numpy as np
+from optimisers.array_model import ArrayModel
+from optimisers.objective import ObjectiveCompiler
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+class ModelCache:
+    '''
+    On-disk cache of built array models, keyed by a hash of every input to the model and the objective parameters.
+    Each entry is the model's arrays and objective components in an .npz file plus the model written as MPS, so a hit
+    goes straight to the solver. Entries are evicted least recently used first once the cache is over its size limit.
+    '''
+    # bump whenever the way models are built changes, so entries built by older code are not reused
+    VERSION = 2
+    MODEL_ARRAYS = ('objective', 'indptr', 'indices', 'data', 'senses', 'rhs', 'integer')
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        self.cache_dir = cache_dir or os.getenv('MODEL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'supply_chain_models'))
+        self.max_bytes = max_bytes or int(os.getenv('MODEL_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def get_key(self, optimiser, **objective_params) -> str:
+        '''
+        Hashes the inputs in order, since the order of the sites and routes sets the order of the arcs and so of the columns.
+        '''
+        digest = hashlib.sha256()
+        digest.update(repr((self.VERSION, type(optimiser).__name__, sorted(objective_params.items()))).encode())
+        for rows in (optimiser.vendors, optimiser.warehouses, optimiser.restaurants, optimiser.vehicles):
+            for row in rows:
+                digest.update(repr(astuple(row)).encode())
+        for mapper in (optimiser.supplier_warehouse_mapper, optimiser.warehouse_restaurant_mapper):
+            for route, distance in mapper.distance_mapping.items():
+                digest.update(repr((route, distance)).encode())
+        return digest.hexdigest()
+
+    def get_paths(self, key: str) -> tuple[str, str]:
+        return os.path.join(self.cache_dir, f"{key}.npz"), os.path.join(self.cache_dir, f"{key}.mps")
+
+    def load(self, key: str, optimiser) -> tuple[ArrayModel, ObjectiveCompiler]:
+        '''
+        Returns the cached model and an objective compiler for the optimiser's arcs, or None on a miss.
+        '''
+        arrays_file, mps_file = self.get_paths(key)
+        if not (os.path.exists(arrays_file) and os.path.exists(mps_file)):
+            self.misses += 1
+            return None
+
+        with np.load(arrays_file) as arrays:
+            model = ArrayModel(*(arrays[name] for name in self.MODEL_ARRAYS),
+                               sense=int(arrays['sense']),
+                               objective_constant=float(arrays['objective_constant']))
+            compiler = ObjectiveCompiler(optimiser, arrays['supply_components'], arrays['distribution_components'])
+        model.mps_file = mps_file
+        # the modification time is the last use, which is what eviction goes by
+        os.utime(arrays_file)
+        os.utime(mps_file)
+        self.hits += 1
+        self.bytes_saved += os.path.getsize(arrays_file) + os.path.getsize(mps_file)
+        logger.info(f"Loaded model {key[:12]} from the cache.")
+        return model, compiler
+
+    def store(self, key: str, model: ArrayModel, compiler: ObjectiveCompiler):
+        arrays_file, mps_file = self.get_paths(key)
+        # write to temporary names first so a crash never leaves a half written entry behind
+        with tempfile.TemporaryDirectory(dir=self.cache_dir) as tmp_dir:
+            tmp_arrays_file = os.path.join(tmp_dir, "model.npz")
+            tmp_mps_file = os.path.join(tmp_dir, "model.mps")
+            np.savez(tmp_arrays_file,
+                     **{name: getattr(model, name) for name in self.MODEL_ARRAYS},
+                     sense=model.sense,
+                     objective_constant=model.objective_constant,
+                     supply_components=compiler.supply_components,
+                     distribution_components=compiler.distribution_components)
+            model.write_mps(tmp_mps_file)
+            shutil.move(tmp_mps_file, mps_file)
+            shutil.move(tmp_arrays_file, arrays_file)
+        model.mps_file = mps_file
+        logger.info(f"Stored model {key[:12]} in the cache.")
+        self.evict(keep=key)
+
+    def evict(self, keep: str = None):
+        '''
+        Keeps the entry just stored even when it alone is over the size limit, since the model is about to be solved from it.
+        '''
+        entries = {}
+        for filename in os.listdir(self.cache_dir):
+            key, extension = os.path.splitext(filename)
+            if extension in ('.npz', '.mps'):
+                path = os.path.join(self.cache_dir, filename)
+                size, last_used = entries.get(key, (0, 0))
+                entries[key] = (size + os.path.getsize(path), max(last_used, os.path.getmtime(path)))
+
+        total_bytes = sum(size for size, last_used in entries.values())
+        for key in sorted(entries.keys() - {keep}, key=lambda key: entries[key][1]):
+            if total_bytes <= self.max_bytes:
+                break
+            for path in self.get_paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            total_bytes -= entries[key][0]
+            logger.info(f"Evicted model {key[:12]} from the cache.")
+
+    def report(self) -> dict:
+        lookups = self.hits + self.misses
+        report = {'hits': self.hits,
+                  'misses': self.misses,
+                  'hit_rate': self.hits / lookups if lookups else 0.0,
+                  'bytes_saved': self.bytes_saved}
+        logger.info(f"Model cache hit rate {report['hit_rate']:.0%} over {lookups} lookups, {report['bytes_saved']} bytes of built models reused.")
+        return report
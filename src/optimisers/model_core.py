@@ -0,0 +1,321 @@
+from data_objects.flows import SupplierWarehouseDistance, WarehouseRestaurantDistance
+from data_objects.vehicles import Vehicle
+import logging
+from mapper import RouteCostMapper, VehicleCostMapper, SupplierCostMapper, WarehouseCostMapper
+from optimisers.anytime import AnytimeSolver
+from optimisers.arcs import ArcIndex, CandidateArcBuilder
+from optimisers.array_model import ArrayModel, ArrayModelBuilder
+from optimisers.model_cache import ModelCache
+from optimisers.network_flow import NetworkFlowSolver
+from optimisers.objective import ObjectiveCompiler
+from optimisers.rounding import LPRoundingSolver
+from optimisers.solvers import SolverConfig, SolveStats
+from optimisers.spatial import NearestWarehouseSelector
+from optimisers.vehicle_classes import VehicleReducer
+from optimisers.warm_start import WarmStartMapper
+from output.output import Edge
+from pulp import LpConstraintGE, LpConstraintLE, LpProblem, LpVariable, lpSum, LpMinimize
+from data_objects.sites import Vendor, Warehouse, Restaurant
+import time
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+class SupplyChainModel:
+    '''
+    The arcs, variables and constraints both objectives share. A subclass sets the objective through get_objective_weights,
+    its sense and the sense of the restaurant demand constraints, 'G' to meet demand or 'L' to sell at most the demand.
+    '''
+    PROBLEM_NAME = "SupplyChainOptimization"
+    DESCRIPTION = "cost minimising"
+    SENSE = LpMinimize
+    RESTAURANT_DEMAND_SENSE = 'G'
+
+    def __init__(self,
+                 cost_co2_split,
+                 vendors: List[Vendor],
+                 warehouses: List[Warehouse],
+                 restaurants: List[Restaurant],
+                 vehicles: List[Vehicle],
+                 supplier_warehouse_distances: List[SupplierWarehouseDistance],
+                 warehouse_restaurant_distances: List[WarehouseRestaurantDistance],
+                 solver_config: SolverConfig = None,
+                 model_cache: ModelCache = None,
+                 reduce_vehicles: bool = False,
+                 nearest_warehouses: int = None):
+        self.cost_co2_split = cost_co2_split
+        self.solver_config = solver_config or SolverConfig()
+        self.model_cache = model_cache
+        self.reduce_vehicles = reduce_vehicles
+        self.nearest_warehouses = nearest_warehouses
+        self.vendors = vendors
+        self.warehouses = warehouses
+        self.restaurants = restaurants
+        self.vehicle_reducer = VehicleReducer(vehicles) if reduce_vehicles else None
+        if self.vehicle_reducer:
+            vehicles = self.vehicle_reducer.vehicle_classes
+        self.vehicles = vehicles
+        self.supplier_cost_mapper = SupplierCostMapper(vendors)
+        self.warehouse_cost_mapper = WarehouseCostMapper(warehouses)
+        self.supplier_warehouse_mapper = RouteCostMapper(supplier_warehouse_distances)
+        self.warehouse_restaurant_mapper = RouteCostMapper(warehouse_restaurant_distances)
+        self.vehicle_mapper = VehicleCostMapper(vehicles)
+        self.problem = LpProblem(self.PROBLEM_NAME, self.SENSE)
+        self.vehicle_lookup = {(ve.company, ve.name): ve for ve in vehicles}
+        # arcs are the feasible (source, target, vehicle company, vehicle name) combinations for each stage
+        supply_routes, distribution_routes = None, None
+        if nearest_warehouses:
+            selector = NearestWarehouseSelector(warehouses, nearest_warehouses)
+            supply_routes = selector.select(self.supplier_warehouse_mapper, vendors, warehouse_position=1)
+            distribution_routes = selector.select(self.warehouse_restaurant_mapper, restaurants, warehouse_position=0)
+        self.supply_arcs = CandidateArcBuilder(vehicles, self.supplier_warehouse_mapper).build(vendors, warehouses, supply_routes)
+        self.distribution_arcs = CandidateArcBuilder(vehicles, self.warehouse_restaurant_mapper).build(warehouses, restaurants, distribution_routes)
+        self.arc_index = ArcIndex(self.supply_arcs, self.distribution_arcs)
+        # supply is the amount of supply from each supplier to each warehouse
+        self.supply = LpVariable.dicts("supply", self.supply_arcs, lowBound=0, cat='Continuous')
+        # distibution is the amount of chicken sent from each warehouse to each restaurant
+        self.distribution = LpVariable.dicts("distribution", self.distribution_arcs, lowBound=0, cat="Integer")
+        self.objective_compiler: ObjectiveCompiler = None
+        # the array model of the last array solve, kept so it can be re-solved without rebuilding
+        self.array_model: ArrayModel = None
+        self.warm_start = False
+        self.solve_stats: SolveStats = None
+        # constraints that can be updated in place are kept by site name
+        self.vendor_limit_constraints = {}
+        self.warehouse_capacity_constraints = {}
+        self.restaurant_demand_constraints = {}
+
+    @classmethod
+    def from_model(cls, model: 'SupplyChainModel') -> 'SupplyChainModel':
+        '''
+        Takes over the arcs, variables and constraints of a model with another objective instead of building them again.
+        Only the objective and the sense of the restaurant demand constraints are changed, on the PuLP problem and on the
+        array model, whichever was built. The two models share the problem, so the original should not be solved again.
+        '''
+        converted = cls.__new__(cls)
+        converted.__dict__.update(model.__dict__)
+        converted.warm_start = False
+        converted.solve_stats = None
+        converted.problem.name = cls.PROBLEM_NAME
+        converted.problem.sense = cls.SENSE
+        if converted.problem.constraints:
+            converted.problem.setObjective(converted.objective_compiler.compile(**converted.get_objective_weights()))
+            sense = LpConstraintGE if cls.RESTAURANT_DEMAND_SENSE == 'G' else LpConstraintLE
+            for constraint in converted.restaurant_demand_constraints.values():
+                constraint.sense = sense
+        if converted.array_model:
+            converted.set_array_objective(converted.array_model)
+        logger.info(f"Converted the built model to {cls.DESCRIPTION}.")
+        return converted
+
+    def get_objective_weights(self) -> dict[str, float]:
+        '''
+        Returns the keyword arguments of ObjectiveCompiler.compile for the objective.
+        '''
+        return {'cost_weight': self.cost_co2_split, 'co2_weight': 1 - self.cost_co2_split}
+
+    def get_supply_cost(self):
+        return lpSum(self.supply[arc] * self.supplier_cost_mapper.supplier_mapping[arc[0]] for arc in self.supply_arcs)
+
+    def get_supply_to_warehouse_cost(self):
+        return lpSum(self.supply[arc] * self.supplier_warehouse_mapper.distance_mapping[arc[0], arc[1]] * self.vehicle_mapper.cost_mapping[(arc[2], arc[3])] for arc in self.supply_arcs)
+
+    def get_warehouse_storage_cost(self):
+        return lpSum(self.supply[arc] * self.warehouse_cost_mapper.warehouse_mapping[arc[1]] for arc in self.supply_arcs)
+
+    def get_warehouse_to_restaurant_cost(self):
+        return lpSum(self.distribution[arc] * self.warehouse_restaurant_mapper.distance_mapping[arc[0], arc[1]] * self.vehicle_mapper.cost_mapping[(arc[2], arc[3])] for arc in self.distribution_arcs)
+
+    def get_supplier_co2_emissions_cost(self):
+        return lpSum(self.supply[arc] * self.supplier_cost_mapper.supplier_co2_mapping[arc[0]] for arc in self.supply_arcs)
+
+    def get_supply_to_warehouse_co2_emissions_cost(self):
+        return lpSum(self.supply[arc] * self.supplier_warehouse_mapper.distance_mapping[arc[0], arc[1]] * self.vehicle_mapper.co2_mapping[(arc[2], arc[3])] for arc in self.supply_arcs)
+
+    def get_warehouse_to_restaurant_co2_emissions_cost(self):
+        return lpSum(self.distribution[arc] * self.warehouse_restaurant_mapper.distance_mapping[arc[0], arc[1]] * self.vehicle_mapper.co2_mapping[(arc[2], arc[3])] for arc in self.distribution_arcs)
+
+    def add_vendor_constraints(self):
+        for v in self.vendors:
+            self.add_vendor_limit_constraint(v)
+
+    def add_warehouse_constraints(self):
+        for w in self.warehouses:
+            self.add_warehouse_capacity_constraint(w)
+            self.add_warehouse_supply_constraint(w)
+
+    def add_vendor_warehouse_constraints(self):
+        for route, arcs in self.arc_index.supply_routes.items():
+            self.add_vendor_logistics_constraint(arcs)
+
+    def add_restaurant_constraints(self):
+        for r in self.restaurants:
+            self.add_restaurant_demand_constraint(r)
+
+    def add_warehouse_restaurant_constraints(self):
+        for route, arcs in self.arc_index.distribution_routes.items():
+            self.add_warehouse_logistics_constraint(arcs)
+
+    def add_vehicle_constraints(self):
+        for ve in self.vehicles:
+            self.add_vehicle_number_availability_constraints_supplier_warehouse(ve)
+            self.add_vehicle_number_availability_constraints_warehouse_restaurant(ve)
+
+    def add_vendor_limit_constraint(self, vendor: Vendor):
+        constraint = lpSum(self.supply[arc] for arc in self.arc_index.get_vendor_out(vendor.name))  <= vendor.capacity
+        self.problem += constraint
+        self.vendor_limit_constraints[vendor.name] = constraint
+
+    def add_vendor_logistics_constraint(self, route_arcs: List[tuple[str, str, str, str]]):
+        '''
+        Constraint for each vendor and warehouse combination their supply must be below the associated logistics capacity.
+        '''
+        self.problem += lpSum(self.supply[arc] for arc in route_arcs) <= lpSum(self.supply[arc] * self.vehicle_lookup[(arc[2], arc[3])].capacity for arc in route_arcs)
+
+    def add_warehouse_capacity_constraint(self, warehouse: Warehouse):
+        constraint = lpSum(self.supply[arc] for arc in self.arc_index.get_warehouse_in(warehouse.name)) <= warehouse.inventory_capacity
+        self.problem += constraint
+        self.warehouse_capacity_constraints[warehouse.name] = constraint
+
+    def add_warehouse_supply_constraint(self, warehouse: Warehouse):
+        self.problem += lpSum(self.distribution[arc] for arc in self.arc_index.get_warehouse_out(warehouse.name)) <= lpSum(self.supply[arc] for arc in self.arc_index.get_warehouse_in(warehouse.name))
+
+    def add_warehouse_logistics_constraint(self, route_arcs: List[tuple[str, str, str, str]]):
+        self.problem += lpSum(self.distribution[arc] for arc in route_arcs) <= lpSum(self.distribution[arc] * self.vehicle_lookup[(arc[2], arc[3])].capacity for arc in route_arcs)
+
+    def add_restaurant_demand_constraint(self, restaurant: Restaurant):
+        inflow = lpSum(self.distribution[arc] for arc in self.arc_index.get_restaurant_in(restaurant.name))
+        constraint = inflow >= restaurant.restaurant_demand if self.RESTAURANT_DEMAND_SENSE == 'G' else inflow <= restaurant.restaurant_demand
+        self.problem += constraint
+        self.restaurant_demand_constraints[restaurant.name] = constraint
+
+    def add_restaurant_stock_constraint(self, restaurant: Restaurant):
+        self.problem += lpSum(self.distribution[arc] for arc in self.arc_index.get_restaurant_in(restaurant.name)) <= restaurant.restaurant_demand * 3
+
+    def add_vehicle_number_availability_constraints_supplier_warehouse(self, ve: Vehicle):
+        '''
+        Constraint to ensure the number of vehicles used between suppliers and warehouses is less than or equal to the number of vehicles available.
+        Vehicles without any supply arcs are skipped, as the constraint would have no terms.
+        '''
+        vehicle_arcs = self.arc_index.get_vehicle_supply((ve.company, ve.name))
+        if vehicle_arcs:
+            self.problem += lpSum(self.supply[arc] for arc in vehicle_arcs) >= ve.number_available
+
+    def add_vehicle_number_availability_constraints_warehouse_restaurant(self, ve: Vehicle):
+        '''
+        Constraint to ensure the number of vehicles used between warehouses and restaurants is less than or equal to the number of vehicles available.
+        Vehicles without any distribution arcs are skipped, as the constraint would have no terms.
+        '''
+        vehicle_arcs = self.arc_index.get_vehicle_distribution((ve.company, ve.name))
+        if vehicle_arcs:
+            self.problem += lpSum(self.distribution[arc] for arc in vehicle_arcs) >= ve.number_available
+
+    def set_warm_start(self, edges: List[Edge]):
+        '''
+        Uses the edges of a previous plan as a MIP start for the next solve.
+        '''
+        self.warm_start = WarmStartMapper(self, restaurant_demand_sense=self.RESTAURANT_DEMAND_SENSE).apply(edges)
+
+    def solve(self, backend='pulp', mode='exact'):
+        '''
+        Builds and solves the problem. The 'pulp' backend builds PuLP expressions, the 'array' backend builds the
+        objective and constraint matrix as arrays and passes them to CBC as an MPS file. The 'network' backend solves
+        the model as a minimum cost flow, falling back to the 'pulp' backend when the flow does not give a plan.
+        A problem already built, e.g. by from_model, is solved as is.
+        The 'exact' mode solves the MIP, the 'rounded' mode solves the LP relaxation and rounds the distribution flows,
+        the 'anytime' mode solves the MIP from the rounded plan and keeps the better of the two at the time limit.
+        '''
+        if mode not in ('exact', 'rounded', 'anytime'):
+            raise ValueError(f"Unknown solve mode {mode}.")
+        if backend == 'array':
+            return self.solve_array(mode)
+        elif backend == 'network':
+            return self.solve_network(mode)
+        elif backend != 'pulp':
+            raise ValueError(f"Unknown model backend {backend}.")
+        if self.model_cache:
+            logger.warning("The model cache only holds array models, building the PuLP problem.")
+
+        if not self.problem.constraints:
+            self.build()
+        self.solve_problem(mode)
+
+    def build(self):
+        logger.info(f"Building {self.DESCRIPTION} optimisation problem.")
+        self.objective_compiler = ObjectiveCompiler(self)
+        self.problem += self.objective_compiler.compile(**self.get_objective_weights())
+
+        self.add_vendor_constraints()
+        self.add_warehouse_constraints()
+        self.add_restaurant_constraints()
+        self.add_vendor_warehouse_constraints()
+        self.add_warehouse_restaurant_constraints()
+        self.add_vehicle_constraints()
+
+    def solve_problem(self, mode='exact'):
+        logger.info(f"Solving optimisation for {len(self.problem._variables)} variables and {len(self.problem.constraints)} constraints.")
+        if mode == 'rounded':
+            self.solve_stats = LPRoundingSolver(self, restaurant_demand_sense=self.RESTAURANT_DEMAND_SENSE).solve_problem()
+        elif mode == 'anytime':
+            self.solve_stats = AnytimeSolver(self, restaurant_demand_sense=self.RESTAURANT_DEMAND_SENSE).solve_problem()
+        else:
+            self.solve_stats = self.solver_config.solve(self.problem, warm_start=self.warm_start)
+        logger.info(f"Optimiser solved in {self.solve_stats.wall_time}.")
+
+    def solve_network(self, mode='exact'):
+        '''
+        The network's plan is whole, so it serves every mode. The mode is used if it falls back to the MIP.
+        '''
+        if self.objective_compiler is None:
+            self.objective_compiler = ObjectiveCompiler(self)
+        logger.info(f"Solving network flow for {len(self.arc_index.supply_routes) + len(self.arc_index.distribution_routes)} routes.")
+        self.solve_stats = NetworkFlowSolver(self).solve_problem()
+        if self.solve_stats is None:
+            logger.warning("Network flow has no plan meeting every constraint, solving the PuLP problem.")
+            self.solve('pulp', mode)
+            return
+        logger.info(f"Optimiser solved in {self.solve_stats.wall_time}.")
+
+    def set_array_objective(self, model: ArrayModel):
+        '''
+        Writes the objective and the restaurant demand sense into an array model built for another objective.
+        '''
+        weights = self.get_objective_weights()
+        supply_objective, distribution_objective = self.objective_compiler.get_objective_coefficients(weights['cost_weight'], weights['co2_weight'], weights.get('distribution_revenue', 0.0))
+        model.objective[:len(supply_objective)] = supply_objective
+        model.objective[len(supply_objective):] = distribution_objective
+        model.objective_constant = weights.get('constant', 0.0)
+        model.sense = self.SENSE
+        model.senses[ArrayModelBuilder(self).get_restaurant_rows()] = self.RESTAURANT_DEMAND_SENSE
+        # the MPS file written for the old objective no longer matches the arrays
+        model.mps_file = None
+
+    def solve_array(self, mode='exact'):
+        builder = ArrayModelBuilder(self)
+        if self.array_model is None:
+            weights = self.get_objective_weights()
+            cache_key = self.model_cache.get_key(self, reduce_vehicles=self.reduce_vehicles, nearest_warehouses=self.nearest_warehouses, **weights) if self.model_cache else None
+            cached = self.model_cache.load(cache_key, self) if self.model_cache else None
+            if cached:
+                self.array_model, self.objective_compiler = cached
+            else:
+                logger.info(f"Building {self.DESCRIPTION} array model.")
+                self.objective_compiler = ObjectiveCompiler(self)
+                supply_objective, distribution_objective = self.objective_compiler.get_objective_coefficients(weights['cost_weight'], weights['co2_weight'], weights.get('distribution_revenue', 0.0))
+                self.array_model = builder.build(supply_objective, distribution_objective, restaurant_demand_sense=self.RESTAURANT_DEMAND_SENSE,
+                                                 sense=self.problem.sense, objective_constant=weights.get('constant', 0.0))
+                if self.model_cache:
+                    self.model_cache.store(cache_key, self.array_model, self.objective_compiler)
+        model = self.array_model
+
+        logger.info(f"Solving array optimisation for {model.n_columns} variables and {model.n_rows} constraints.")
+        if mode == 'rounded':
+            self.solve_stats = LPRoundingSolver(self, restaurant_demand_sense=self.RESTAURANT_DEMAND_SENSE).solve_model(builder, model)
+        elif mode == 'anytime':
+            self.solve_stats = AnytimeSolver(self, restaurant_demand_sense=self.RESTAURANT_DEMAND_SENSE).solve_model(builder, model)
+        else:
+            start_time = time.time()
+            status, sol_status, values, bound = model.solve(self.solver_config, initial_values=builder.get_initial_values() if self.warm_start else None)
+            builder.assign_solution(model, status, sol_status, values)
+            self.solve_stats = self.solver_config.get_stats(self.problem, bound, time.time() - start_time)
+        logger.info(f"Optimiser solved in {self.solve_stats.wall_time}.")
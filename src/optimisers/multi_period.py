@@ -0,0 +1,135 @@
+from dataclasses import dataclass
+import logging
+from optimisers.objective import ObjectiveCompiler
+from optimisers.solvers import SolverConfig, SolveStats
+from pulp import LpAffineExpression, LpMinimize, LpProblem, LpVariable, lpSum
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PeriodPlan:
+    '''
+    One period of a multi-period model, with the attributes OptimisationOutputter reads from an optimiser.
+    '''
+    period: int
+    problem: LpProblem
+    solve_stats: SolveStats
+    supply: dict
+    distribution: dict
+    objective_compiler: ObjectiveCompiler
+    vehicle_reducer: object
+
+
+class MultiPeriodModel:
+    '''
+    The cost minimising model over a window of consecutive periods, with each warehouse's inventory carried from one
+    period to the next. Periods are days counted from the start of the plan. A vendor's additional capacity can be
+    used from its SLA period on, and warehouses that are not onboarded yet can only be used from their onboarding period on.
+    The arcs and objective coefficients are taken from a single period optimiser, so they are only computed once.
+    '''
+    def __init__(self,
+                 template,
+                 periods: range,
+                 initial_inventory: dict[str, float],
+                 onboarded_warehouses: set[str] = None,
+                 solver_config: SolverConfig = None):
+        self.template = template
+        self.periods = periods
+        self.initial_inventory = initial_inventory
+        self.onboarded_warehouses = onboarded_warehouses
+        self.solver_config = solver_config or template.solver_config
+        self.onboarding_periods = {w.name: w.onboarding_period for w in template.warehouses}
+        if template.objective_compiler is None:
+            template.objective_compiler = ObjectiveCompiler(template)
+        self.problem = LpProblem("SupplyChainMultiPeriod", LpMinimize)
+        self.supply = {}
+        self.distribution = {}
+        self.inventory = {}
+        for t in periods:
+            for i, arc in enumerate(template.supply_arcs):
+                self.supply[(arc, t)] = LpVariable(f"supply_{t}_{i}", lowBound=0, upBound=None if self.is_open(arc[1], t) else 0)
+            for i, arc in enumerate(template.distribution_arcs):
+                self.distribution[(arc, t)] = LpVariable(f"distribution_{t}_{i}", lowBound=0, upBound=None if self.is_open(arc[0], t) else 0, cat='Integer')
+            for i, w in enumerate(template.warehouses):
+                self.inventory[(w.name, t)] = LpVariable(f"inventory_{t}_{i}", lowBound=0)
+        self.warm_start = False
+        self.solve_stats: SolveStats = None
+
+    def is_open(self, warehouse_name: str, period: int) -> bool:
+        if self.onboarded_warehouses is None or warehouse_name in self.onboarded_warehouses:
+            return True
+        return period >= self.onboarding_periods[warehouse_name]
+
+    def build(self):
+        template = self.template
+        supply_coefficients, distribution_coefficients = template.objective_compiler.get_objective_coefficients(cost_weight=template.cost_co2_split, co2_weight=1 - template.cost_co2_split)
+        terms = []
+        for t in self.periods:
+            terms.extend(zip((self.supply[(arc, t)] for arc in template.supply_arcs), supply_coefficients.tolist()))
+            terms.extend(zip((self.distribution[(arc, t)] for arc in template.distribution_arcs), distribution_coefficients.tolist()))
+            # stock carried overnight pays the storage cost again
+            terms.extend((self.inventory[(w.name, t)], float(w.storage_cost_per_kg) * template.cost_co2_split) for w in template.warehouses)
+        self.problem += LpAffineExpression(terms)
+
+        for t in self.periods:
+            self.add_period_constraints(t)
+
+    def add_period_constraints(self, t: int):
+        template = self.template
+        index = template.arc_index
+        supply = {arc: self.supply[(arc, t)] for arc in template.supply_arcs}
+        distribution = {arc: self.distribution[(arc, t)] for arc in template.distribution_arcs}
+
+        for v in template.vendors:
+            capacity = v.capacity + (v.additional_capacity if t >= v.sla_period else 0)
+            self.problem += lpSum(supply[arc] for arc in index.get_vendor_out(v.name)) <= capacity
+
+        for w in template.warehouses:
+            opening = self.inventory[(w.name, t - 1)] if t - 1 in self.periods else self.initial_inventory.get(w.name, 0)
+            inflow = lpSum(supply[arc] for arc in index.get_warehouse_in(w.name))
+            outflow = lpSum(distribution[arc] for arc in index.get_warehouse_out(w.name))
+            self.problem += opening + inflow <= w.inventory_capacity
+            self.problem += self.inventory[(w.name, t)] == opening + inflow - outflow
+
+        for r in template.restaurants:
+            self.problem += lpSum(distribution[arc] for arc in index.get_restaurant_in(r.name)) >= r.restaurant_demand
+
+        for route, arcs in index.supply_routes.items():
+            self.problem += lpSum(supply[arc] for arc in arcs) <= lpSum(supply[arc] * template.vehicle_lookup[(arc[2], arc[3])].capacity for arc in arcs)
+        for route, arcs in index.distribution_routes.items():
+            self.problem += lpSum(distribution[arc] for arc in arcs) <= lpSum(distribution[arc] * template.vehicle_lookup[(arc[2], arc[3])].capacity for arc in arcs)
+
+        for ve in template.vehicles:
+            vehicle_arcs = index.get_vehicle_supply((ve.company, ve.name))
+            if vehicle_arcs:
+                self.problem += lpSum(supply[arc] for arc in vehicle_arcs) >= ve.number_available
+            vehicle_arcs = index.get_vehicle_distribution((ve.company, ve.name))
+            if vehicle_arcs:
+                self.problem += lpSum(distribution[arc] for arc in vehicle_arcs) >= ve.number_available
+
+    def set_warm_start(self, previous: 'MultiPeriodModel'):
+        '''
+        Starts from the previous window's solution for the periods both windows cover, and repeats its last period for the new one.
+        '''
+        for variables, previous_variables in ((self.supply, previous.supply), (self.distribution, previous.distribution), (self.inventory, previous.inventory)):
+            for (key, t), variable in variables.items():
+                previous_variable = previous_variables.get((key, min(t, previous.periods[-1])))
+                if previous_variable is not None and previous_variable.varValue is not None:
+                    variable.setInitialValue(previous_variable.varValue)
+        self.warm_start = True
+
+    def solve(self):
+        logger.info(f"Solving periods {self.periods.start} to {self.periods.stop - 1} for {len(self.problem.variables())} variables and {len(self.problem.constraints)} constraints.")
+        self.solve_stats = self.solver_config.solve(self.problem, warm_start=self.warm_start)
+
+    def get_period_plan(self, t: int) -> PeriodPlan:
+        return PeriodPlan(period=t,
+                          problem=self.problem,
+                          solve_stats=self.solve_stats,
+                          supply={arc: self.supply[(arc, t)] for arc in self.template.supply_arcs},
+                          distribution={arc: self.distribution[(arc, t)] for arc in self.template.distribution_arcs},
+                          objective_compiler=self.template.objective_compiler,
+                          vehicle_reducer=self.template.vehicle_reducer)
+
+    def get_closing_inventory(self, t: int) -> dict[str, float]:
+        return {w.name: self.inventory[(w.name, t)].varValue or 0.0 for w in self.template.warehouses}
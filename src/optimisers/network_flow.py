@@ -0,0 +1,274 @@
+from collections import defaultdict
+import logging
+import math
+import numpy as np
+from optimisers.feasibility import MaxFlow
+from optimisers.solvers import SolveStats
+from pulp import (LpAffineExpression, LpMinimize, LpSolution, LpSolutionInfeasible, LpSolutionIntegerFeasible, LpSolutionOptimal,
+                  LpStatus, LpStatusInfeasible, LpStatusOptimal)
+import time
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+class MinCostFlow:
+    '''
+    Primal-dual minimum cost flow over edge arrays, each edge stored next to its reverse so edge i ^ 1 is the reverse of edge i.
+    Each phase finds the shortest distances over the residual edges with a vectorised Bellman-Ford, then pushes a maximum
+    flow over the edges that lie on shortest paths, so one phase augments every shortest path at once.
+    Costs may be negative as long as the network has no negative cycle.
+    '''
+    TOLERANCE = 1e-9
+
+    def __init__(self, n_nodes: int):
+        self.n_nodes = n_nodes
+        # lists while the network is built, arrays once it is solved
+        self.sources = []
+        self.targets = []
+        self.capacities = []
+        self.costs = []
+
+    def add_edge(self, source: int, target: int, capacity: float, cost: float = 0.0) -> int:
+        edge = len(self.targets)
+        self.sources.extend((source, target))
+        self.targets.extend((target, source))
+        self.capacities.extend((float(capacity), 0.0))
+        self.costs.extend((float(cost), -float(cost)))
+        return edge
+
+    def get_distances(self, source: int, cost_tolerance: float) -> np.ndarray:
+        '''
+        Bellman-Ford over the edges with capacity left, relaxing every edge at once until no distance improves.
+        '''
+        distances = np.full(self.n_nodes, np.inf)
+        distances[source] = 0.0
+        closed = self.capacities[self.order] <= self.TOLERANCE
+        for _ in range(self.n_nodes):
+            candidates = distances[self.sources[self.order]] + self.costs[self.order]
+            candidates[closed] = np.inf
+            best = distances.copy()
+            best[self.reached] = np.minimum.reduceat(candidates, self.starts)
+            improved = best < distances - cost_tolerance
+            if not improved.any():
+                break
+            distances[improved] = best[improved]
+        return distances
+
+    def solve(self, source: int, sink: int, required: bool = True) -> tuple[float, float]:
+        '''
+        Returns the flow and its cost. A required flow is the maximum flow at the least cost, otherwise flow is only
+        pushed while the shortest path has a negative cost, which is the least cost flow of any amount.
+        '''
+        self.sources = np.array(self.sources, dtype=np.int64)
+        self.targets = np.array(self.targets, dtype=np.int64)
+        self.capacities = np.array(self.capacities, dtype=float)
+        self.costs = np.array(self.costs, dtype=float)
+        # edges sorted by target so the best candidate of every node is one reduceat
+        self.order = np.argsort(self.targets, kind='stable')
+        self.reached, self.starts = np.unique(self.targets[self.order], return_index=True)
+        cost_tolerance = self.TOLERANCE * (1 + np.abs(self.costs).max(initial=0.0))
+        flow = 0.0
+        while True:
+            distances = self.get_distances(source, cost_tolerance)
+            if distances[sink] == np.inf or (not required and distances[sink] >= -cost_tolerance):
+                break
+            # the edges on a shortest path, where the distance grows by exactly the edge's cost
+            with np.errstate(invalid='ignore'):
+                reduced = self.costs + distances[self.sources] - distances[self.targets]
+            admissible = np.flatnonzero((self.capacities > self.TOLERANCE) & (np.abs(reduced) <= cost_tolerance))
+            network = MaxFlow(self.n_nodes)
+            for edge_source, edge_target, capacity in zip(self.sources[admissible].tolist(), self.targets[admissible].tolist(), self.capacities[admissible].tolist()):
+                network.add_edge(edge_source, edge_target, capacity)
+            amount = network.solve(source, sink)
+            if amount <= self.TOLERANCE:
+                break
+            pushed = np.array(network.capacities[1::2])
+            self.capacities[admissible] -= pushed
+            self.capacities[admissible ^ 1] += pushed
+            flow += amount
+        cost = float(self.costs[0::2] @ self.capacities[1::2])
+        return flow, cost
+
+    def get_flow(self, edge: int) -> float:
+        return float(self.capacities[edge ^ 1])
+
+
+class NetworkFlowSolver:
+    '''
+    Solves an optimiser's model as a two-echelon minimum cost flow instead of a MIP. Each route becomes one edge with the
+    cost of its cheapest vehicle that carries at least a kg per kg sent, so the route's logistics constraint is slack.
+    Restaurant demand is rounded to whole kilograms, which with whole vendor and warehouse capacities makes every flow whole.
+    The vehicle number available constraints are not part of the network, vehicles left below theirs take over flow on
+    their routes from the cheapest vehicles with some to spare. The network's cost is then a bound on the plan rather than its objective.
+    When that is not possible, or a distribution flow is not whole, no plan is returned and the optimiser falls back to the MIP.
+    '''
+    TOLERANCE = 1e-6
+
+    def __init__(self, optimiser):
+        self.optimiser = optimiser
+        weights = optimiser.get_objective_weights()
+        supply_coefficients, distribution_coefficients = optimiser.objective_compiler.get_objective_coefficients(weights['cost_weight'], weights['co2_weight'], weights.get('distribution_revenue', 0.0))
+        self.supply_coefficients = supply_coefficients.tolist()
+        self.distribution_coefficients = distribution_coefficients.tolist()
+        self.objective_constant = weights.get('constant', 0.0)
+        # the flow is minimised, a maximised objective is negated
+        self.sign = 1 if optimiser.problem.sense == LpMinimize else -1
+        self.required = optimiser.RESTAURANT_DEMAND_SENSE == 'G'
+
+    def get_route_arcs(self, routes: dict, positions: dict, coefficients: List[float]) -> dict[tuple[str, str], tuple]:
+        '''
+        The cheapest arc of each route on which it has a vehicle carrying at least a kg per kg sent.
+        '''
+        vehicle_lookup = self.optimiser.vehicle_lookup
+        route_arcs = {}
+        for route, arcs in routes.items():
+            arcs = [arc for arc in arcs if vehicle_lookup[(arc[2], arc[3])].capacity >= 1]
+            if arcs:
+                route_arcs[route] = min(arcs, key=lambda arc: self.sign * coefficients[positions[arc]])
+        return route_arcs
+
+    def solve_problem(self) -> SolveStats:
+        '''
+        Writes the plan onto the optimiser's variables and returns its statistics, or returns None if the plan does not meet
+        the constraints left out of the network. An infeasible network proves the optimiser's model infeasible.
+        '''
+        start_time = time.time()
+        optimiser = self.optimiser
+        compiler = optimiser.objective_compiler
+        supply_route_arcs = self.get_route_arcs(optimiser.arc_index.supply_routes, compiler.supply_position, self.supply_coefficients)
+        distribution_route_arcs = self.get_route_arcs(optimiser.arc_index.distribution_routes, compiler.distribution_position, self.distribution_coefficients)
+
+        # nodes are the source, vendors, warehouse inflows, warehouse outflows, restaurants and the sink, in that order
+        n_vendors, n_warehouses, n_restaurants = len(optimiser.vendors), len(optimiser.warehouses), len(optimiser.restaurants)
+        vendor_node = {v.name: 1 + i for i, v in enumerate(optimiser.vendors)}
+        warehouse_in_node = {w.name: 1 + n_vendors + i for i, w in enumerate(optimiser.warehouses)}
+        warehouse_out_node = {w.name: 1 + n_vendors + n_warehouses + i for i, w in enumerate(optimiser.warehouses)}
+        restaurant_node = {r.name: 1 + n_vendors + 2 * n_warehouses + i for i, r in enumerate(optimiser.restaurants)}
+        source, sink = 0, 1 + n_vendors + 2 * n_warehouses + n_restaurants
+        network = MinCostFlow(sink + 1)
+        unbounded = sum(max(float(v.capacity), 0.0) for v in optimiser.vendors) + 1
+
+        for v in optimiser.vendors:
+            network.add_edge(source, vendor_node[v.name], max(float(v.capacity), 0.0))
+        for w in optimiser.warehouses:
+            network.add_edge(warehouse_in_node[w.name], warehouse_out_node[w.name], max(float(w.inventory_capacity), 0.0))
+        supply_edges = {network.add_edge(vendor_node[v], warehouse_in_node[w], unbounded, self.sign * self.supply_coefficients[compiler.supply_position[arc]]): arc
+                        for (v, w), arc in supply_route_arcs.items()}
+        distribution_edges = {network.add_edge(warehouse_out_node[w], restaurant_node[r], unbounded, self.sign * self.distribution_coefficients[compiler.distribution_position[arc]]): arc
+                              for (w, r), arc in distribution_route_arcs.items()}
+        # whole kilograms delivered meet a demand if they meet it rounded up, and stay within it if they stay within it rounded down
+        demand = {r.name: math.ceil(r.restaurant_demand - self.TOLERANCE) if self.required else math.floor(r.restaurant_demand + self.TOLERANCE) for r in optimiser.restaurants}
+        for r in optimiser.restaurants:
+            network.add_edge(restaurant_node[r.name], sink, max(demand[r.name], 0))
+        if not self.required:
+            # supply only has to cover distribution, so a warehouse can take in more than it sends out
+            for w in optimiser.warehouses:
+                network.add_edge(warehouse_out_node[w.name], sink, unbounded)
+
+        flow, cost = network.solve(source, sink, required=self.required)
+        if self.required and flow < sum(max(d, 0) for d in demand.values()) - self.TOLERANCE:
+            logger.warning(f"The network carries {flow:.1f} of {sum(demand.values()):.1f} demand, the model is infeasible.")
+            optimiser.problem.assignStatus(LpStatusInfeasible, LpSolutionInfeasible)
+            return self.get_stats(None, None, start_time)
+
+        supply = defaultdict(float)
+        distribution = defaultdict(float)
+        for edge, arc in supply_edges.items():
+            if network.get_flow(edge) > self.TOLERANCE:
+                supply[arc] = network.get_flow(edge)
+        for edge, arc in distribution_edges.items():
+            if network.get_flow(edge) > self.TOLERANCE:
+                distribution[arc] = network.get_flow(edge)
+        if any(abs(amount - round(amount)) > self.TOLERANCE for amount in distribution.values()):
+            logger.warning("The network has distribution flows that are not whole kilograms.")
+            return None
+
+        reassigned = self.meet_number_available(supply, optimiser.arc_index.get_vehicle_supply, compiler.supply_position, self.supply_coefficients)
+        if reassigned is None:
+            return None
+        reassigned_distribution = self.meet_number_available(distribution, optimiser.arc_index.get_vehicle_distribution, compiler.distribution_position, self.distribution_coefficients)
+        if reassigned_distribution is None:
+            return None
+
+        bound = self.sign * cost + self.objective_constant
+        objective = self.get_objective(supply, distribution)
+        # moving flow between vehicles can leave the plan worse than the bound, it is only proven optimal if it is not
+        proven = not (reassigned or reassigned_distribution) or abs(objective - bound) <= self.TOLERANCE * (1 + abs(bound))
+        self.assign_solution(supply, distribution, LpSolutionOptimal if proven else LpSolutionIntegerFeasible)
+        return self.get_stats(objective, bound, start_time)
+
+    def meet_number_available(self, flows: dict, get_vehicle_arcs, positions: dict, coefficients: List[float]) -> bool:
+        '''
+        Moves flow onto the arcs of vehicles below their number available, from other vehicles on the same routes that have
+        flow above theirs, cheapest first. Returns whether any flow moved, or None if a vehicle is still short.
+        '''
+        vehicles = self.optimiser.vehicles
+        totals = defaultdict(float)
+        for arc, amount in flows.items():
+            totals[(arc[2], arc[3])] += amount
+        number_available = {(ve.company, ve.name): ve.number_available for ve in vehicles}
+        route_flows = defaultdict(list)
+        for arc in flows:
+            route_flows[(arc[0], arc[1])].append(arc)
+
+        moved = False
+        for ve in vehicles:
+            key = (ve.company, ve.name)
+            vehicle_arcs = get_vehicle_arcs(key)
+            shortfall = ve.number_available - totals[key]
+            if not vehicle_arcs or shortfall <= self.TOLERANCE:
+                continue
+            if ve.capacity < 1:
+                logger.warning(f"Vehicle {ve.company} {ve.name} is below its number available and carries less than a kg per kg sent.")
+                return None
+            moves = [(self.sign * (coefficients[positions[arc]] - coefficients[positions[current]]), arc, current)
+                     for arc in vehicle_arcs for current in route_flows.get((arc[0], arc[1]), []) if current != arc]
+            for _, arc, current in sorted(moves, key=lambda move: move[0]):
+                if shortfall <= self.TOLERANCE:
+                    break
+                current_vehicle = (current[2], current[3])
+                amount = min(shortfall, flows.get(current, 0.0), totals[current_vehicle] - number_available[current_vehicle])
+                if amount <= self.TOLERANCE:
+                    continue
+                flows[current] -= amount
+                flows[arc] += amount
+                totals[current_vehicle] -= amount
+                totals[key] += amount
+                route_flows[(arc[0], arc[1])].append(arc)
+                shortfall -= amount
+                moved = True
+            if shortfall > self.TOLERANCE:
+                logger.warning(f"Vehicle {ve.company} {ve.name} is {shortfall:.1f} below its number available on the network's routes.")
+                return None
+        return moved
+
+    def get_objective(self, supply: dict, distribution: dict) -> float:
+        compiler = self.optimiser.objective_compiler
+        return (sum(self.supply_coefficients[compiler.supply_position[arc]] * amount for arc, amount in supply.items())
+                + sum(self.distribution_coefficients[compiler.distribution_position[arc]] * amount for arc, amount in distribution.items())
+                + self.objective_constant)
+
+    def assign_solution(self, supply: dict, distribution: dict, sol_status: int):
+        '''
+        Writes the plan onto the optimiser's PuLP variables and problem so the outputters work unchanged.
+        '''
+        optimiser = self.optimiser
+        for arc, variable in optimiser.supply.items():
+            variable.varValue = supply.get(arc, 0.0)
+        for arc, variable in optimiser.distribution.items():
+            variable.varValue = distribution.get(arc, 0.0)
+        terms = list(zip((optimiser.supply[arc] for arc in optimiser.supply_arcs), self.supply_coefficients))
+        terms.extend(zip((optimiser.distribution[arc] for arc in optimiser.distribution_arcs), self.distribution_coefficients))
+        optimiser.problem.objective = LpAffineExpression(terms, constant=self.objective_constant)
+        optimiser.problem.assignStatus(LpStatusOptimal, sol_status)
+
+    def get_stats(self, objective: float, bound: float, start_time: float) -> SolveStats:
+        problem = self.optimiser.problem
+        stats = SolveStats(solver='network',
+                           status=LpStatus[problem.status],
+                           solution_status=LpSolution[problem.sol_status],
+                           objective=objective,
+                           bound=bound,
+                           wall_time=time.time() - start_time)
+        logger.info(f"Network flow finished with status {stats.solution_status}, objective {stats.objective} and bound {stats.bound} in {stats.wall_time}.")
+        return stats
@@ -0,0 +1,112 @@
+import logging
+import numpy as np
+from pulp import LpAffineExpression
+
+logger = logging.getLogger(__name__)
+
+class ObjectiveCompiler:
+    '''
+    Walks every supply and distribution arc once, computing all of its per kg cost and CO2 components in the same pass.
+    The components are kept as a breakdown so the objective for any cost/CO2 split, and the reporting after the solve,
+    can be produced from them without looking anything up again.
+    '''
+    SUPPLY_COMPONENTS = ('supply_cost',
+                         'supply_to_warehouse_cost',
+                         'warehouse_storage_cost',
+                         'supplier_co2_emissions',
+                         'supply_to_warehouse_co2_emissions')
+    # the warehouse storage cost on distribution is only reported as the source cost of the edge, it is not part of the objective
+    DISTRIBUTION_COMPONENTS = ('warehouse_to_restaurant_cost',
+                               'warehouse_to_restaurant_co2_emissions',
+                               'distribution_storage_cost')
+    SUPPLY_COST_COLUMNS = [0, 1, 2]
+    SUPPLY_CO2_COLUMNS = [3, 4]
+    DISTRIBUTION_COST_COLUMNS = [0]
+    DISTRIBUTION_CO2_COLUMNS = [1]
+
+    def __init__(self, optimiser, supply_components: np.ndarray = None, distribution_components: np.ndarray = None):
+        '''
+        Components already computed for the same arcs, e.g. loaded from the model cache, can be passed in instead of recomputed.
+        '''
+        self.optimiser = optimiser
+        self.supply_arcs = optimiser.supply_arcs
+        self.distribution_arcs = optimiser.distribution_arcs
+        self.supply_position = {arc: i for i, arc in enumerate(self.supply_arcs)}
+        self.distribution_position = {arc: i for i, arc in enumerate(self.distribution_arcs)}
+        self.supply_components = self.get_supply_components() if supply_components is None else supply_components
+        self.distribution_components = self.get_distribution_components() if distribution_components is None else distribution_components
+
+    def get_supply_components(self) -> np.ndarray:
+        vendor_terms = {name: (float(cost), float(self.optimiser.supplier_cost_mapper.supplier_co2_mapping[name])) for name, cost in self.optimiser.supplier_cost_mapper.supplier_mapping.items()}
+        vehicle_terms = self.get_vehicle_terms()
+        storage_costs = self.optimiser.warehouse_cost_mapper.warehouse_mapping
+        distances = self.optimiser.supplier_warehouse_mapper.distance_mapping
+
+        components = []
+        for v, w, company, vehicle_name in self.supply_arcs:
+            vendor_cost, vendor_co2 = vendor_terms[v]
+            vehicle_cost, vehicle_co2 = vehicle_terms[(company, vehicle_name)]
+            distance = float(distances[(v, w)])
+            components.append((vendor_cost, distance * vehicle_cost, float(storage_costs[w]), vendor_co2, distance * vehicle_co2))
+        return np.array(components, dtype=float).reshape(-1, len(self.SUPPLY_COMPONENTS))
+
+    def get_distribution_components(self) -> np.ndarray:
+        vehicle_terms = self.get_vehicle_terms()
+        storage_costs = self.optimiser.warehouse_cost_mapper.warehouse_mapping
+        distances = self.optimiser.warehouse_restaurant_mapper.distance_mapping
+
+        components = []
+        for w, r, company, vehicle_name in self.distribution_arcs:
+            vehicle_cost, vehicle_co2 = vehicle_terms[(company, vehicle_name)]
+            distance = float(distances[(w, r)])
+            components.append((distance * vehicle_cost, distance * vehicle_co2, float(storage_costs[w])))
+        return np.array(components, dtype=float).reshape(-1, len(self.DISTRIBUTION_COMPONENTS))
+
+    def get_vehicle_terms(self) -> dict[tuple[str, str], tuple[float, float]]:
+        return {vehicle: (float(cost), float(self.optimiser.vehicle_mapper.co2_mapping[vehicle])) for vehicle, cost in self.optimiser.vehicle_mapper.cost_mapping.items()}
+
+    def get_objective_coefficients(self, cost_weight: float, co2_weight: float, distribution_revenue: float = 0.0):
+        '''
+        Blends the components into a single coefficient per arc.
+        The cost weight is negative for a maximisation, the revenue is per kg distributed and is not weighted.
+        '''
+        supply_coefficients = self.supply_components[:, self.SUPPLY_COST_COLUMNS].sum(axis=1) * cost_weight + \
+                              self.supply_components[:, self.SUPPLY_CO2_COLUMNS].sum(axis=1) * co2_weight
+        distribution_coefficients = distribution_revenue + \
+                                    self.distribution_components[:, self.DISTRIBUTION_COST_COLUMNS].sum(axis=1) * cost_weight + \
+                                    self.distribution_components[:, self.DISTRIBUTION_CO2_COLUMNS].sum(axis=1) * co2_weight
+        return supply_coefficients, distribution_coefficients
+
+    def compile(self, cost_weight: float, co2_weight: float, distribution_revenue: float = 0.0, constant: float = 0.0) -> LpAffineExpression:
+        '''
+        Emits the objective as a single expression with one term per variable.
+        '''
+        supply_coefficients, distribution_coefficients = self.get_objective_coefficients(cost_weight, co2_weight, distribution_revenue)
+        terms = list(zip((self.optimiser.supply[arc] for arc in self.supply_arcs), supply_coefficients.tolist()))
+        terms.extend(zip((self.optimiser.distribution[arc] for arc in self.distribution_arcs), distribution_coefficients.tolist()))
+        return LpAffineExpression(terms, constant=constant)
+
+    def get_supply_breakdown(self, arc: tuple[str, str, str, str]) -> dict[str, float]:
+        return dict(zip(self.SUPPLY_COMPONENTS, self.supply_components[self.supply_position[arc]].tolist()))
+
+    def get_distribution_breakdown(self, arc: tuple[str, str, str, str]) -> dict[str, float]:
+        return dict(zip(self.DISTRIBUTION_COMPONENTS, self.distribution_components[self.distribution_position[arc]].tolist()))
+
+    def get_component_totals(self, supply_values: np.ndarray, distribution_values: np.ndarray) -> dict[str, float]:
+        '''
+        Returns the total of each component for the given solution values, ordered like the arcs.
+        '''
+        totals = dict(zip(self.SUPPLY_COMPONENTS, (supply_values @ self.supply_components).tolist()))
+        totals.update(zip(self.DISTRIBUTION_COMPONENTS, (distribution_values @ self.distribution_components).tolist()))
+        return totals
+
+    def get_solution_values(self, supply: dict = None, distribution: dict = None) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Reads the values of the given supply and distribution variables in arc order, by default the optimiser's own.
+        A model that reuses the arcs with variables of its own, e.g. a period of a multi-period model, passes those.
+        '''
+        supply = self.optimiser.supply if supply is None else supply
+        distribution = self.optimiser.distribution if distribution is None else distribution
+        supply_values = np.array([supply[arc].varValue or 0 for arc in self.supply_arcs], dtype=float)
+        distribution_values = np.array([distribution[arc].varValue or 0 for arc in self.distribution_arcs], dtype=float)
+        return supply_values, distribution_values
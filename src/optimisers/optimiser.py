@@ -1,184 +1,47 @@
 from data_objects.flows import Distance, SupplierWarehouseDistance, WarehouseRestaurantDistance
 from data_objects.vehicles import Vehicle
 import logging
-from mapper import RouteCostMapper, VehicleCostMapper, SupplierCostMapper, WarehouseCostMapper
-from pulp import LpProblem, LpVariable, lpSum, LpMinimize
+from optimisers.model_core import SupplyChainModel
 from data_objects.sites import Vendor, Warehouse, Restaurant
-import time
-from typing import List
 
 logger = logging.getLogger(__name__)
 
-class SupplyChainOptimisation:
-    def __init__(self,
-                 cost_co2_split,
-                 vendors: List[Vendor],
-                 warehouses: List[Warehouse], 
-                 restaurants: List[Restaurant],
-                 vehicles: List[Vehicle], 
-                 supplier_warehouse_distances: List[SupplierWarehouseDistance], 
-                 warehouse_restaurant_distances: List[WarehouseRestaurantDistance]):
-        self.cost_co2_split = cost_co2_split
-        self.vendors = vendors
-        self.warehouses = warehouses
-        self.restaurants = restaurants
-        self.vehicles = vehicles
-        self.supplier_cost_mapper = SupplierCostMapper(vendors) 
-        self.warehouse_cost_mapper = WarehouseCostMapper(warehouses)
-        self.supplier_warehouse_mapper = RouteCostMapper(supplier_warehouse_distances)
-        self.warehouse_restaurant_mapper = RouteCostMapper(warehouse_restaurant_distances)
-        self.vehicle_mapper = VehicleCostMapper(vehicles)
-        self.problem = LpProblem("SupplyChainOptimization", LpMinimize)
-        # supply is the amount of supply from each supplier to each warehouse
-        self.supply = LpVariable.dicts("supply", [(v.name, w.name, ve.company, ve.name) for v in vendors for w in warehouses for ve in vehicles], lowBound=0, cat='Continuous')
-        # distibution is the amount of chicken sent from each warehouse to each restaurant
-        self.distribution = LpVariable.dicts("distribution", [(w.name, r.name, ve.company, ve.name) for w in warehouses for r in restaurants for ve in vehicles], lowBound=0, cat="Integer")
-
-    def get_supply_cost(self):
-        return lpSum(self.supply[(v.name, w.name, ve.company, ve.name)] * v.cost_per_kg for v in self.vendors for w in self.warehouses for ve in self.vehicles)
-    
-    def get_supply_to_warehouse_cost(self):
-        return lpSum(self.supply[(v.name, w.name, ve.company, ve.name)] * self.supplier_warehouse_mapper.distance_mapping[v.name, w.name] * self.vehicle_mapper.cost_mapping[(ve.company, ve.name)] for v in self.vendors for w in self.warehouses for ve in self.vehicles)
-    
-    def get_warehouse_storage_cost(self):
-        return lpSum(self.supply[(v.name, w.name, ve.company, ve.name)] * w.storage_cost_per_kg for v in self.vendors for w in self.warehouses for ve in self.vehicles)
-    
-    def get_warehouse_to_restaurant_cost(self):
-        return lpSum(self.distribution[(w.name, r.name, ve.company, ve.name)] * self.warehouse_restaurant_mapper.distance_mapping[w.name, r.name] * self.vehicle_mapper.cost_mapping[(ve.company, ve.name)] for w in self.warehouses for r in self.restaurants for ve in self.vehicles)
-    
-    def get_supplier_co2_emissions_cost(self):
-        return lpSum(self.supply[(v.name, w.name, ve.company, ve.name)] * self.supplier_cost_mapper.supplier_co2_mapping[v.name] for v in self.vendors for w in self.warehouses for ve in self.vehicles) 
-    
-    def get_supply_to_warehouse_co2_emissions_cost(self):
-        return lpSum(self.supply[(v.name, w.name, ve.company, ve.name)] * self.supplier_warehouse_mapper.distance_mapping[v.name, w.name] * self.vehicle_mapper.co2_mapping[(ve.company, ve.name)] for v in self.vendors for w in self.warehouses for ve in self.vehicles)
-    
-    def get_warehouse_to_restaurant_co2_emissions_cost(self):
-        return lpSum(self.distribution[(w.name, r.name, ve.company, ve.name)] * self.warehouse_restaurant_mapper.distance_mapping[w.name, r.name] * self.vehicle_mapper.co2_mapping[(ve.company, ve.name)] for w in self.warehouses for r in self.restaurants for ve in self.vehicles)
-
-    def add_vendor_constraints(self):
-        for v in self.vendors:
-            self.add_vendor_limit_constraint(v)
-
-    def add_warehouse_constraints(self):
-        for w in self.warehouses:
-            self.add_warehouse_capacity_constraint(w)
-            self.add_warehouse_supply_constraint(w)
-
-    def add_vendor_warehouse_constraints(self):
-        for v in self.vendors:
-            for w in self.warehouses:
-                self.add_vendor_logistics_constraint(v, w)
-
-    def add_restaurant_constraints(self):
-        for r in self.restaurants:
-            self.add_restaurant_demand_constraint(r)
-
-    def add_warehouse_restaurant_constraints(self):
-        for w in self.warehouses:
-            for r in self.restaurants:
-                self.add_warehouse_logistics_constraint(w, r)
-
-    def add_vehicle_constraints(self):
-        for ve in self.vehicles:
-            self.add_vehicle_number_availability_constraints_supplier_warehouse(ve)
-            self.add_vehicle_number_availability_constraints_warehouse_restaurant(ve)
-
-    def add_vendor_limit_constraint(self, vendor: Vendor):
-        self.problem += lpSum(self.supply[(vendor.name, w.name, ve.company, ve.name)] for w in self.warehouses for ve in self.vehicles)  <= vendor.capacity
-
-    def add_vendor_logistics_constraint(self, vendor: Vendor, warehouse: Warehouse):
-        '''
-        Constraint for each vendor and warehouse combination their supply must be below the associated logistics capacity.
-        '''
-        self.problem += lpSum(self.supply[(vendor.name, warehouse.name, ve.company, ve.name)] for ve in self.vehicles) <= lpSum(self.supply[(vendor.name, warehouse.name, ve.company, ve.name)] * ve.capacity for ve in self.vehicles)
-
-    def add_warehouse_capacity_constraint(self, warehouse: Warehouse):
-        self.problem += lpSum(self.supply[(v.name, warehouse.name, ve.company, ve.name)] for v in self.vendors for ve in self.vehicles) <= warehouse.inventory_capacity
-
-    def add_warehouse_supply_constraint(self, warehouse: Warehouse):
-        self.problem += lpSum(self.distribution[(warehouse.name, r.name, ve.company, ve.name)] for r in self.restaurants for ve in self.vehicles) <= lpSum(self.supply[(v.name, warehouse.name, ve.company, ve.name)] for v in self.vendors for ve in self.vehicles)
-
-    def add_warehouse_logistics_constraint(self, warehouse: Warehouse, restaurant: Restaurant):
-        self.problem += lpSum(self.distribution[(warehouse.name, restaurant.name, ve.company, ve.name)] for ve in self.vehicles) <= lpSum(self.distribution[(warehouse.name, restaurant.name, ve.company, ve.name)] * ve.capacity for ve in self.vehicles)
-
-    def add_restaurant_demand_constraint(self, restaurant: Restaurant):
-        self.problem += lpSum(self.distribution[(w.name, restaurant.name, ve.company, ve.name)] for w in self.warehouses for ve in self.vehicles) >= restaurant.restaurant_demand
-
-    def add_restaurant_stock_constraint(self, restaurant: Restaurant):
-        self.problem += lpSum(self.distribution[(w.name, restaurant.name, ve.company, ve.name)] for w in self.warehouses for ve in self.vehicles) <= restaurant.restaurant_demand * 3
-
-    def add_vehicle_number_availability_constraints_supplier_warehouse(self, ve: Vehicle):
-        '''
-        Constraint to ensure the number of vehicles used between suppliers and warehouses is less than or equal to the number of vehicles available.
-        '''
-        self.problem += lpSum(self.supply[(v.name, w.name, ve.company, ve.name)] for v in self.vendors for w in self.warehouses) >= ve.number_available
-
-    def add_vehicle_number_availability_constraints_warehouse_restaurant(self, ve: Vehicle):
-        '''
-        Constraint to ensure the number of vehicles used between warehouses and restaurants is less than or equal to the number of vehicles available.
-        '''
-        self.problem += lpSum(self.distribution[(w.name, r.name, ve.company, ve.name)] for w in self.warehouses for r in self.restaurants) >= ve.number_available
-
+class SupplyChainOptimisation(SupplyChainModel):
+    '''
+    Minimises the cost and CO2 emissions, weighted by the cost/CO2 split, of meeting every restaurant's demand.
+    '''
     def print_results(self):
         if self.problem.status == 1:
-            for v in self.vendors:
-                for w in self.warehouses:
-                    for ve in self.vehicles:
-                        if self.supply[(v.name, w.name, ve.company, ve.name)].varValue > 0:
-                            logger.info(f"Supply {self.supply[(v.name, w.name, ve.company, ve.name)].varValue} units from {v.name} at a cost of {self.supply[(v.name, w.name, ve.company, ve.name)].varValue * v.cost_per_kg} and delivered to warehouse {w.name}.")
-                            logger.info(f"Inventory at warehouse {w.name} is {self.supply[(v.name, w.name, ve.company, ve.name)].varValue} units at a cost of {self.supply[(v.name, w.name, ve.company, ve.name)].varValue * w.storage_cost_per_kg}.")
-                            logger.info(f"Transport costs of {self.supply[(v.name, w.name, ve.company, ve.name)].varValue * self.supplier_warehouse_mapper.distance_mapping[v.name, w.name] * self.vehicle_mapper.cost_mapping[(ve.company, ve.name)]} from {v.name} to {w.name} using {ve.name} from {ve.company}.")
-
-            for w in self.warehouses:
-                for r in self.restaurants:
-                    for ve in self.vehicles:
-                        if self.distribution[(w.name, r.name, ve.company, ve.name)].varValue > 0:
-                            logger.info(f"Transport costs of {self.distribution[(w.name, r.name, ve.company, ve.name)].varValue * self.warehouse_restaurant_mapper.distance_mapping[w.name, r.name] * self.vehicle_mapper.cost_mapping[(ve.company, ve.name)]} from {w.name} to {r.name} using {ve.name} from {ve.company}.")
-
-            for v in self.vendors:
-                for w in self.warehouses:
-                    for ve in self.vehicles:
-                        if self.supply[(v.name, w.name, ve.company, ve.name)].varValue > 0:
-                            logger.info(f"CO2 emissions of {self.supply[(v.name, w.name, ve.company, ve.name)].varValue * self.supplier_warehouse_mapper.distance_mapping[v.name, w.name] * self.vehicle_mapper.co2_mapping[(ve.company, ve.name)]} from {v.name} to {w.name} using {ve.name} from {ve.company}.")
-
-            for w in self.warehouses:
-                for r in self.restaurants:
-                    for ve in self.vehicles:
-                        if self.distribution[(w.name, r.name, ve.company, ve.name)].varValue > 0:
-                            logger.info(f"CO2 emissions of {self.distribution[(w.name, r.name, ve.company, ve.name)].varValue * self.warehouse_restaurant_mapper.distance_mapping[w.name, r.name] * self.vehicle_mapper.co2_mapping[(ve.company, ve.name)]} from {w.name} to {r.name} using {ve.name} from {ve.company}.")            
+            for arc in self.supply_arcs:
+                amount = self.supply[arc].varValue
+                if amount > 0:
+                    v, w, company, vehicle_name = arc
+                    logger.info(f"Supply {amount} units from {v} at a cost of {amount * self.supplier_cost_mapper.supplier_mapping[v]} and delivered to warehouse {w}.")
+                    logger.info(f"Inventory at warehouse {w} is {amount} units at a cost of {amount * self.warehouse_cost_mapper.warehouse_mapping[w]}.")
+                    logger.info(f"Transport costs of {amount * self.supplier_warehouse_mapper.distance_mapping[v, w] * self.vehicle_mapper.cost_mapping[(company, vehicle_name)]} from {v} to {w} using {vehicle_name} from {company}.")
+
+            for arc in self.distribution_arcs:
+                amount = self.distribution[arc].varValue
+                if amount > 0:
+                    w, r, company, vehicle_name = arc
+                    logger.info(f"Transport costs of {amount * self.warehouse_restaurant_mapper.distance_mapping[w, r] * self.vehicle_mapper.cost_mapping[(company, vehicle_name)]} from {w} to {r} using {vehicle_name} from {company}.")
+
+            for arc in self.supply_arcs:
+                amount = self.supply[arc].varValue
+                if amount > 0:
+                    v, w, company, vehicle_name = arc
+                    logger.info(f"CO2 emissions of {amount * self.supplier_warehouse_mapper.distance_mapping[v, w] * self.vehicle_mapper.co2_mapping[(company, vehicle_name)]} from {v} to {w} using {vehicle_name} from {company}.")
+
+            for arc in self.distribution_arcs:
+                amount = self.distribution[arc].varValue
+                if amount > 0:
+                    w, r, company, vehicle_name = arc
+                    logger.info(f"CO2 emissions of {amount * self.warehouse_restaurant_mapper.distance_mapping[w, r] * self.vehicle_mapper.co2_mapping[(company, vehicle_name)]} from {w} to {r} using {vehicle_name} from {company}.")
 
             logger.info(f"Total cost: {self.problem.objective.value()}")
         else:
             logger.warning("No optimal solution found.")
 
-    def solve(self):
-        logger.info("Building cost minimising optimisation problem.")
-        total_cost = (
-            (self.get_supply_cost() + 
-            self.get_supply_to_warehouse_cost() +
-            self.get_warehouse_storage_cost() +
-            self.get_warehouse_to_restaurant_cost()) * self.cost_co2_split +
-            (self.get_supplier_co2_emissions_cost() +
-            self.get_supply_to_warehouse_co2_emissions_cost() +
-            self.get_warehouse_to_restaurant_co2_emissions_cost()) * (1 - self.cost_co2_split)
-        )
-        self.problem += total_cost
-
-        self.add_vendor_constraints()
-        self.add_warehouse_constraints()
-        self.add_restaurant_constraints()
-        self.add_vendor_warehouse_constraints()
-        self.add_warehouse_restaurant_constraints()
-        self.add_vehicle_constraints()
-
-        logger.info(f"Solving optimisation for {len(self.problem._variables)} variables and {len(self.problem.constraints)} constraints.")
-        start_time = time.time()
-
-        self.problem.solve()
-
-        end_time = time.time()
-        logger.info(f"Optimiser solved in {end_time - start_time}.")
-
 
 if __name__ == "__main__":
     vendors = [
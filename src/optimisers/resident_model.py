@@ -0,0 +1,96 @@
+import logging
+from optimisers.optimiser import SupplyChainOptimisation
+import time
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+class ResidentSupplyChainModel:
+    '''
+    Keeps a built SupplyChainOptimisation in memory so what-if changes can be applied in place and re-solved.
+    Updates change constraint right-hand sides, variable bounds or objective coefficients only, variables and
+    constraints are never rebuilt. Every re-solve starts from the previous solution.
+    '''
+    def __init__(self, optimiser: SupplyChainOptimisation):
+        self.optimiser = optimiser
+        self.vendors = {v.name for v in optimiser.vendors}
+        self.warehouses = {w.name for w in optimiser.warehouses}
+        self.restaurant_demand = {r.name: r.restaurant_demand for r in optimiser.restaurants}
+        self.inactive_sites = set()
+        self.solves = 0
+        start_time = time.time()
+        self.optimiser.build()
+        logger.info(f"Built resident model in {time.time() - start_time}.")
+
+    def solve(self) -> int:
+        self.optimiser.warm_start = self.solves > 0
+        self.optimiser.solve_problem()
+        self.solves += 1
+        return self.optimiser.problem.status
+
+    def update_demand(self, restaurant_name: str, demand: float):
+        if restaurant_name not in self.restaurant_demand:
+            raise KeyError(f"No restaurant named {restaurant_name}.")
+        self.restaurant_demand[restaurant_name] = demand
+        if restaurant_name not in self.inactive_sites:
+            self.set_rhs(self.optimiser.restaurant_demand_constraints[restaurant_name], demand)
+        logger.info(f"Set demand of {restaurant_name} to {demand}.")
+
+    def update_capacity(self, site_name: str, capacity: float):
+        '''
+        Updates the capacity of a vendor, or the inventory capacity of a warehouse.
+        '''
+        if site_name in self.vendors:
+            self.set_rhs(self.optimiser.vendor_limit_constraints[site_name], capacity)
+        elif site_name in self.warehouses:
+            self.set_rhs(self.optimiser.warehouse_capacity_constraints[site_name], capacity)
+        else:
+            raise KeyError(f"No vendor or warehouse named {site_name}.")
+        logger.info(f"Set capacity of {site_name} to {capacity}.")
+
+    def deactivate_site(self, site_name: str):
+        '''
+        Fixes every arc into and out of the site to zero. A deactivated restaurant no longer needs its demand met.
+        '''
+        for variable in self.get_site_variables(site_name):
+            variable.upBound = 0
+            variable.varValue = 0
+        if site_name in self.restaurant_demand:
+            self.set_rhs(self.optimiser.restaurant_demand_constraints[site_name], 0)
+        self.inactive_sites.add(site_name)
+        logger.info(f"Deactivated {site_name}.")
+
+    def activate_site(self, site_name: str):
+        for variable in self.get_site_variables(site_name):
+            variable.upBound = None
+        if site_name in self.restaurant_demand:
+            self.set_rhs(self.optimiser.restaurant_demand_constraints[site_name], self.restaurant_demand[site_name])
+        self.inactive_sites.discard(site_name)
+        logger.info(f"Activated {site_name}.")
+
+    def set_cost_co2_split(self, cost_co2_split: float):
+        '''
+        Re-blends the objective coefficients from the compiler's breakdown and writes them into the existing objective.
+        '''
+        self.optimiser.cost_co2_split = cost_co2_split
+        compiler = self.optimiser.objective_compiler
+        supply_coefficients, distribution_coefficients = compiler.get_objective_coefficients(cost_weight=cost_co2_split, co2_weight=1 - cost_co2_split)
+        objective = self.optimiser.problem.objective
+        for arc, coefficient in zip(compiler.supply_arcs, supply_coefficients.tolist()):
+            objective[self.optimiser.supply[arc]] = coefficient
+        for arc, coefficient in zip(compiler.distribution_arcs, distribution_coefficients.tolist()):
+            objective[self.optimiser.distribution[arc]] = coefficient
+        logger.info(f"Set cost/CO2 split to {cost_co2_split}.")
+
+    def get_site_variables(self, site_name: str) -> List:
+        arc_index = self.optimiser.arc_index
+        variables = [self.optimiser.supply[arc] for arc in arc_index.get_vendor_out(site_name) + arc_index.get_warehouse_in(site_name)]
+        variables.extend(self.optimiser.distribution[arc] for arc in arc_index.get_warehouse_out(site_name) + arc_index.get_restaurant_in(site_name))
+        if not variables and site_name not in self.vendors and site_name not in self.warehouses and site_name not in self.restaurant_demand:
+            raise KeyError(f"No site named {site_name}.")
+        return variables
+
+    def set_rhs(self, constraint, rhs: float):
+        # PuLP keeps constraints as expression + constant, so the right-hand side is the negated constant
+        constraint.constant = -rhs
+
@@ -0,0 +1,132 @@
+import logging
+import math
+import numpy as np
+from optimisers.array_model import ArrayModel, ArrayModelBuilder
+from optimisers.solvers import SolveStats
+from pulp import LpSolution, LpSolutionIntegerFeasible, LpSolutionOptimal
+import time
+
+logger = logging.getLogger(__name__)
+
+class LPRoundingSolver:
+    '''
+    Solves the LP relaxation of an optimiser's problem, rounds the distribution flows to whole kilograms and
+    re-solves the supply stage as an LP with the rounded flows fixed, so every warehouse is still supplied.
+    The LP objective is a bound on the exact MIP, the reported gap is how far the rounded plan is from it.
+    If the rounded flows cannot be supplied the exact MIP is solved instead.
+    '''
+    TOLERANCE = 1e-6
+
+    def __init__(self, optimiser, restaurant_demand_sense: str = 'G'):
+        self.optimiser = optimiser
+        self.restaurant_demand_sense = restaurant_demand_sense
+        self.solver_config = optimiser.solver_config
+        restaurant_index = {r.name: i for i, r in enumerate(optimiser.restaurants)}
+        self.restaurant_demand = np.array([r.restaurant_demand for r in optimiser.restaurants], dtype=float)
+        self.arc_restaurant = np.fromiter((restaurant_index[arc[1]] for arc in optimiser.distribution_arcs), dtype=np.int64, count=len(optimiser.distribution_arcs))
+
+    def round_distribution(self, values: np.ndarray) -> np.ndarray:
+        '''
+        Rounds the flows restaurant by restaurant with the largest remainder method, so each restaurant receives its
+        relaxed inflow rounded up (for >= demand) or down (for <= demand). Vehicles left below their number available
+        by the rounding are then topped up on their arcs with the largest remainders.
+        '''
+        n_restaurants = len(self.restaurant_demand)
+        rounded = np.floor(values + self.TOLERANCE)
+        remainders = np.clip(values - rounded, 0, None)
+        inflow = np.bincount(self.arc_restaurant, weights=values, minlength=n_restaurants)
+        if self.restaurant_demand_sense == 'G':
+            target = np.ceil(inflow - self.TOLERANCE)
+        else:
+            target = np.floor(inflow + self.TOLERANCE)
+        missing = target - np.bincount(self.arc_restaurant, weights=rounded, minlength=n_restaurants)
+
+        # rank each arc within its restaurant by remainder, largest first, and round up the top `missing` of them
+        order = np.lexsort((-remainders, self.arc_restaurant))
+        group_starts = np.searchsorted(self.arc_restaurant[order], np.arange(n_restaurants))
+        ranks = np.empty(len(values), dtype=np.int64)
+        ranks[order] = np.arange(len(values)) - group_starts[self.arc_restaurant[order]]
+        rounded += ranks < missing[self.arc_restaurant]
+
+        return self.repair_vehicle_availability(rounded, remainders)
+
+    def repair_vehicle_availability(self, rounded: np.ndarray, remainders: np.ndarray) -> np.ndarray:
+        position = {arc: i for i, arc in enumerate(self.optimiser.distribution_arcs)}
+        restaurant_inflow = np.bincount(self.arc_restaurant, weights=rounded, minlength=len(self.restaurant_demand))
+        for ve in self.optimiser.vehicles:
+            arcs = [position[arc] for arc in self.optimiser.arc_index.get_vehicle_distribution((ve.company, ve.name))]
+            if not arcs:
+                continue
+            shortfall = math.ceil(ve.number_available - rounded[arcs].sum() - self.TOLERANCE)
+            for i in sorted(arcs, key=lambda i: -remainders[i]):
+                if shortfall <= 0:
+                    break
+                r = self.arc_restaurant[i]
+                if self.restaurant_demand_sense == 'L' and restaurant_inflow[r] + 1 > self.restaurant_demand[r]:
+                    continue
+                rounded[i] += 1
+                restaurant_inflow[r] += 1
+                shortfall -= 1
+        return rounded
+
+    def solve_problem(self) -> SolveStats:
+        '''
+        Rounds on the optimiser's PuLP problem, fixing the distribution variables through their bounds for the supply re-solve.
+        '''
+        start_time = time.time()
+        problem = self.optimiser.problem
+        relaxed_stats = self.solver_config.solve(problem, mip=False)
+        if problem.sol_status != LpSolutionOptimal:
+            logger.warning("LP relaxation has no optimal solution, no rounded plan.")
+            return relaxed_stats
+
+        variables = [self.optimiser.distribution[arc] for arc in self.optimiser.distribution_arcs]
+        bounds = [(variable.lowBound, variable.upBound) for variable in variables]
+        rounded = self.round_distribution(np.array([variable.varValue or 0 for variable in variables], dtype=float))
+        for variable, amount in zip(variables, rounded.tolist()):
+            variable.lowBound = amount
+            variable.upBound = amount
+        repaired_stats = self.solver_config.solve(problem, mip=False)
+        for variable, (low_bound, up_bound) in zip(variables, bounds):
+            variable.lowBound = low_bound
+            variable.upBound = up_bound
+
+        if problem.sol_status != LpSolutionOptimal:
+            logger.warning("Rounded distribution cannot be supplied, solving the exact MIP.")
+            return self.solver_config.solve(problem)
+        return self.get_stats(repaired_stats.objective, relaxed_stats.objective, time.time() - start_time)
+
+    def solve_model(self, builder: ArrayModelBuilder, model: ArrayModel) -> SolveStats:
+        '''
+        Rounds on an array model, fixing the distribution columns with FX bounds for the supply re-solve.
+        '''
+        start_time = time.time()
+        status, sol_status, values, _ = model.solve(self.solver_config, mip=False)
+        builder.assign_solution(model, status, sol_status, values)
+        if sol_status != LpSolutionOptimal:
+            logger.warning("LP relaxation has no optimal solution, no rounded plan.")
+            return self.solver_config.get_stats(self.optimiser.problem, None, time.time() - start_time)
+        relaxed_objective = model.get_objective_value(values)
+
+        distribution_columns = np.arange(builder.n_supply, builder.n_supply + builder.n_distribution)
+        model.fix_columns(distribution_columns, self.round_distribution(values[distribution_columns]))
+        status, sol_status, values, _ = model.solve(self.solver_config, mip=False)
+        model.fix_columns([], [])
+
+        if sol_status != LpSolutionOptimal:
+            logger.warning("Rounded distribution cannot be supplied, solving the exact MIP.")
+            status, sol_status, values, bound = model.solve(self.solver_config)
+            builder.assign_solution(model, status, sol_status, values)
+            return self.solver_config.get_stats(self.optimiser.problem, bound, time.time() - start_time)
+        builder.assign_solution(model, status, sol_status, values)
+        return self.get_stats(model.get_objective_value(values), relaxed_objective, time.time() - start_time)
+
+    def get_stats(self, objective: float, bound: float, wall_time: float) -> SolveStats:
+        stats = SolveStats(solver=self.solver_config.name,
+                           status='Optimal',
+                           solution_status=LpSolution[LpSolutionIntegerFeasible],
+                           objective=objective,
+                           bound=bound,
+                           wall_time=wall_time)
+        logger.info(f"Rounded plan has objective {stats.objective}, within {stats.gap:.2%} of the LP bound {stats.bound}.")
+        return stats
@@ -0,0 +1,208 @@
+from dataclasses import asdict, dataclass
+from data_objects.flows import SupplierWarehouseDistance, WarehouseRestaurantDistance
+from data_objects.sites import Vendor, Warehouse, Restaurant
+from data_objects.vehicles import Vehicle
+import json
+import logging
+from mapper import RouteCostMapper
+import math
+import numpy as np
+from optimisers.arcs import CandidateArcBuilder
+from optimisers.solvers import SolveStats
+from optimisers.spatial import NearestWarehouseSelector
+import os
+import tempfile
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ModelSizeEstimate:
+    n_supply: int
+    n_distribution: int
+    n_constraints: int
+    n_nonzeros: int
+    memory_bytes: int
+    # seconds, None until there are enough past runs to fit
+    solve_time: float = None
+
+    @property
+    def n_variables(self) -> int:
+        return self.n_supply + self.n_distribution
+
+
+class ModelSizeEstimator:
+    '''
+    Predicts the size of the model the optimisers would build from the reader outputs, by counting the candidate
+    arcs per route instead of building them. The counts are exact for both optimisers, apart from vehicle reduction,
+    so they are an upper bound when vehicles are reduced.
+    '''
+    # measured with tracemalloc: the variables and arcs cost the same in every backend, the constraints do not,
+    # and the network backend builds none
+    BYTES_PER_VARIABLE = 540
+    BYTES_PER_NONZERO = {'pulp': 240, 'array': 110, 'network': 0}
+
+    def __init__(self,
+                 vendors: List[Vendor],
+                 warehouses: List[Warehouse],
+                 restaurants: List[Restaurant],
+                 vehicles: List[Vehicle],
+                 supplier_warehouse_distances: List[SupplierWarehouseDistance],
+                 warehouse_restaurant_distances: List[WarehouseRestaurantDistance],
+                 solve_history: 'SolveHistory' = None):
+        self.vendors = vendors
+        self.warehouses = warehouses
+        self.restaurants = restaurants
+        self.vehicles = vehicles
+        self.supplier_warehouse_mapper = RouteCostMapper(supplier_warehouse_distances)
+        self.warehouse_restaurant_mapper = RouteCostMapper(warehouse_restaurant_distances)
+        self.solve_history = solve_history
+
+    def estimate(self, backend='pulp', mode='exact', nearest_warehouses: int = None) -> ModelSizeEstimate:
+        supply_routes, distribution_routes = None, None
+        if nearest_warehouses:
+            selector = NearestWarehouseSelector(self.warehouses, nearest_warehouses)
+            supply_routes = selector.select(self.supplier_warehouse_mapper, self.vendors, warehouse_position=1)
+            distribution_routes = selector.select(self.warehouse_restaurant_mapper, self.restaurants, warehouse_position=0)
+        n_supply, n_supply_routes, supply_vehicles = self.count_arcs(self.supplier_warehouse_mapper, self.vendors, self.warehouses, supply_routes)
+        n_distribution, n_distribution_routes, distribution_vehicles = self.count_arcs(self.warehouse_restaurant_mapper, self.warehouses, self.restaurants, distribution_routes)
+
+        estimate = self.get_estimate(n_supply, n_distribution, n_supply_routes, n_distribution_routes, supply_vehicles + distribution_vehicles, backend)
+        if self.solve_history:
+            estimate.solve_time = self.solve_history.predict(estimate, mode)
+        logger.info(f"Estimated {estimate.n_variables} variables, {estimate.n_constraints} constraints, {estimate.n_nonzeros} non-zeros, "
+                    f"{estimate.memory_bytes / 1024 ** 2:.0f} MB and a solve time of {estimate.solve_time} seconds.")
+        return estimate
+
+    def measure(self, optimiser, backend='pulp') -> ModelSizeEstimate:
+        '''
+        Returns the size of a built optimiser's model, counted the same way as the estimate, e.g. to record with its solve time.
+        '''
+        index = optimiser.arc_index
+        return self.get_estimate(len(optimiser.supply_arcs), len(optimiser.distribution_arcs), len(index.supply_routes), len(index.distribution_routes),
+                                 len(index.vehicle_supply) + len(index.vehicle_distribution), backend)
+
+    def count_arcs(self, route_mapper: RouteCostMapper, sources: list, targets: list, routes: List[tuple[str, str]] = None) -> tuple[int, int, int]:
+        '''
+        Returns the number of arcs, of routes with at least one arc and of vehicles with at least one arc, matching CandidateArcBuilder.build.
+        '''
+        builder = CandidateArcBuilder(self.vehicles, route_mapper)
+        source_locations = {s.name: s.location for s in sources}
+        target_locations = {t.name: t.location for t in targets}
+        n_arcs, n_routes, used_vehicles = 0, 0, set()
+        for (source, target) in (route_mapper.distance_mapping if routes is None else routes):
+            if source not in source_locations or target not in target_locations:
+                continue
+            route_vehicles = builder.get_route_vehicles(source_locations[source], target_locations[target])
+            n_arcs += len(route_vehicles)
+            n_routes += 1 if route_vehicles else 0
+            used_vehicles.update((ve.company, ve.name) for ve in route_vehicles)
+        return n_arcs, n_routes, len(used_vehicles)
+
+    def get_estimate(self, n_supply: int, n_distribution: int, n_supply_routes: int, n_distribution_routes: int, n_vehicle_constraints: int, backend='pulp') -> ModelSizeEstimate:
+        # vendor limits, warehouse capacity and supply, restaurant demand, route logistics and vehicle availability
+        n_constraints = len(self.vendors) + 2 * len(self.warehouses) + len(self.restaurants) + n_supply_routes + n_distribution_routes + n_vehicle_constraints
+        # a supply arc is in its vendor, warehouse capacity, warehouse supply, route and vehicle rows, a distribution arc
+        # in all of those but the first two and in its restaurant row; the logistics rows hold each arc once
+        n_nonzeros = 5 * n_supply + 4 * n_distribution
+        memory_bytes = self.BYTES_PER_VARIABLE * (n_supply + n_distribution) + self.BYTES_PER_NONZERO[backend] * n_nonzeros
+        return ModelSizeEstimate(n_supply, n_distribution, n_constraints, n_nonzeros, memory_bytes)
+
+
+class SolveHistory:
+    '''
+    Past solves as JSON lines, with the solve time fitted as a power law of the number of non-zeros per solve mode and solver.
+    '''
+    MIN_RUNS = 3
+
+    def __init__(self, history_file: str = None):
+        self.history_file = history_file or os.getenv('SOLVE_HISTORY_FILE', os.path.join(tempfile.gettempdir(), 'supply_chain_solve_history.jsonl'))
+
+    def read(self) -> List[dict]:
+        if not os.path.exists(self.history_file):
+            return []
+        with open(self.history_file) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def record(self, estimate: ModelSizeEstimate, stats: SolveStats, mode='exact'):
+        run = asdict(estimate)
+        run.update({'mode': mode, 'solver': stats.solver, 'status': stats.status, 'wall_time': stats.wall_time})
+        with open(self.history_file, 'a') as f:
+            f.write(json.dumps(run) + '\n')
+
+    def fit(self, mode='exact', solver: str = None) -> tuple[float, float]:
+        '''
+        Returns the intercept and slope of log solve time against log non-zeros, or None with fewer than MIN_RUNS runs.
+        '''
+        runs = [run for run in self.read() if run['mode'] == mode and (solver is None or run['solver'] == solver) and run['wall_time'] > 0]
+        if len({run['n_nonzeros'] for run in runs}) < self.MIN_RUNS:
+            return None
+        x = np.log([max(run['n_nonzeros'], 1) for run in runs])
+        y = np.log([run['wall_time'] for run in runs])
+        slope, intercept = np.polyfit(x, y, 1)
+        return intercept, slope
+
+    def predict(self, estimate: ModelSizeEstimate, mode='exact', solver: str = None) -> float:
+        fit = self.fit(mode, solver)
+        if fit is None:
+            return None
+        intercept, slope = fit
+        return math.exp(intercept + slope * math.log(max(estimate.n_nonzeros, 1)))
+
+
+class ModelBudgetExceeded(RuntimeError):
+    pass
+
+
+@dataclass
+class ModelBudget:
+    '''
+    Limits on the estimated model. Limits left as None are not checked. When a limit would be exceeded the planner either
+    refuses to run, or degrades to the rounded LP mode for the solve time and to fewer nearest warehouses for the size.
+    '''
+    max_variables: int = None
+    max_constraints: int = None
+    max_nonzeros: int = None
+    max_memory_bytes: int = None
+    max_solve_time: float = None
+    on_exceed: str = 'degrade'
+
+    def __post_init__(self):
+        if self.on_exceed not in ('degrade', 'refuse'):
+            raise ValueError(f"Unknown budget action {self.on_exceed}, expected degrade or refuse.")
+
+    def get_exceeded(self, estimate: ModelSizeEstimate) -> List[str]:
+        limits = (('variables', estimate.n_variables, self.max_variables),
+                  ('constraints', estimate.n_constraints, self.max_constraints),
+                  ('non-zeros', estimate.n_nonzeros, self.max_nonzeros),
+                  ('memory bytes', estimate.memory_bytes, self.max_memory_bytes),
+                  ('solve time', estimate.solve_time, self.max_solve_time))
+        return [f"{name} {value:.0f} > {limit}" for name, value, limit in limits if limit is not None and value is not None and value > limit]
+
+    def fit(self, estimator: ModelSizeEstimator, backend='pulp', mode='exact', nearest_warehouses: int = None) -> tuple[str, int]:
+        '''
+        Returns the solve mode and number of nearest warehouses to run with so the estimate is within budget.
+        Over the solve time the rounded mode is tried first, then the number of nearest warehouses is halved down to one.
+        '''
+        estimate = estimator.estimate(backend, mode, nearest_warehouses)
+        exceeded = self.get_exceeded(estimate)
+        if exceeded and self.on_exceed == 'refuse':
+            raise ModelBudgetExceeded(f"Model over budget: {', '.join(exceeded)}.")
+
+        # the rounded mode solves an LP of the same size, so it only helps with the solve time
+        if mode == 'exact' and self.max_solve_time is not None and estimate.solve_time is not None and estimate.solve_time > self.max_solve_time:
+            mode = 'rounded'
+            estimate = estimator.estimate(backend, mode, nearest_warehouses)
+            exceeded = self.get_exceeded(estimate)
+            logger.warning("Model over budget, switching to the rounded mode.")
+
+        nearest_warehouses = nearest_warehouses or len(estimator.warehouses)
+        while exceeded and nearest_warehouses > 1:
+            nearest_warehouses = nearest_warehouses // 2
+            estimate = estimator.estimate(backend, mode, nearest_warehouses)
+            exceeded = self.get_exceeded(estimate)
+            logger.warning(f"Model over budget, pruning to the {nearest_warehouses} nearest warehouses.")
+
+        if exceeded:
+            raise ModelBudgetExceeded(f"Model over budget even at its cheapest: {', '.join(exceeded)}.")
+        return mode, nearest_warehouses if nearest_warehouses < len(estimator.warehouses) else None
@@ -0,0 +1,184 @@
+from dataclasses import dataclass
+import logging
+from optimisers.warm_start import WarmStartMapper
+import os
+from pulp import LpProblem, LpSolution, LpSolutionIntegerFeasible, LpSolutionNoSolutionFound, LpSolutionOptimal, LpStatus, LpStatusNotSolved, PULP_CBC_CMD, HiGHS_CMD, GLPK_CMD
+import re
+import sys
+import tempfile
+import time
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class SolveStats:
+    solver: str
+    status: str
+    solution_status: str
+    objective: float
+    bound: float
+    wall_time: float
+
+    @property
+    def gap(self) -> float:
+        '''
+        Relative gap between the objective and the bound, None if either is unknown.
+        '''
+        if self.objective is None or self.bound is None:
+            return None
+        return abs(self.objective - self.bound) / max(abs(self.objective), 1e-9)
+
+    @property
+    def has_solution(self) -> bool:
+        return self.solution_status in (LpSolution[LpSolutionOptimal], LpSolution[LpSolutionIntegerFeasible])
+
+    @property
+    def proven_optimal(self) -> bool:
+        '''
+        False for a feasible solution the solver stopped on, e.g. at its time limit, and for rounded plans.
+        '''
+        return self.solution_status == LpSolution[LpSolutionOptimal]
+
+
+@dataclass
+class SolverConfig:
+    '''
+    Selects the solver used by the optimisers and the options passed to it.
+    Options left as None keep the solver's own default. Presolve is a level understood by the solver, e.g. 'on', 'off' or 'more' for CBC.
+    '''
+    name: str = 'cbc'
+    threads: int = None
+    gap_rel: float = None
+    time_limit: float = None
+    presolve: str = None
+    msg: bool = True
+
+    SOLVERS = ('cbc', 'highs', 'glpk')
+
+    def __post_init__(self):
+        self.name = self.name.lower()
+        if self.name not in self.SOLVERS:
+            raise ValueError(f"Unknown solver {self.name}, expected one of {', '.join(self.SOLVERS)}.")
+
+    @classmethod
+    def from_env(cls, **overrides) -> 'SolverConfig':
+        '''
+        Reads the configuration from the SOLVER, SOLVER_THREADS, SOLVER_GAP, SOLVER_TIME_LIMIT, SOLVER_PRESOLVE and SOLVER_MSG
+        environment variables. Threads default to the number of cores. Keyword arguments that are not None take precedence.
+        '''
+        config = {
+            'name': os.getenv('SOLVER', 'cbc'),
+            'threads': int(os.getenv('SOLVER_THREADS', os.cpu_count() or 1)),
+            'gap_rel': float(os.getenv('SOLVER_GAP')) if os.getenv('SOLVER_GAP') else None,
+            'time_limit': float(os.getenv('SOLVER_TIME_LIMIT')) if os.getenv('SOLVER_TIME_LIMIT') else None,
+            'presolve': os.getenv('SOLVER_PRESOLVE'),
+            'msg': os.getenv('SOLVER_MSG', 'True') == 'True',
+        }
+        config.update({key: option for key, option in overrides.items() if option is not None})
+        return cls(**config)
+
+    def get_solver(self, warm_start: bool = False, log_path: str = None, mip: bool = True):
+        if self.name == 'cbc':
+            return PULP_CBC_CMD(mip=mip,
+                                msg=self.msg and not log_path,
+                                timeLimit=self.time_limit,
+                                gapRel=self.gap_rel,
+                                threads=self.threads,
+                                warmStart=warm_start,
+                                logPath=log_path,
+                                options=[f"presolve {self.presolve}"] if self.presolve else [])
+
+        if warm_start:
+            logger.warning(f"Solver {self.name} does not take a MIP start, solving without it.")
+        if self.name == 'highs':
+            # HiGHS_CMD only exposes command line options, the gap is set in its options file which PuLP writes itself
+            if self.gap_rel is not None:
+                logger.warning("HiGHS_CMD does not take a relative gap, solving to optimality.")
+            options = [f"--presolve {self.presolve}"] if self.presolve else []
+            if self.threads and self.threads > 1:
+                options.append("--parallel on")
+            return HiGHS_CMD(mip=mip, msg=self.msg, timeLimit=self.time_limit, options=options)
+
+        if self.threads and self.threads > 1:
+            logger.warning("GLPK is single threaded, ignoring the thread count.")
+        options = ["--mipgap", str(self.gap_rel)] if self.gap_rel is not None else []
+        if self.presolve:
+            options.append("--nopresol" if self.presolve == 'off' else "--presol")
+        return GLPK_CMD(mip=mip, msg=self.msg, timeLimit=self.time_limit, options=options)
+
+    def get_cbc_args(self) -> List[str]:
+        '''
+        Returns the options as arguments for the CBC command line, used when the model is written out as arrays.
+        '''
+        if self.name != 'cbc':
+            raise ValueError(f"The array backend solves with CBC only, not {self.name}.")
+        args = []
+        if self.time_limit is not None:
+            args.extend(["sec", str(self.time_limit)])
+        if self.gap_rel is not None:
+            args.extend(["ratio", str(self.gap_rel)])
+        if self.threads is not None:
+            args.extend(["threads", str(self.threads)])
+        if self.presolve:
+            args.extend(["presolve", self.presolve])
+        return args
+
+    def solve(self, problem: LpProblem, warm_start: bool = False, mip: bool = True) -> SolveStats:
+        '''
+        Solves the problem with the configured solver and returns its status, objective, bound and wall time.
+        With mip set to False only the LP relaxation is solved.
+        CBC's log is captured to read the bound and the MIP start messages, and is echoed afterwards if msg is set.
+        '''
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_file = os.path.join(tmp_dir, "cbc.log") if self.name == 'cbc' else None
+            # HiGHS_CMD maximises by negating the objective on the problem itself, so keep the original to put back
+            objective = problem.objective
+            start_time = time.time()
+            problem.solve(self.get_solver(warm_start=warm_start, log_path=log_file, mip=mip))
+            wall_time = time.time() - start_time
+            problem.objective = objective
+            # CBC stopped on its time limit can write out a node's solution instead of its incumbent
+            if problem.sol_status == LpSolutionIntegerFeasible and not problem.valid(eps=1e-6):
+                logger.warning(f"Solver {self.name} stopped with a solution that breaks the constraints, discarding it.")
+                problem.assignStatus(LpStatusNotSolved, LpSolutionNoSolutionFound)
+
+            bound = None
+            if log_file:
+                bound = self.read_cbc_bound(log_file)
+                if bound is not None:
+                    # CBC reports the bound without the objective's constant term
+                    bound += problem.objective.constant
+                if warm_start:
+                    WarmStartMapper.log_solver_start(log_file)
+                self.echo_log(log_file)
+
+        return self.get_stats(problem, bound, wall_time)
+
+    def get_stats(self, problem: LpProblem, bound: float, wall_time: float) -> SolveStats:
+        objective = problem.objective.value() if problem.sol_status > 0 else None
+        # a solve proven optimal is its own bound, otherwise the bound is only known if the solver reported it
+        if bound is None and problem.sol_status == LpSolutionOptimal:
+            bound = objective
+        stats = SolveStats(solver=self.name,
+                           status=LpStatus[problem.status],
+                           solution_status=LpSolution[problem.sol_status],
+                           objective=objective,
+                           bound=bound,
+                           wall_time=wall_time)
+        logger.info(f"Solver {stats.solver} finished with status {stats.solution_status}, objective {stats.objective} and bound {stats.bound} in {stats.wall_time}.")
+        return stats
+
+    def echo_log(self, log_file: str):
+        if self.msg:
+            with open(log_file) as f:
+                sys.stdout.write(f.read())
+
+    @staticmethod
+    def read_cbc_bound(log_file: str) -> float:
+        '''
+        Reads the best bound from CBC's result summary, which is only printed when the search stopped before proving optimality.
+        '''
+        with open(log_file) as f:
+            match = re.search(r"^(?:Lower|Upper) bound:\s+(\S+)", f.read(), re.MULTILINE)
+        return float(match.group(1)) if match else None
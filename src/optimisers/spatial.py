@@ -0,0 +1,123 @@
+from collections import defaultdict
+from data_objects.sites import Warehouse
+import heapq
+import logging
+from mapper import RouteCostMapper
+import math
+import numpy as np
+from typing import Iterator, List
+
+logger = logging.getLogger(__name__)
+
+class GridIndex:
+    '''
+    Uniform grid over points projected from lat/long to kilometres, for nearest neighbour queries.
+    Queries search outwards one ring of cells at a time, so they only look at the points near the query.
+    '''
+    KM_PER_DEGREE = 111.32
+
+    def __init__(self, names: List[str], lats: List[float], longs: List[float]):
+        self.names = names
+        lats = np.asarray(lats, dtype=float)
+        longs = np.asarray(longs, dtype=float)
+        # an equirectangular projection around the mean latitude is accurate enough to rank sites by distance
+        self.long_scale = self.KM_PER_DEGREE * math.cos(math.radians(lats.mean())) if len(lats) else self.KM_PER_DEGREE
+        self.points = np.column_stack([longs * self.long_scale, lats * self.KM_PER_DEGREE]).reshape(-1, 2)
+
+        self.origin = self.points.min(axis=0) if len(self.points) else np.zeros(2)
+        extent = self.points.max(axis=0) - self.origin if len(self.points) else np.zeros(2)
+        # about two points a cell
+        self.cell_size = max(math.sqrt(max(extent[0], 1.0) * max(extent[1], 1.0) * 2 / max(len(self.points), 1)), 1e-6)
+        self.n_cells = np.floor(extent / self.cell_size).astype(np.int64) + 1
+        self.cells = defaultdict(list)
+        for i, cell in enumerate(self.get_cells(self.points)):
+            self.cells[tuple(cell)].append(i)
+
+    def get_cells(self, points: np.ndarray) -> np.ndarray:
+        return np.clip(np.floor((points - self.origin) / self.cell_size).astype(np.int64), 0, self.n_cells - 1)
+
+    def nearest(self, lat: float, long: float) -> Iterator[tuple[str, float]]:
+        '''
+        Yields every point's name and distance in km, nearest first.
+        '''
+        if not len(self.points):
+            return
+        query = np.array([float(long) * self.long_scale, float(lat) * self.KM_PER_DEGREE])
+        # queries outside the grid start from the nearest cell inside it
+        cx, cy = (int(c) for c in self.get_cells(query[None, :])[0])
+        max_ring = int(max(cx, cy, self.n_cells[0] - 1 - cx, self.n_cells[1] - 1 - cy))
+        heap = []
+        for ring in range(max_ring + 1):
+            for x, y in self.get_ring(cx, cy, ring):
+                for i in self.cells.get((x, y), []):
+                    heapq.heappush(heap, (float(np.hypot(*(self.points[i] - query))), i))
+            # every point outside the searched rings is at least this far away
+            covered = self.get_covered_distance(query, cx, cy, ring)
+            while heap and heap[0][0] <= covered:
+                distance, i = heapq.heappop(heap)
+                yield self.names[i], distance
+
+    def get_ring(self, cx: int, cy: int, ring: int) -> Iterator[tuple[int, int]]:
+        if ring == 0:
+            yield cx, cy
+            return
+        for x in range(cx - ring, cx + ring + 1):
+            yield x, cy - ring
+            yield x, cy + ring
+        for y in range(cy - ring + 1, cy + ring):
+            yield cx - ring, y
+            yield cx + ring, y
+
+    def get_covered_distance(self, query: np.ndarray, cx: int, cy: int, ring: int) -> float:
+        covered = math.inf
+        low = self.origin + np.array([cx - ring, cy - ring]) * self.cell_size
+        high = self.origin + np.array([cx + ring + 1, cy + ring + 1]) * self.cell_size
+        for axis, centre in enumerate((cx, cy)):
+            # sides that have reached the edge of the grid have nothing beyond them
+            if centre - ring > 0:
+                covered = min(covered, query[axis] - low[axis])
+            if centre + ring < self.n_cells[axis] - 1:
+                covered = min(covered, high[axis] - query[axis])
+        return covered
+
+
+class NearestWarehouseSelector:
+    '''
+    Keeps only the routes from each farm, or to each restaurant, to its k nearest warehouses by lat/long.
+    Warehouses the site has no route to are passed over, so every site keeps k routes if it has that many.
+    Sites without coordinates, and routes to warehouses without coordinates, are always kept.
+    '''
+    def __init__(self, warehouses: List[Warehouse], k: int):
+        self.k = k
+        located = [w for w in warehouses if w.lat is not None and w.long is not None]
+        self.index = GridIndex([w.name for w in located], [w.lat for w in located], [w.long for w in located])
+        # warehouses without coordinates cannot be ranked, so they are never pruned
+        self.unlocated = {w.name for w in warehouses} - {w.name for w in located}
+
+    def select(self, route_mapper: RouteCostMapper, sites: list, warehouse_position: int) -> List[tuple[str, str]]:
+        '''
+        Returns the kept routes in the order of the distance mapping. The warehouse is at warehouse_position in each route.
+        '''
+        site_position = 1 - warehouse_position
+        site_warehouses = defaultdict(set)
+        for route in route_mapper.distance_mapping:
+            site_warehouses[route[site_position]].add(route[warehouse_position])
+
+        kept = set()
+        for site in sites:
+            warehouses = site_warehouses.get(site.name, set())
+            if len(warehouses) <= self.k or site.lat is None or site.long is None:
+                kept.update((site.name, w) for w in warehouses)
+                continue
+            kept.update((site.name, w) for w in warehouses & self.unlocated)
+            n_kept = 0
+            for warehouse, _ in self.index.nearest(site.lat, site.long):
+                if warehouse in warehouses:
+                    kept.add((site.name, warehouse))
+                    n_kept += 1
+                    if n_kept >= self.k:
+                        break
+
+        routes = [route for route in route_mapper.distance_mapping if (route[site_position], route[warehouse_position]) in kept]
+        logger.info(f"Kept {len(routes)} of {len(route_mapper.distance_mapping)} routes to the {self.k} nearest warehouses.")
+        return routes
@@ -0,0 +1,53 @@
+from collections import defaultdict
+from dataclasses import replace
+from data_objects.vehicles import Vehicle
+import logging
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+class VehicleReducer:
+    '''
+    Shrinks the vehicles before the arcs are built, without changing the optimum.
+    Vehicles with the same capacity, costs, emissions and locations are collapsed into one class, named after its first
+    member, whose number available is the sum of its members'. No vehicle is dropped for being worse than another on
+    a route, since every vehicle read has a number available it must carry.
+    The solution is expanded back to the concrete vehicles of each class with expand.
+    '''
+    def __init__(self, vehicles: List[Vehicle]):
+        self.vehicles = vehicles
+        self.members: dict[tuple[str, str], List[Vehicle]] = {}
+        self.vehicle_classes = self.collapse(vehicles)
+        self.class_of = {(ve.company, ve.name): key for key, members in self.members.items() for ve in members}
+
+    def collapse(self, vehicles: List[Vehicle]) -> List[Vehicle]:
+        classes = defaultdict(list)
+        for ve in vehicles:
+            classes[(float(ve.capacity), float(ve.cost_per_kg_per_km), float(ve.co2_emissions_per_kg_per_km), tuple(sorted(ve.locations or [])))].append(ve)
+
+        vehicle_classes = []
+        for members in classes.values():
+            first = members[0]
+            self.members[(first.company, first.name)] = members
+            vehicle_classes.append(replace(first, number_available=sum(max(ve.number_available, 0) for ve in members)))
+        logger.info(f"Collapsed {len(vehicles)} vehicles into {len(vehicle_classes)} vehicle classes.")
+        return vehicle_classes
+
+    def expand(self, flows: List[tuple[tuple[str, str, str, str], float]]) -> List[tuple[tuple[str, str, str, str], float]]:
+        '''
+        Splits the flows of one stage on class arcs into flows on the concrete vehicles' arcs.
+        Each member is given flows in arc order until it carries its number available, anything left stays with the first member.
+        '''
+        still_needed = {key: [max(ve.number_available, 0) for ve in members] for key, members in self.members.items()}
+        expanded = []
+        for arc, amount in flows:
+            members = self.members[(arc[2], arc[3])]
+            needed = still_needed[(arc[2], arc[3])]
+            shares = [0.0] * len(members)
+            for i in range(1, len(members)):
+                shares[i] = min(amount, needed[i])
+                needed[i] -= shares[i]
+                amount -= shares[i]
+            shares[0] = amount
+            expanded.extend(((arc[0], arc[1], ve.company, ve.name), share) for ve, share in zip(members, shares) if share > 0)
+        return expanded
@@ -0,0 +1,96 @@
+from collections import defaultdict
+import logging
+import math
+from output.output import Edge
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+class WarmStartMapper:
+    '''
+    Maps the edges of a previous plan onto the supply and distribution variables of a new model as a MIP start.
+    Edges whose exact arc no longer exists are moved onto another vehicle on the same route, or dropped if the route is gone.
+    Distribution amounts are rounded to whole kilograms and each restaurant's inflow is repaired towards its current demand.
+    '''
+    def __init__(self, optimiser, restaurant_demand_sense: str = 'G'):
+        self.optimiser = optimiser
+        self.restaurant_demand_sense = restaurant_demand_sense
+        self.mapped = 0
+        self.repaired = 0
+        self.dropped = 0
+
+    def apply(self, edges: List[Edge]) -> bool:
+        '''
+        Sets the initial value of every variable from the plan, returns True if any edge could be mapped.
+        '''
+        supply_start, distribution_start = self.map_edges(edges)
+        distribution_start = self.repair_restaurant_amounts(distribution_start)
+
+        for arc, variable in self.optimiser.supply.items():
+            variable.setInitialValue(supply_start.get(arc, 0))
+        for arc, variable in self.optimiser.distribution.items():
+            variable.setInitialValue(distribution_start.get(arc, 0))
+
+        logger.info(f"Warm start mapped {self.mapped} edges, moved {self.repaired} edges to another vehicle and dropped {self.dropped} edges.")
+        return self.mapped + self.repaired > 0
+
+    def map_edges(self, edges: List[Edge]):
+        supply_start = defaultdict(float)
+        distribution_start = defaultdict(float)
+        for edge in edges:
+            if edge.stage == 'supply':
+                self.map_edge(edge, self.optimiser.supply, self.optimiser.arc_index.supply_routes, supply_start)
+            elif edge.stage == 'distribution':
+                self.map_edge(edge, self.optimiser.distribution, self.optimiser.arc_index.distribution_routes, distribution_start)
+        return supply_start, distribution_start
+
+    def map_edge(self, edge: Edge, variables: dict, routes: dict, start: dict):
+        arc = (edge.source_id, edge.target_id, edge.vehicle_company, edge.vehicle_type)
+        # the plan names concrete vehicles, a reduced model only has their classes
+        if self.optimiser.vehicle_reducer and (edge.vehicle_company, edge.vehicle_type) in self.optimiser.vehicle_reducer.class_of:
+            arc = (edge.source_id, edge.target_id, *self.optimiser.vehicle_reducer.class_of[(edge.vehicle_company, edge.vehicle_type)])
+        if arc in variables:
+            start[arc] += edge.amount
+            self.mapped += 1
+        elif routes.get((edge.source_id, edge.target_id)):
+            start[routes[(edge.source_id, edge.target_id)][0]] += edge.amount
+            self.repaired += 1
+        else:
+            self.dropped += 1
+
+    def repair_restaurant_amounts(self, distribution_start: dict) -> dict:
+        '''
+        Rounds distribution amounts to integers, then tops up (for >= demand) or scales down (for <= demand) each restaurant's
+        inflow so it matches the current demand. Restaurants with no mapped inflow are left for the solver.
+        '''
+        restaurant_starts = defaultdict(list)
+        for arc, amount in distribution_start.items():
+            restaurant_starts[arc[1]].append(arc)
+
+        repaired_start = {}
+        for r in self.optimiser.restaurants:
+            arcs = restaurant_starts.get(r.name)
+            if not arcs:
+                continue
+            amounts = {arc: float(round(distribution_start[arc])) for arc in arcs}
+            inflow = sum(amounts.values())
+            demand = float(r.restaurant_demand)
+            if self.restaurant_demand_sense == 'G' and inflow < demand:
+                largest = max(amounts, key=amounts.get)
+                amounts[largest] += math.ceil(demand - inflow)
+            elif self.restaurant_demand_sense == 'L' and inflow > demand:
+                amounts = {arc: float(math.floor(amount * demand / inflow)) for arc, amount in amounts.items()}
+            repaired_start.update(amounts)
+        return repaired_start
+
+    @staticmethod
+    def log_solver_start(log_file: str):
+        '''
+        Reports the solver's MIP start messages, which say whether the start was read and accepted.
+        '''
+        with open(log_file) as f:
+            start_lines = [line.strip() for line in f if 'mipstart' in line.lower()]
+        for line in start_lines:
+            logger.info(f"Solver: {line}")
+        if not start_lines:
+            logger.warning("Solver did not report on the MIP start.")
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
+import numpy as np
 from typing import List
 
 @dataclass
@@ -60,41 +61,232 @@ class TotalOutput:
             self.total_co2_emissions += edge.target_co2_emissions + edge.transport_co2_emissions
 
 
+@dataclass
+class SolutionQuality:
+    proven_optimal: bool
+    objective: float
+    bound: float
+    gap: float
+
+
+class EdgeView:
+    '''
+    One row of a SupplyChain with the attributes of an Edge, read from and written to the chain's columns.
+    '''
+    __slots__ = ('chain', 'row')
+
+    def __init__(self, chain: 'SupplyChain', row: int):
+        object.__setattr__(self, 'chain', chain)
+        object.__setattr__(self, 'row', row)
+
+    def __getattr__(self, name):
+        return self.chain.get_value(name, self.row)
+
+    def __setattr__(self, name, value):
+        self.chain.set_value(name, self.row, value)
+
+    def __repr__(self):
+        return repr(self.to_edge())
+
+    def to_dict(self) -> dict:
+        return {name: self.chain.get_value(name, self.row) for name in SupplyChain.FIELDS}
+
+    def to_edge(self) -> Edge:
+        return Edge(**self.to_dict())
+
+
+class EdgeSequence:
+    '''
+    The rows of a SupplyChain as a sequence of EdgeView, without copying the columns.
+    '''
+    def __init__(self, chain: 'SupplyChain'):
+        self.chain = chain
+
+    def __len__(self):
+        return len(self.chain)
+
+    def __iter__(self):
+        return (EdgeView(self.chain, row) for row in range(len(self.chain)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [EdgeView(self.chain, row) for row in range(*index.indices(len(self.chain)))]
+        if index < 0:
+            index += len(self.chain)
+        if not 0 <= index < len(self.chain):
+            raise IndexError(f"Edge {index} out of range.")
+        return EdgeView(self.chain, index)
+
+
 class SupplyChain:
-    def __init__(self, supply_chain:List[Edge]):
-        self.supply_chain = supply_chain
+    '''
+    The edges of a plan stored by column. The sites, vehicles, stage and site types are category codes into a list of
+    their values, the amounts, costs and emissions are float arrays. The edges are still available as Edge-like rows
+    through supply_chain, and can be looked up by source, target and vehicle.
+    '''
+    FIELDS = tuple(f.name for f in fields(Edge))
+    CATEGORY_FIELDS = ('stage', 'source_id', 'source_name', 'source_type', 'target_id', 'target_name', 'target_type', 'vehicle_company', 'vehicle_type')
+    NUMERIC_FIELDS = ('source_cost', 'source_co2_emissions', 'target_cost', 'target_co2_emissions', 'amount', 'transport_cost', 'transport_co2_emissions')
+
+    def __init__(self, supply_chain: List[Edge] = None, quality: SolutionQuality = None):
+        supply_chain = supply_chain or []
+        self.set_columns({name: [getattr(edge, name) for edge in supply_chain] for name in self.FIELDS})
         self.metrics: TotalOutput = TotalOutput(0, 0, 0)
+        self.quality = quality
+
+    @classmethod
+    def from_columns(cls, columns: dict, quality: SolutionQuality = None) -> 'SupplyChain':
+        '''
+        Creates a supply chain from one sequence of values per Edge field, without creating any edges.
+        '''
+        supply_chain = cls(quality=quality)
+        supply_chain.set_columns(columns)
+        return supply_chain
+
+    @classmethod
+    def from_records(cls, records: List[dict], quality: SolutionQuality = None) -> 'SupplyChain':
+        return cls.from_columns({name: [record[name] for record in records] for name in cls.FIELDS}, quality)
+
+    @classmethod
+    def concatenate(cls, supply_chains: List['SupplyChain'], quality: SolutionQuality = None) -> 'SupplyChain':
+        columns = {name: [] for name in cls.FIELDS}
+        for supply_chain in supply_chains:
+            for name in cls.CATEGORY_FIELDS:
+                columns[name].extend(supply_chain.get_column(name))
+            for name in cls.NUMERIC_FIELDS:
+                columns[name].append(supply_chain.columns[name])
+        for name in cls.NUMERIC_FIELDS:
+            columns[name] = np.concatenate(columns[name]) if columns[name] else []
+        return cls.from_columns(columns, quality)
+
+    def select(self, rows: np.ndarray, quality: SolutionQuality = None) -> 'SupplyChain':
+        '''
+        A new supply chain with copies of the given rows, sharing this one's category values.
+        '''
+        supply_chain = SupplyChain(quality=quality)
+        supply_chain.categories = {name: list(values) for name, values in self.categories.items()}
+        supply_chain.category_codes = {name: dict(codes) for name, codes in self.category_codes.items()}
+        supply_chain.columns = {name: column[rows] for name, column in self.columns.items()}
+        return supply_chain
+
+    def set_columns(self, columns: dict):
+        lengths = {len(columns[name]) for name in self.FIELDS}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths {sorted(lengths)}.")
+        self.categories: dict[str, list] = {}
+        self.category_codes: dict[str, dict] = {}
+        self.columns: dict[str, np.ndarray] = {}
+        for name in self.CATEGORY_FIELDS:
+            codes = {}
+            self.columns[name] = np.array([codes.setdefault(value, len(codes)) for value in columns[name]], dtype=np.int32)
+            self.category_codes[name] = codes
+            self.categories[name] = list(codes)
+        for name in self.NUMERIC_FIELDS:
+            self.columns[name] = np.asarray(columns[name], dtype=float).copy()
+        self.index = None
+
+    def __len__(self):
+        return len(self.columns['amount'])
+
+    @property
+    def supply_chain(self) -> EdgeSequence:
+        return EdgeSequence(self)
+
+    def get_column(self, name: str, rows: slice = slice(None)) -> list:
+        '''
+        The values of a field for every edge, or the given rows, decoded for the category fields.
+        '''
+        if name in self.categories:
+            categories = self.categories[name]
+            return [categories[code] for code in self.columns[name][rows].tolist()]
+        return self.columns[name][rows].tolist()
+
+    def get_value(self, name: str, row: int):
+        if name in self.categories:
+            return self.categories[name][self.columns[name][row]]
+        if name in self.columns:
+            return float(self.columns[name][row])
+        raise AttributeError(f"Edge has no attribute {name}.")
+
+    def set_value(self, name: str, row: int, value):
+        if name in self.categories:
+            codes = self.category_codes[name]
+            if value not in codes:
+                codes[value] = len(codes)
+                self.categories[name].append(value)
+            self.columns[name][row] = codes[value]
+            self.index = None
+        elif name in self.columns:
+            self.columns[name][row] = value
+        else:
+            raise AttributeError(f"Edge has no attribute {name}.")
+
+    def get_stage_mask(self, stage: str) -> np.ndarray:
+        code = self.category_codes['stage'].get(stage)
+        return self.columns['stage'] == code if code is not None else np.zeros(len(self), dtype=bool)
 
     def get_totals(self):
         """
         This method returns the total amounts, costs, and co2 emissions for a given list of flow outputs.
         """
-        for edge in self.supply_chain:
-            self.metrics.update_metrics_for_edge(edge)
+        columns = self.columns
+        supply = self.get_stage_mask('supply')
+        staged = supply | self.get_stage_mask('distribution')
+        distribution = staged & ~supply
+        self.metrics.total_amount += float(columns['amount'][distribution].sum())
+        self.metrics.total_cost += float(columns['source_cost'][supply].sum() + columns['target_cost'][staged].sum() + columns['transport_cost'][staged].sum())
+        self.metrics.total_co2_emissions += float(columns['source_co2_emissions'][supply].sum() + columns['target_co2_emissions'][staged].sum() + columns['transport_co2_emissions'][staged].sum())
+
+    def get_site_amounts(self, stage: str, site: str = 'target_id') -> dict:
+        '''
+        The total amount each target receives at the stage, or each source sends if the site is 'source_id'.
+        '''
+        mask = self.get_stage_mask(stage)
+        totals = np.bincount(self.columns[site][mask], weights=self.columns['amount'][mask], minlength=len(self.categories[site]))
+        return {name: amount for name, amount in zip(self.categories[site], totals.tolist()) if amount}
 
     @classmethod
     def append_edge(self, edge:Edge, supply_chain:List[Edge]):
         supply_chain = supply_chain.append(edge)
 
     def plan_to_list(self):
-        supply_chain_dict = self.__dict__.copy()
-        supply_chain_dict['supply_chain'] = [edge.__dict__ for edge in supply_chain_dict['supply_chain']]
-        supply_chain_dict['metrics'] = supply_chain_dict['metrics'].__dict__
-        return supply_chain_dict
+        columns = [self.get_column(name) for name in self.FIELDS]
+        return {'supply_chain': [dict(zip(self.FIELDS, row)) for row in zip(*columns)],
+                'metrics': self.metrics.__dict__.copy(),
+                'quality': self.quality.__dict__.copy() if self.quality else None}
     
     @classmethod
     def list_to_plan(self, supply_chain_list):
-        supply_chain = []
-        for edge in supply_chain_list:
-            SupplyChain.append_edge(edge=Edge(**edge), supply_chain=supply_chain)
-        supply_chain = SupplyChain(supply_chain)
+        supply_chain = SupplyChain.from_records(supply_chain_list)
         supply_chain.get_totals()
         return supply_chain
 
+    def get_index(self) -> dict[tuple, int]:
+        '''
+        Maps the source, target and vehicle codes of each edge to its row, the first row if there are several.
+        '''
+        if self.index is None:
+            keys = zip(*(self.columns[name].tolist() for name in ('source_id', 'source_name', 'target_id', 'target_name', 'vehicle_company', 'vehicle_type')))
+            self.index = {}
+            for row, key in enumerate(keys):
+                self.index.setdefault(key, row)
+                self.index.setdefault(key[:4], row)
+        return self.index
+
+    def get_edge(self, source_id, source_name, target_id, target_name, vehicle_company=None, vehicle_type=None) -> EdgeView:
+        '''
+        Returns the edge between the source and target on the vehicle, or the first one on any vehicle if no vehicle is given.
+        '''
+        key = [source_id, source_name, target_id, target_name]
+        if vehicle_company is not None or vehicle_type is not None:
+            key.extend((vehicle_company, vehicle_type))
+        names = ('source_id', 'source_name', 'target_id', 'target_name', 'vehicle_company', 'vehicle_type')
+        codes = tuple(self.category_codes[name].get(value) for name, value in zip(names, key))
+        row = self.get_index().get(codes) if None not in codes else None
+        return EdgeView(self, row) if row is not None else None
+
     def get_edge_by_source_and_target(self, source_id, source_name, target_id, target_name):
-        for edge in self.supply_chain:
-            if (edge.source_id, edge.source_name, edge.target_id, edge.target_name) == (source_id, source_name, target_id, target_name):
-                return edge
+        return self.get_edge(source_id, source_name, target_id, target_name)
 
 
 
@@ -1,14 +1,18 @@
 from abc import ABC, abstractmethod
 from collections import defaultdict
 import logging
+import numpy as np
 from mapper import SupplierGeometryMapper, WarehouseGeometryMapper, RestaurantGeometryMapper
+import orjson
 from optimisers.optimiser import SupplyChainOptimisation
 from output.output import (VendorOutput,
                            WarehouseOutput,
                            RestaurantOutput,
                            Edge,
                            SupplyChain,
+                           SolutionQuality,
                            TotalOutput)
+from pulp import LpSolutionIntegerFeasible, LpSolutionOptimal
 from typing import List
 
 logger = logging.getLogger(__name__)
@@ -25,30 +29,70 @@ class Outputter(ABC):
 
 class OptimisationOutputter(Outputter):
     def __init__(self, optimiser: SupplyChainOptimisation):
+        self.quality: SolutionQuality = None
         self.optimiser = self.confirm_optimal_solution(optimiser)
 
     def confirm_optimal_solution(self, optimiser: SupplyChainOptimisation):
-        if optimiser.problem.status == 1:
-            return optimiser
-        else:
-            logger.warning("No optimal solution found.")
+        '''
+        Accepts optimal solutions and feasible ones that are not proven optimal, e.g. the incumbent at a deadline,
+        and flags which one it is in the quality of the output.
+        '''
+        if optimiser.problem.sol_status not in (LpSolutionOptimal, LpSolutionIntegerFeasible):
+            logger.warning("No feasible solution found.")
             return
+        stats = optimiser.solve_stats
+        if stats is None:
+            self.quality = SolutionQuality(optimiser.problem.sol_status == LpSolutionOptimal, optimiser.problem.objective.value(), None, None)
+        else:
+            self.quality = SolutionQuality(stats.proven_optimal, stats.objective, stats.bound, stats.gap)
+        if not self.quality.proven_optimal:
+            gap = f"{self.quality.gap:.2%}" if self.quality.gap is not None else "unknown"
+            logger.warning(f"Solution is feasible but not proven optimal, objective {self.quality.objective}, bound {self.quality.bound}, gap {gap}.")
+        self.optimiser = optimiser
+        self.extract_solution()
+        return optimiser
         
     def create_table_output(self):
-        supply_output = []
-        for supply in self.optimiser.supply:
-            if self.optimiser.supply[supply].varValue > 0:
-                flow_output = self.create_flow_output(supply, self.optimiser.supply, supply=True)
-                supply_output.append(flow_output)
-            
-        distribution_output = []
-        for distribution in self.optimiser.distribution:
-            if self.optimiser.distribution[distribution].varValue > 0:
-                flow_output = self.create_flow_output(distribution, self.optimiser.distribution, supply=False)
-                distribution_output.append(flow_output)
-
-        supply_output.extend(distribution_output)
-        return SupplyChain(supply_output)
+        supply_output = self.create_stage_output(supply=True)
+        distribution_output = self.create_stage_output(supply=False)
+        for name, column in distribution_output.items():
+            supply_output[name] = np.concatenate([supply_output[name], column]) if isinstance(column, np.ndarray) else supply_output[name] + column
+        return SupplyChain.from_columns(supply_output, self.quality)
+
+    def extract_solution(self):
+        '''
+        Reads every variable value once and keeps the positions of the arcs with flow on them, so the output and
+        reporting only visit the arcs that are used.
+        '''
+        compiler = self.optimiser.objective_compiler
+        self.supply_values, self.distribution_values = compiler.get_solution_values(self.optimiser.supply, self.optimiser.distribution)
+        self.used_supply = np.flatnonzero(self.supply_values > 0)
+        self.used_distribution = np.flatnonzero(self.distribution_values > 0)
+
+    def get_used_flows(self, supply=True) -> tuple[List[tuple[str, str, str, str]], np.ndarray, np.ndarray]:
+        '''
+        Returns the used arcs of a stage with their amounts and per kg components.
+        '''
+        compiler = self.optimiser.objective_compiler
+        if supply:
+            arcs, used, values, components = compiler.supply_arcs, self.used_supply, self.supply_values, compiler.supply_components
+        else:
+            arcs, used, values, components = compiler.distribution_arcs, self.used_distribution, self.distribution_values, compiler.distribution_components
+        return [arcs[i] for i in used.tolist()], values[used], components[used]
+
+    def get_vehicle_flows(self, supply=True) -> tuple[List[tuple[str, str, str, str]], np.ndarray, np.ndarray]:
+        '''
+        Returns the used flows of a stage, on the arcs of the concrete vehicles if the optimiser collapsed them into classes.
+        A concrete vehicle has the per kg components of its class.
+        '''
+        arcs, amounts, components = self.get_used_flows(supply)
+        vehicle_reducer = self.optimiser.vehicle_reducer
+        if not vehicle_reducer:
+            return arcs, amounts, components
+        positions = {arc: i for i, arc in enumerate(arcs)}
+        expanded = vehicle_reducer.expand(list(zip(arcs, amounts.tolist())))
+        rows = [positions[(arc[0], arc[1], *vehicle_reducer.class_of[(arc[2], arc[3])])] for arc, _ in expanded]
+        return [arc for arc, _ in expanded], np.array([amount for _, amount in expanded], dtype=float), components[rows]
 
     def print_output(self):
         if self.optimiser:
@@ -56,88 +100,85 @@ class OptimisationOutputter(Outputter):
             self.print_distribution_output()
             self.print_supply_co2_output()
             self.print_distribution_co2_output()
+            self.print_component_totals()
             self.print_total_cost()
         
     def print_supply_output(self):
-        for v in self.optimiser.vendors:
-            for w in self.optimiser.warehouses:
-                for ve in self.optimiser.vehicles:
-                    if self.optimiser.supply[(v.name, w.name, ve.company, ve.name)].varValue > 0:
-                        logger.info(f"Supply {self.optimiser.supply[(v.name, w.name, ve.company, ve.name)].varValue} units from {v.name} at a cost of {self.optimiser.supply[(v.name, w.name, ve.company, ve.name)].varValue * v.cost_per_kg} and delivered to warehouse {w.name}.")
-                        logger.info(f"Inventory at warehouse {w.name} is {self.optimiser.supply[(v.name, w.name, ve.company, ve.name)].varValue} units at a cost of {self.optimiser.supply[(v.name, w.name, ve.company, ve.name)].varValue * w.storage_cost_per_kg}.")
-                        logger.info(f"Transport costs of {self.optimiser.supply[(v.name, w.name, ve.company, ve.name)].varValue * self.optimiser.supplier_warehouse_mapper.distance_mapping[v.name, w.name] * self.optimiser.vehicle_mapper.cost_mapping[(ve.company, ve.name)]} from {v.name} to {w.name} using {ve.name} from {ve.company}.")
+        arcs, amounts, components = self.get_used_flows(supply=True)
+        costs = (components * amounts[:, None]).tolist()
+        for (v, w, company, vehicle_name), amount, (supply_cost, transport_cost, storage_cost, _, _) in zip(arcs, amounts.tolist(), costs):
+            logger.info(f"Supply {amount} units from {v} at a cost of {supply_cost} and delivered to warehouse {w}.")
+            logger.info(f"Inventory at warehouse {w} is {amount} units at a cost of {storage_cost}.")
+            logger.info(f"Transport costs of {transport_cost} from {v} to {w} using {vehicle_name} from {company}.")
 
     def print_distribution_output(self):
-        for w in self.optimiser.warehouses:
-            for r in self.optimiser.restaurants:
-                for ve in self.optimiser.vehicles:
-                    if self.optimiser.distribution[(w.name, r.name, ve.company, ve.name)].varValue > 0:
-                        logger.info(f"Transport costs of {self.optimiser.distribution[(w.name, r.name, ve.company, ve.name)].varValue * self.optimiser.warehouse_restaurant_mapper.distance_mapping[w.name, r.name] * self.optimiser.vehicle_mapper.cost_mapping[(ve.company, ve.name)]} from {w.name} to {r.name} using {ve.name} from {ve.company}.")
+        arcs, amounts, components = self.get_used_flows(supply=False)
+        costs = (components * amounts[:, None]).tolist()
+        for (w, r, company, vehicle_name), (transport_cost, _, _) in zip(arcs, costs):
+            logger.info(f"Transport costs of {transport_cost} from {w} to {r} using {vehicle_name} from {company}.")
 
 
     def print_supply_co2_output(self):
-        for v in self.optimiser.vendors:
-            for w in self.optimiser.warehouses:
-                for ve in self.optimiser.vehicles:
-                    if self.optimiser.supply[(v.name, w.name, ve.company, ve.name)].varValue > 0:
-                        logger.info(f"CO2 emissions of {self.optimiser.supply[(v.name, w.name, ve.company, ve.name)].varValue * self.optimiser.supplier_warehouse_mapper.distance_mapping[v.name, w.name] * self.optimiser.vehicle_mapper.co2_mapping[(ve.company, ve.name)]} from {v.name} to {w.name} using {ve.name} from {ve.company}.")
+        arcs, amounts, components = self.get_used_flows(supply=True)
+        costs = (components * amounts[:, None]).tolist()
+        for (v, w, company, vehicle_name), (_, _, _, _, transport_co2_emissions) in zip(arcs, costs):
+            logger.info(f"CO2 emissions of {transport_co2_emissions} from {v} to {w} using {vehicle_name} from {company}.")
 
     def print_distribution_co2_output(self):
-        for w in self.optimiser.warehouses:
-            for r in self.optimiser.restaurants:
-                for ve in self.optimiser.vehicles:
-                    if self.optimiser.distribution[(w.name, r.name, ve.company, ve.name)].varValue > 0:
-                        logger.info(f"CO2 emissions of {self.optimiser.distribution[(w.name, r.name, ve.company, ve.name)].varValue * self.optimiser.warehouse_restaurant_mapper.distance_mapping[w.name, r.name] * self.optimiser.vehicle_mapper.co2_mapping[(ve.company, ve.name)]} from {w.name} to {r.name} using {ve.name} from {ve.company}.")            
+        arcs, amounts, components = self.get_used_flows(supply=False)
+        costs = (components * amounts[:, None]).tolist()
+        for (w, r, company, vehicle_name), (_, transport_co2_emissions, _) in zip(arcs, costs):
+            logger.info(f"CO2 emissions of {transport_co2_emissions} from {w} to {r} using {vehicle_name} from {company}.")
+
+    def print_component_totals(self):
+        compiler = self.optimiser.objective_compiler
+        totals = dict(zip(compiler.SUPPLY_COMPONENTS, (self.supply_values[self.used_supply] @ compiler.supply_components[self.used_supply]).tolist()))
+        totals.update(zip(compiler.DISTRIBUTION_COMPONENTS, (self.distribution_values[self.used_distribution] @ compiler.distribution_components[self.used_distribution]).tolist()))
+        for component, total in totals.items():
+            logger.info(f"Total {component.replace('_', ' ')}: {total}")
 
     def print_total_cost(self):
         logger.info(f"Total cost: {self.optimiser.problem.objective.value()}")
 
-    def create_flow_output(self, flow, chain, supply=True):
-        source_id = flow[0]
-        source_name = flow[0]
-        target_id = flow[1]
-        target_name = flow[1]
-        vehicle_company = flow[2]
-        vehicle_type = flow [3]
-        amount = chain[flow].varValue
-
+    def create_stage_output(self, supply=True) -> dict:
+        '''
+        Creates the columns of a stage's edges, with every cost and CO2 column computed for all of its used flows at once.
+        '''
+        arcs, amounts, components = self.get_vehicle_flows(supply)
+        costs = components * amounts[:, None]
+        n_edges = len(arcs)
         if supply:
-            stage = 'supply'
-            source_type = 'farm'
-            source_cost = chain[flow].varValue * self.optimiser.supplier_cost_mapper.supplier_mapping[source_id]
-            source_co2_emissions = chain[flow].varValue * self.optimiser.supplier_cost_mapper.supplier_co2_mapping[source_id]
-            target_type = 'warehouse'
-            target_cost = chain[flow].varValue * self.optimiser.warehouse_cost_mapper.warehouse_mapping[target_id]
-            target_co2_emissions = 0
-            transport_cost = chain[flow].varValue * self.optimiser.supplier_warehouse_mapper.distance_mapping[(source_id, target_id)] * self.optimiser.vehicle_mapper.cost_mapping[(vehicle_company, vehicle_type)]
-            transport_co2_emissions = chain[flow].varValue * self.optimiser.supplier_warehouse_mapper.distance_mapping[(source_id, target_id)] * self.optimiser.vehicle_mapper.co2_mapping[(vehicle_company, vehicle_type)]
+            stage, source_type, target_type = 'supply', 'farm', 'warehouse'
+            source_cost = costs[:, 0]
+            source_co2_emissions = costs[:, 3]
+            target_cost = costs[:, 2]
+            transport_cost = costs[:, 1]
+            transport_co2_emissions = costs[:, 4]
         else:
-            stage = 'distribution'
-            source_type = 'warehouse'
-            source_cost = chain[flow].varValue * self.optimiser.warehouse_cost_mapper.warehouse_mapping[source_id]
-            source_co2_emissions = 0
-            target_type = 'restaurant'
-            target_cost = 0
-            target_co2_emissions = 0
-            transport_cost = chain[flow].varValue * self.optimiser.warehouse_restaurant_mapper.distance_mapping[(source_id, target_id)] * self.optimiser.vehicle_mapper.cost_mapping[(vehicle_company, vehicle_type)]
-            transport_co2_emissions = chain[flow].varValue * self.optimiser.warehouse_restaurant_mapper.distance_mapping[(source_id, target_id)] * self.optimiser.vehicle_mapper.co2_mapping[(vehicle_company, vehicle_type)]
-
-        return Edge(stage=stage,
-                    source_id=source_id,
-                    source_name=source_name,
-                    source_type=source_type,
-                    source_cost=source_cost,
-                    source_co2_emissions=source_co2_emissions,
-                    target_id=target_id,
-                    target_name=target_name,
-                    target_type=target_type,
-                    target_cost=target_cost,
-                    target_co2_emissions=target_co2_emissions,
-                    vehicle_company=vehicle_company,
-                    vehicle_type=vehicle_type,
-                    amount=amount,
-                    transport_cost=transport_cost,
-                    transport_co2_emissions=transport_co2_emissions)
+            stage, source_type, target_type = 'distribution', 'warehouse', 'restaurant'
+            source_cost = costs[:, 2]
+            source_co2_emissions = np.zeros(n_edges)
+            target_cost = np.zeros(n_edges)
+            transport_cost = costs[:, 0]
+            transport_co2_emissions = costs[:, 1]
+        sources = [arc[0] for arc in arcs]
+        targets = [arc[1] for arc in arcs]
+        return {'stage': [stage] * n_edges,
+                'source_id': sources,
+                'source_name': sources,
+                'source_type': [source_type] * n_edges,
+                'source_cost': source_cost,
+                'source_co2_emissions': source_co2_emissions,
+                'target_id': targets,
+                'target_name': targets,
+                'target_type': [target_type] * n_edges,
+                'target_cost': target_cost,
+                'target_co2_emissions': np.zeros(n_edges),
+                'vehicle_company': [arc[2] for arc in arcs],
+                'vehicle_type': [arc[3] for arc in arcs],
+                'amount': amounts,
+                'transport_cost': transport_cost,
+                'transport_co2_emissions': transport_co2_emissions}
     
     def create_site_from_flow(self, flow_list: List[Edge]):
         amounts = defaultdict(float)
@@ -147,33 +188,94 @@ class OptimisationOutputter(Outputter):
             amounts[flow.source] += flow.amount
 
 class JSONOutputter:
+    '''
+    Turns a plan into GeoJSON line features followed by the metrics, the supply per restaurant and the solution quality.
+    The plan is either a SupplyChain or the dict from its plan_to_list. The features can be built as a list or streamed
+    to anything with a write method, e.g. a file or a socket's makefile, one chunk of edges at a time so the memory
+    used does not grow with the plan. The metrics and restaurant supply are totalled while the features are made.
+    '''
+    # edges decoded and written at a time when streaming a SupplyChain
+    CHUNK_SIZE = 10000
+
     def __init__(self, supply_chain_plan, vendors, warehouses, restaurants):
         self.supply_chain_plan = supply_chain_plan
         self.supplier_geometry = SupplierGeometryMapper(vendors)
         self.warehouses = WarehouseGeometryMapper(warehouses)
         self.restaurants = RestaurantGeometryMapper(restaurants)
+        self.metrics: TotalOutput = None
+        self.restaurant_supply: dict[str, float] = None
 
     def create_json(self):
-        output = []
-        restaurant_counter = defaultdict(int)
-        for linestring in self.supply_chain_plan['supply_chain']:
-            source_geoms = self.get_source_geometry(linestring)
-            target_geoms = self.get_target_geometry(linestring)
-
-            single_output = {}
-            single_output['type'] = 'Feature'
-            single_output['geometry'] = {"type": "LineString", "coordinates": [source_geoms, target_geoms]}
-            single_output['properties'] = linestring
-            output.append(single_output)
-        
-            if linestring['stage']=='distribution':
-                restaurant_counter[linestring['target_id']] += linestring['amount']
-        metrics = {'metrics': self.supply_chain_plan['metrics']}
-        restaurant_supply = {'restaurant_supply': restaurant_counter}
-        output.append(metrics)
-        output.append(restaurant_supply)
+        output = list(self.iter_features())
+        output.extend(self.get_summary())
         return output
-    
+
+    def write_json(self, file):
+        '''
+        Writes the same JSON as create_json returns, without holding more than a chunk of features at a time.
+        '''
+        file.write('[')
+        for chunk in self.iter_feature_chunks():
+            if chunk:
+                # the chunk's list brackets are left out so the chunks join into one list
+                file.write(orjson.dumps(chunk)[1:-1].decode() + ',')
+        file.write(orjson.dumps(self.get_summary())[1:].decode())
+
+    def iter_features(self):
+        for chunk in self.iter_feature_chunks():
+            yield from chunk
+
+    def iter_feature_chunks(self):
+        '''
+        Yields the features in lists of up to CHUNK_SIZE, totalling the metrics and restaurant supply as it goes.
+        '''
+        self.metrics = TotalOutput(0, 0, 0)
+        self.restaurant_supply = defaultdict(float)
+        for linestrings in self.iter_linestring_chunks():
+            chunk = []
+            for linestring in linestrings:
+                chunk.append({'type': 'Feature',
+                              'geometry': {"type": "LineString", "coordinates": [self.get_source_geometry(linestring), self.get_target_geometry(linestring)]},
+                              'properties': linestring})
+                self.add_to_totals(linestring)
+            yield chunk
+
+    def iter_linestring_chunks(self):
+        plan = self.supply_chain_plan
+        if isinstance(plan, SupplyChain):
+            for start in range(0, len(plan), self.CHUNK_SIZE):
+                rows = slice(start, start + self.CHUNK_SIZE)
+                columns = [plan.get_column(name, rows) for name in plan.FIELDS]
+                yield [dict(zip(plan.FIELDS, row)) for row in zip(*columns)]
+        else:
+            linestrings = plan['supply_chain']
+            for start in range(0, len(linestrings), self.CHUNK_SIZE):
+                yield linestrings[start:start + self.CHUNK_SIZE]
+
+    def add_to_totals(self, linestring: dict):
+        if linestring['stage'] == 'supply':
+            self.metrics.total_cost += linestring['source_cost'] + linestring['target_cost'] + linestring['transport_cost']
+            self.metrics.total_co2_emissions += linestring['source_co2_emissions'] + linestring['target_co2_emissions'] + linestring['transport_co2_emissions']
+        elif linestring['stage'] == 'distribution':
+            self.metrics.total_amount += linestring['amount']
+            self.metrics.total_cost += linestring['target_cost'] + linestring['transport_cost']
+            self.metrics.total_co2_emissions += linestring['target_co2_emissions'] + linestring['transport_co2_emissions']
+            self.restaurant_supply[linestring['target_id']] += linestring['amount']
+
+    def get_summary(self) -> List[dict]:
+        '''
+        The entries after the features, once they have all been made.
+        '''
+        plan = self.supply_chain_plan
+        if isinstance(plan, SupplyChain):
+            quality = plan.quality.__dict__ if plan.quality else None
+        else:
+            quality = plan.get('quality')
+        summary = [{'metrics': self.metrics.__dict__}, {'restaurant_supply': dict(self.restaurant_supply)}]
+        if quality:
+            summary.append({'quality': quality})
+        return summary
+
     def get_source_geometry(self, linestring):
         if linestring['stage'] == 'supply':
             return self.supplier_geometry.supplier_geometry_mapping[linestring['source_id']]
@@ -1,14 +1,22 @@
+from dataclasses import replace
+from datetime import datetime
 from data_objects.flows import SupplierWarehouseDistance, WarehouseRestaurantDistance
 from data_objects.sites import Vendor, Warehouse, Restaurant
 from data_objects.vehicles import Vehicle
 import logging
+from optimisers.feasibility import FeasibilityAnalyser, FeasibilityReport
+from optimisers.model_cache import ModelCache
 from optimisers.optimiser import SupplyChainOptimisation
 from optimisers.profit_maximiser import SupplyChainProfitMaximiser
+from optimisers.size_estimator import ModelBudget, SolveHistory
+from optimisers.solvers import SolverConfig
 import os
 from output.outputter import OptimisationOutputter, JSONOutputter
-from output.output import SupplyChain
+from output.output import Edge, SupplyChain
+from planners.planner import Planner
 from readers.restaurant_reader import RestaurantReader
 from readers.supplier_warehouse_distances_reader import SupplierWarehouseDistanceReader
+from readers.supply_chain_reader import SupplyChainReader
 from readers.vehicle_reader import VehicleReader
 from readers.vendor_reader import VendorReader
 from readers.warehouse_reader import WarehouseReader
@@ -19,14 +27,30 @@ from typing import List
 
 logger = logging.getLogger(__name__)
 
-class CostMinimiserPlanner:
+class CostMinimiserPlanner(Planner):
     USER = os.getenv('CSCUSER')
     PASSWORD = os.getenv('CSCPASSWORD')
     HOST = os.getenv('CSCHOST')
     PORT = os.getenv('CSCPORT')
+    # seconds kept back from the deadline for building the output, and the least time the solver is given
+    DEADLINE_MARGIN = 10
+    MIN_TIME_LIMIT = 1
+    # with a deadline the solver stops within this gap of the bound, unless a gap is configured
+    DEADLINE_GAP = 0.02
 
     def __init__(self,
                 cost_co2_split=0.5,
+                model_backend='pulp',
+                solve_mode='exact',
+                warm_start=False,
+                solver_config: SolverConfig = None,
+                model_cache: ModelCache = None,
+                reduce_vehicles=False,
+                nearest_warehouses=None,
+                budget: ModelBudget = None,
+                solve_history: SolveHistory = None,
+                deadline: datetime = None,
+                check_feasibility=False,
                 #  vendors_input,
                 #  warehouses_input,
                 #  restaurants_input,
@@ -35,6 +59,20 @@ class CostMinimiserPlanner:
                 #  warehouse_restaurant_distance_input
                  ):
         self.cost_co2_split = cost_co2_split
+        self.model_backend = model_backend
+        self.solve_mode = solve_mode
+        self.warm_start = warm_start
+        self.solver_config = solver_config or SolverConfig.from_env()
+        self.model_cache = model_cache
+        self.reduce_vehicles = reduce_vehicles
+        self.nearest_warehouses = nearest_warehouses
+        self.budget = budget
+        self.fitted_solve_mode = solve_mode
+        self.fitted_nearest_warehouses = nearest_warehouses
+        self.solve_history = solve_history
+        self.deadline = deadline
+        self.check_feasibility = check_feasibility
+        self.feasibility_report: FeasibilityReport = None
         self.vendors_input: List[Vendor] = None
         self.warehouses_input: List[Warehouse] = None
         self.restaurants_input: List[Restaurant] = None
@@ -49,13 +87,22 @@ class CostMinimiserPlanner:
         self.warehouse_restaurant_distance = []
         self.supply_chain: SupplyChain = None
         self.json_output = None
+        self.optimiser = None
+        self.previous_plan: List[Edge] = None
 
-    def run(self):
+    def run(self, output_file=None):
+        '''
+        With check_feasibility, a demand the network cannot carry goes straight to the profit maximiser without trying the cost minimiser.
+        With an output file the JSON output is streamed to it rather than built in memory.
+        '''
         self.get_data()
-        self.optimise()
-        if self.optimiser.problem.status != 1:
+        if self.check_feasibility and not self.analyse_feasibility().feasible:
             self.loose_optimise()
-        self.create_output()
+        else:
+            self.optimise()
+            if not self.optimiser.solve_stats.has_solution:
+                self.loose_optimise()
+        self.create_output(output_file)
 
     def get_data(self):
         vendors = VendorReader(self.vendors_input)
@@ -89,37 +136,118 @@ class CostMinimiserPlanner:
         logger.info("Read all data.")
 
     def optimise(self):
-        self.optimiser = SupplyChainOptimisation(
-                                                 cost_co2_split=self.cost_co2_split,
-                                                 vendors=self.vendors,
-                                                 warehouses=self.warehouses,
-                                                 restaurants=self.restaurants,
-                                                 vehicles=self.vehicles,
-                                                 supplier_warehouse_distances=self.supplier_warehouse_distance,
-                                                 warehouse_restaurant_distances=self.warehouse_restaurant_distance)
-    
-        self.optimiser.solve()
+        self.previous_plan = None
+        self.fit_budget()
+        self.solve_widening(self.create_optimiser)
 
     def loose_optimise(self):
-        self.optimiser = SupplyChainProfitMaximiser(cost_co2_split=self.cost_co2_split,
-                                                    vendors=self.vendors,
-                                                    warehouses=self.warehouses,
-                                                    restaurants=self.restaurants,
-                                                    vehicles=self.vehicles,
-                                                    supplier_warehouse_distances=self.supplier_warehouse_distance,
-                                                    warehouse_restaurant_distances=self.warehouse_restaurant_distance)
-    
-        self.optimiser.solve()
-
-    def create_output(self):
+        '''
+        Relaxes the infeasible cost minimising model into the profit maximising one in place, so its arcs, variables and
+        constraints are not built again. When the cost minimiser was skipped the profit maximiser is built from scratch.
+        '''
+        if self.optimiser is None:
+            self.fit_budget()
+            self.solve_widening(self.create_loose_optimiser)
+            return
+        self.optimiser = SupplyChainProfitMaximiser.from_model(self.optimiser)
+        self.optimiser.solver_config = self.get_solver_config()
+        self.solve_optimiser()
+
+    def analyse_feasibility(self) -> FeasibilityReport:
+        analyser = FeasibilityAnalyser(vendors=self.vendors,
+                                       warehouses=self.warehouses,
+                                       restaurants=self.restaurants,
+                                       vehicles=self.vehicles,
+                                       supplier_warehouse_distances=self.supplier_warehouse_distance,
+                                       warehouse_restaurant_distances=self.warehouse_restaurant_distance)
+        self.feasibility_report = analyser.analyse()
+        return self.feasibility_report
+
+    def get_solver_config(self) -> SolverConfig:
+        '''
+        With a deadline the solver stops at its own time limit or at the deadline less DEADLINE_MARGIN, whichever is first,
+        and the best incumbent found by then is used for the plan.
+        '''
+        if not self.deadline:
+            return self.solver_config
+        time_limit = max((self.deadline - datetime.now()).total_seconds() - self.DEADLINE_MARGIN, self.MIN_TIME_LIMIT)
+        if self.solver_config.time_limit is not None:
+            time_limit = min(time_limit, self.solver_config.time_limit)
+        gap_rel = self.solver_config.gap_rel if self.solver_config.gap_rel is not None else self.DEADLINE_GAP
+        logger.info(f"Solving to a deadline of {self.deadline}, with a time limit of {time_limit:.0f} seconds and a gap of {gap_rel:.2%}.")
+        return replace(self.solver_config, time_limit=time_limit, gap_rel=gap_rel)
+
+    def get_solve_mode(self) -> str:
+        # an exact solve stopped at the deadline may have no incumbent, the anytime mode always has the rounded plan
+        return 'anytime' if self.deadline and self.fitted_solve_mode == 'exact' else self.fitted_solve_mode
+
+    def create_optimiser(self, nearest_warehouses: int = None) -> SupplyChainOptimisation:
+        return SupplyChainOptimisation(cost_co2_split=self.cost_co2_split,
+                                       vendors=self.vendors,
+                                       warehouses=self.warehouses,
+                                       restaurants=self.restaurants,
+                                       vehicles=self.vehicles,
+                                       supplier_warehouse_distances=self.supplier_warehouse_distance,
+                                       warehouse_restaurant_distances=self.warehouse_restaurant_distance,
+                                       solver_config=self.get_solver_config(),
+                                       model_cache=self.model_cache,
+                                       reduce_vehicles=self.reduce_vehicles,
+                                       nearest_warehouses=nearest_warehouses)
+
+    def create_loose_optimiser(self, nearest_warehouses: int = None) -> SupplyChainProfitMaximiser:
+        return SupplyChainProfitMaximiser(cost_co2_split=self.cost_co2_split,
+                                          vendors=self.vendors,
+                                          warehouses=self.warehouses,
+                                          restaurants=self.restaurants,
+                                          vehicles=self.vehicles,
+                                          supplier_warehouse_distances=self.supplier_warehouse_distance,
+                                          warehouse_restaurant_distances=self.warehouse_restaurant_distance,
+                                          solver_config=self.get_solver_config(),
+                                          model_cache=self.model_cache,
+                                          reduce_vehicles=self.reduce_vehicles,
+                                          nearest_warehouses=nearest_warehouses)
+
+    def solve_optimiser(self):
+        '''
+        The previous plan is read once per optimise and reused for every model it solves.
+        '''
+        if self.warm_start:
+            if self.previous_plan is None:
+                self.previous_plan = self.get_previous_plan()
+            self.optimiser.set_warm_start(self.previous_plan)
+        super().solve_optimiser()
+
+    def get_previous_plan(self) -> List[Edge]:
+        supply_chain = SupplyChainReader()
+        supply_chain.run()
+        logger.info(f"Read {len(supply_chain.data.supply_chain)} edges of the previous plan from db.")
+        return supply_chain.data.supply_chain
+
+    def create_output(self, output_file=None):
         logger.info("Building output.")
         outputter = OptimisationOutputter(optimiser=self.optimiser)
         self.supply_chain = outputter.create_table_output()
+        self.create_json_output(output_file)
+
+    def create_json_output(self, output_file=None):
+        '''
+        With an output file the features are streamed to it and json_output is left empty, so they are never all held in memory.
+        '''
         self.supply_chain.get_totals()
+        if output_file is None:
+            self.json_output = self.get_json_outputter().create_json()
+        else:
+            self.json_output = None
+            self.write_json_output(output_file)
 
-        supply_chain_plan = self.supply_chain.plan_to_list()
-        json_outputter = JSONOutputter(supply_chain_plan=supply_chain_plan,
-                                       vendors=self.vendors,
-                                       warehouses=self.warehouses,
-                                       restaurants=self.restaurants)
-        self.json_output = json_outputter.create_json()
+    def write_json_output(self, file):
+        '''
+        Streams the JSON output to a file or socket instead of building it in memory.
+        '''
+        self.get_json_outputter().write_json(file)
+
+    def get_json_outputter(self) -> JSONOutputter:
+        return JSONOutputter(supply_chain_plan=self.supply_chain,
+                             vendors=self.vendors,
+                             warehouses=self.warehouses,
+                             restaurants=self.restaurants)
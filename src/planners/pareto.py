@@ -0,0 +1,99 @@
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from dataclasses import dataclass, replace
+from itertools import repeat
+import logging
+import numpy as np
+from optimisers.array_model import ArrayModel, ArrayModelBuilder
+from optimisers.objective import ObjectiveCompiler
+from optimisers.optimiser import SupplyChainOptimisation
+from optimisers.solvers import SolverConfig
+import os
+from output.outputter import OptimisationOutputter
+from output.output import SupplyChain
+from planners.cost_minimiser import CostMinimiserPlanner
+import time
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ParetoPoint:
+    cost_co2_split: float
+    total_cost: float
+    total_co2_emissions: float
+    supply_chain: SupplyChain
+
+
+# each worker process receives the shared model once, when it starts, rather than once per split
+sweep_model: ArrayModel = None
+
+def set_sweep_model(model: ArrayModel):
+    global sweep_model
+    sweep_model = model
+
+
+def solve_objective(objective: np.ndarray, solver_config: SolverConfig):
+    model = copy.copy(sweep_model)
+    model.objective = objective
+    return model.solve(solver_config)
+
+
+class ParetoSweepPlanner(CostMinimiserPlanner):
+    '''
+    Traces the cost/CO2 trade-off over a list of cost_co2_split values. The data is read once and the constraint
+    matrix is built once as an array model, then each split only changes the objective vector and is solved in a worker process.
+    '''
+    def __init__(self,
+                 splits: List[float],
+                 max_workers=None,
+                 solver_config: SolverConfig = None):
+        super().__init__(cost_co2_split=splits[0], model_backend='array', solver_config=solver_config)
+        self.splits = splits
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.frontier: List[ParetoPoint] = []
+
+    def run(self):
+        self.get_data()
+        self.frontier = self.sweep(self.splits)
+
+    def sweep(self, splits: List[float]) -> List[ParetoPoint]:
+        '''
+        Returns a point for each split that has a feasible plan, in the order of the splits.
+        '''
+        start_time = time.time()
+        self.optimiser = SupplyChainOptimisation(cost_co2_split=splits[0],
+                                                 vendors=self.vendors,
+                                                 warehouses=self.warehouses,
+                                                 restaurants=self.restaurants,
+                                                 vehicles=self.vehicles,
+                                                 supplier_warehouse_distances=self.supplier_warehouse_distance,
+                                                 warehouse_restaurant_distances=self.warehouse_restaurant_distance,
+                                                 solver_config=self.solver_config)
+        compiler = ObjectiveCompiler(self.optimiser)
+        self.optimiser.objective_compiler = compiler
+        objectives = [np.concatenate(compiler.get_objective_coefficients(cost_weight=split, co2_weight=1 - split)) for split in splits]
+        builder = ArrayModelBuilder(self.optimiser)
+        model = builder.build(objectives[0][:builder.n_supply], objectives[0][builder.n_supply:], restaurant_demand_sense='G', sense=self.optimiser.problem.sense)
+        logger.info(f"Built sweep model with {model.n_columns} variables and {model.n_rows} constraints in {time.time() - start_time}.")
+
+        workers = min(self.max_workers, len(splits))
+        # the cores are shared between the workers, so each solver gets its share of the threads
+        solver_config = replace(self.solver_config, threads=max(1, (self.solver_config.threads or 1) // workers))
+        with ProcessPoolExecutor(max_workers=workers, initializer=set_sweep_model, initargs=(model,)) as executor:
+            results = list(executor.map(solve_objective, objectives, repeat(solver_config)))
+
+        frontier = []
+        for split, objective, (status, sol_status, values, bound) in zip(splits, objectives, results):
+            model.objective = objective
+            self.optimiser.cost_co2_split = split
+            builder.assign_solution(model, status, sol_status, values)
+            if self.optimiser.problem.status != 1:
+                logger.warning(f"No optimal solution found for split {split}.")
+                continue
+            supply_chain = OptimisationOutputter(optimiser=self.optimiser).create_table_output()
+            supply_chain.get_totals()
+            frontier.append(ParetoPoint(split, supply_chain.metrics.total_cost, supply_chain.metrics.total_co2_emissions, supply_chain))
+
+        logger.info(f"Swept {len(splits)} splits in {time.time() - start_time}, {len(frontier)} have a plan.")
+        return frontier
@@ -0,0 +1,68 @@
+from abc import ABC, abstractmethod
+import logging
+from optimisers.size_estimator import ModelBudgetExceeded, ModelSizeEstimator
+from pulp import LpStatusInfeasible
+
+logger = logging.getLogger(__name__)
+
+class Planner(ABC):
+    '''
+    Solving shared by the cost minimiser and profit maximiser planners. Subclasses read the site and route tables into
+    vendors, warehouses, restaurants, vehicles, supplier_warehouse_distance and warehouse_restaurant_distance, and set
+    model_backend, solve_mode, nearest_warehouses, budget and solve_history. The solve mode and number of nearest
+    warehouses a run uses are kept apart from the configured ones in fitted_solve_mode and fitted_nearest_warehouses,
+    so fitting one run to the budget does not change the settings of the next.
+    '''
+
+    @abstractmethod
+    def optimise(self):
+        pass
+
+    def get_estimator(self) -> ModelSizeEstimator:
+        return ModelSizeEstimator(vendors=self.vendors,
+                                  warehouses=self.warehouses,
+                                  restaurants=self.restaurants,
+                                  vehicles=self.vehicles,
+                                  supplier_warehouse_distances=self.supplier_warehouse_distance,
+                                  warehouse_restaurant_distances=self.warehouse_restaurant_distance,
+                                  solve_history=self.solve_history)
+
+    def fit_budget(self):
+        '''
+        Fits the solve mode and number of nearest warehouses of this run to the budget, if there is one.
+        '''
+        self.fitted_solve_mode, self.fitted_nearest_warehouses = self.solve_mode, self.nearest_warehouses
+        if self.budget:
+            self.fitted_solve_mode, self.fitted_nearest_warehouses = self.budget.fit(self.get_estimator(), self.model_backend, self.solve_mode, self.nearest_warehouses)
+
+    def get_solve_mode(self) -> str:
+        return self.fitted_solve_mode
+
+    def solve_widening(self, create_optimiser):
+        '''
+        Solves with arcs to the nearest warehouses only, if set. While that model is infeasible the number of
+        warehouses is doubled and the model rebuilt, until every warehouse is a candidate.
+        With a budget the model is only widened while the wider one is within it. Past that the budget is refused, or
+        when degrading the infeasible model is kept, so the cost minimiser falls back to the profit maximiser on it.
+        '''
+        nearest_warehouses = self.fitted_nearest_warehouses
+        estimator = self.get_estimator() if self.budget else None
+        while True:
+            self.optimiser = create_optimiser(nearest_warehouses)
+            self.solve_optimiser()
+            if self.optimiser.problem.status != LpStatusInfeasible or not nearest_warehouses:
+                return
+            wider = nearest_warehouses * 2 if nearest_warehouses * 2 < len(self.warehouses) else None
+            exceeded = self.budget.get_exceeded(estimator.estimate(self.model_backend, self.get_solve_mode(), wider)) if self.budget else []
+            if exceeded and self.budget.on_exceed == 'refuse':
+                raise ModelBudgetExceeded(f"Infeasible with arcs to the {nearest_warehouses} nearest warehouses and widening is over budget: {', '.join(exceeded)}.")
+            if exceeded:
+                logger.warning(f"Infeasible with arcs to the {nearest_warehouses} nearest warehouses, not widening as it is over budget: {', '.join(exceeded)}.")
+                return
+            nearest_warehouses = wider
+            logger.warning(f"Infeasible with arcs to the nearest warehouses only, widening to {nearest_warehouses or 'all'} warehouses.")
+
+    def solve_optimiser(self):
+        self.optimiser.solve(backend=self.model_backend, mode=self.get_solve_mode())
+        if self.solve_history:
+            self.solve_history.record(self.get_estimator().measure(self.optimiser, self.model_backend), self.optimiser.solve_stats, self.get_solve_mode())
@@ -1,7 +1,11 @@
 import logging
+from optimisers.model_cache import ModelCache
 from optimisers.profit_maximiser import SupplyChainProfitMaximiser
+from optimisers.size_estimator import ModelBudget, SolveHistory
+from optimisers.solvers import SolverConfig
 import os
 from output.outputter import OptimisationOutputter
+from planners.planner import Planner
 from readers.restaurant_reader import RestaurantReader
 from readers.supplier_warehouse_distances_reader import SupplierWarehouseDistanceReader
 from readers.vehicle_reader import VehicleReader
@@ -13,7 +17,7 @@ import time
 
 logger = logging.getLogger(__name__)
 
-class ProfitMaximiserPlanner:
+class ProfitMaximiserPlanner(Planner):
     USER = os.getenv('CSCUSER')
     PASSWORD = os.getenv('CSCPASSWORD')
     HOST = os.getenv('CSCHOST')
@@ -25,13 +29,31 @@ class ProfitMaximiserPlanner:
                  restaurants_input,
                  vehicles_input,
                  supplier_warehouse_distance_input,
-                 warehouse_restaurant_distance_input):
+                 warehouse_restaurant_distance_input,
+                 model_backend='pulp',
+                 solve_mode='exact',
+                 solver_config: SolverConfig = None,
+                 model_cache: ModelCache = None,
+                 reduce_vehicles=False,
+                 nearest_warehouses=None,
+                 budget: ModelBudget = None,
+                 solve_history: SolveHistory = None):
         self.vendors_input = vendors_input
         self.warehouses_input = warehouses_input
         self.restaurants_input = restaurants_input
         self.vehicles_input = vehicles_input
         self.supplier_warehouse_distance_input = supplier_warehouse_distance_input
         self.warehouse_restaurant_distance_input = warehouse_restaurant_distance_input
+        self.model_backend = model_backend
+        self.solve_mode = solve_mode
+        self.solver_config = solver_config or SolverConfig.from_env()
+        self.model_cache = model_cache
+        self.reduce_vehicles = reduce_vehicles
+        self.nearest_warehouses = nearest_warehouses
+        self.budget = budget
+        self.fitted_solve_mode = solve_mode
+        self.fitted_nearest_warehouses = nearest_warehouses
+        self.solve_history = solve_history
         self.vendors = []
         self.warehouses = []
         self.restaurants = []
@@ -78,14 +100,24 @@ class ProfitMaximiserPlanner:
         logger.info("Read all data.")
 
     def optimise(self):
-        self.optimiser = SupplyChainProfitMaximiser(vendors=self.vendors,
-                                                    warehouses=self.warehouses,
-                                                    restaurants=self.restaurants,
-                                                    vehicles=self.vehicles,
-                                                    supplier_warehouse_distances=self.supplier_warehouse_distance,
-                                                    warehouse_restaurant_distances=self.warehouse_restaurant_distance)
-    
-        self.optimiser.solve()
+        '''
+        Solves with arcs to the nearest warehouses only, if set, doubling the number of warehouses while the model is infeasible.
+        With a budget the solve mode and number of nearest warehouses are first fitted to it.
+        '''
+        self.fit_budget()
+        self.solve_widening(self.create_optimiser)
+
+    def create_optimiser(self, nearest_warehouses: int = None) -> SupplyChainProfitMaximiser:
+        return SupplyChainProfitMaximiser(vendors=self.vendors,
+                                          warehouses=self.warehouses,
+                                          restaurants=self.restaurants,
+                                          vehicles=self.vehicles,
+                                          supplier_warehouse_distances=self.supplier_warehouse_distance,
+                                          warehouse_restaurant_distances=self.warehouse_restaurant_distance,
+                                          solver_config=self.solver_config,
+                                          model_cache=self.model_cache,
+                                          reduce_vehicles=self.reduce_vehicles,
+                                          nearest_warehouses=nearest_warehouses)
 
     def loose_optimise(self):
         pass
@@ -0,0 +1,301 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from data_objects.flows import SupplierWarehouseDistance, WarehouseRestaurantDistance
+from data_objects.sites import Vendor, Warehouse, Restaurant
+from data_objects.vehicles import Vehicle
+import logging
+import math
+import numpy as np
+from optimisers.optimiser import SupplyChainOptimisation
+from optimisers.profit_maximiser import SupplyChainProfitMaximiser
+from optimisers.solvers import SolverConfig, SolveStats
+import os
+from output.outputter import OptimisationOutputter
+from output.output import SupplyChain
+from planners.cost_minimiser import CostMinimiserPlanner
+import time
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Region:
+    name: str
+    vendors: List[Vendor]
+    warehouses: List[Warehouse]
+    restaurants: List[Restaurant]
+    vehicles: List[Vehicle]
+    supplier_warehouse_distances: List[SupplierWarehouseDistance]
+    warehouse_restaurant_distances: List[WarehouseRestaurantDistance]
+
+
+@dataclass
+class RegionResult:
+    name: str
+    status: int
+    supply_chain: SupplyChain
+    vendor_usage: dict[str, float]
+    solve_stats: SolveStats
+
+
+def solve_region(region: Region, cost_co2_split: float, solver_config: SolverConfig, model_backend: str, solve_mode: str, loose: bool = False) -> RegionResult:
+    '''
+    Solves one region in a worker process. Loose regions are solved with the profit maximiser, which does not have to meet all demand.
+    '''
+    optimiser_class = SupplyChainProfitMaximiser if loose else SupplyChainOptimisation
+    optimiser = optimiser_class(cost_co2_split=cost_co2_split,
+                                vendors=region.vendors,
+                                warehouses=region.warehouses,
+                                restaurants=region.restaurants,
+                                vehicles=region.vehicles,
+                                supplier_warehouse_distances=region.supplier_warehouse_distances,
+                                warehouse_restaurant_distances=region.warehouse_restaurant_distances,
+                                solver_config=solver_config)
+    optimiser.solve(backend=model_backend, mode=solve_mode)
+    if optimiser.problem.status != 1:
+        return RegionResult(region.name, optimiser.problem.status, None, {}, optimiser.solve_stats)
+
+    vendor_usage = defaultdict(float)
+    for arc, variable in optimiser.supply.items():
+        vendor_usage[arc[0]] += variable.varValue or 0
+    supply_chain = OptimisationOutputter(optimiser=optimiser).create_table_output()
+    return RegionResult(region.name, optimiser.problem.status, supply_chain, dict(vendor_usage), optimiser.solve_stats)
+
+
+class RegionPartitioner:
+    '''
+    Splits the warehouses into regions, either by their location or by clustering their lat/long, then gives each
+    restaurant to the region of the nearest warehouse it has a route from.
+    '''
+    def __init__(self,
+                 warehouses: List[Warehouse],
+                 restaurants: List[Restaurant],
+                 warehouse_restaurant_distances: List[WarehouseRestaurantDistance],
+                 partition_by: str = 'location',
+                 n_regions: int = None):
+        if partition_by not in ('location', 'lat_long'):
+            raise ValueError(f"Unknown partition {partition_by}.")
+        self.warehouses = warehouses
+        self.restaurants = restaurants
+        self.warehouse_restaurant_distances = warehouse_restaurant_distances
+        self.partition_by = partition_by
+        self.n_regions = n_regions
+
+    def partition(self) -> dict[str, tuple[List[Warehouse], List[Restaurant]]]:
+        warehouse_regions = self.get_warehouse_regions()
+        restaurant_regions = self.get_restaurant_regions(warehouse_regions)
+
+        regions = defaultdict(lambda: ([], []))
+        for w in self.warehouses:
+            regions[warehouse_regions[w.name]][0].append(w)
+        for r in self.restaurants:
+            regions[restaurant_regions[r.name]][1].append(r)
+        logger.info(f"Partitioned {len(self.warehouses)} warehouses and {len(self.restaurants)} restaurants into {len(regions)} regions by {self.partition_by}.")
+        return dict(regions)
+
+    def get_warehouse_regions(self) -> dict[str, str]:
+        if self.partition_by == 'location':
+            return {w.name: w.location for w in self.warehouses}
+        points = np.array([(float(w.lat), float(w.long)) for w in self.warehouses])
+        labels = self.cluster_lat_long(points, min(self.n_regions or os.cpu_count() or 1, len(self.warehouses)))
+        return {w.name: f"region_{label}" for w, label in zip(self.warehouses, labels.tolist())}
+
+    def get_restaurant_regions(self, warehouse_regions: dict[str, str]) -> dict[str, str]:
+        nearest = {}
+        for d in self.warehouse_restaurant_distances:
+            w, r = d.route_tuple
+            if w in warehouse_regions and (r not in nearest or d.distance < nearest[r][1]):
+                nearest[r] = (w, d.distance)
+
+        restaurant_regions = {}
+        for r in self.restaurants:
+            if r.name in nearest:
+                restaurant_regions[r.name] = warehouse_regions[nearest[r.name][0]]
+            else:
+                logger.warning(f"Restaurant {r.name} has no route from any warehouse, using the closest warehouse by lat/long.")
+                closest = min(self.warehouses, key=lambda w: (float(w.lat) - float(r.lat)) ** 2 + (float(w.long) - float(r.long)) ** 2)
+                restaurant_regions[r.name] = warehouse_regions[closest.name]
+        return restaurant_regions
+
+    @staticmethod
+    def cluster_lat_long(points: np.ndarray, n_regions: int, iterations: int = 50) -> np.ndarray:
+        '''
+        K-means on lat/long, started from points spread out by farthest point sampling so the result is deterministic.
+        '''
+        centres = [points[0]]
+        for _ in range(1, n_regions):
+            distances = np.min([((points - centre) ** 2).sum(axis=1) for centre in centres], axis=0)
+            centres.append(points[np.argmax(distances)])
+        centres = np.array(centres)
+
+        for _ in range(iterations):
+            labels = ((points[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+            new_centres = np.array([points[labels == k].mean(axis=0) if (labels == k).any() else centres[k] for k in range(n_regions)])
+            if np.allclose(new_centres, centres):
+                break
+            centres = new_centres
+        return labels
+
+
+class RegionalCostMinimiserPlanner(CostMinimiserPlanner):
+    '''
+    Solves the cost minimisation region by region in a process pool instead of as one national problem.
+    Vendors supply every region, so their capacity is first shared out by regional demand. Regions that cannot be
+    solved with their share are re-solved with the capacity the solved regions left unused, for a few rounds,
+    and any region still infeasible after that is solved with the profit maximiser. The regional plans are merged into one SupplyChain.
+    '''
+    def __init__(self,
+                 cost_co2_split=0.5,
+                 partition_by='location',
+                 n_regions=None,
+                 max_workers=None,
+                 reconciliation_rounds=3,
+                 model_backend='pulp',
+                 solve_mode='exact',
+                 solver_config: SolverConfig = None):
+        super().__init__(cost_co2_split=cost_co2_split,
+                         model_backend=model_backend,
+                         solve_mode=solve_mode,
+                         solver_config=solver_config)
+        self.partition_by = partition_by
+        self.n_regions = n_regions
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.reconciliation_rounds = reconciliation_rounds
+        self.regions: dict[str, tuple[List[Warehouse], List[Restaurant]]] = {}
+        self.region_demand: dict[str, float] = {}
+        self.region_vendors: dict[str, set[str]] = {}
+        self.region_results: dict[str, RegionResult] = {}
+
+    def run(self, output_file=None):
+        self.get_data()
+        self.optimise()
+        self.create_output(output_file)
+
+    def optimise(self):
+        start_time = time.time()
+        self.regions = RegionPartitioner(self.warehouses, self.restaurants, self.warehouse_restaurant_distance, self.partition_by, self.n_regions).partition()
+        self.region_demand = {name: sum(float(r.restaurant_demand) for r in restaurants) for name, (warehouses, restaurants) in self.regions.items()}
+        warehouse_regions = {w.name: name for name, (warehouses, restaurants) in self.regions.items() for w in warehouses}
+        self.region_vendors = self.get_region_vendors(warehouse_regions)
+        allocations = self.get_initial_allocations()
+
+        pending = list(self.regions)
+        for reconciliation_round in range(self.reconciliation_rounds + 1):
+            self.solve_regions(pending, allocations)
+            failed = [name for name in pending if self.region_results[name].status != 1]
+            logger.info(f"Round {reconciliation_round} solved {len(pending) - len(failed)} of {len(pending)} regions.")
+            if not failed or reconciliation_round == self.reconciliation_rounds:
+                break
+            reconciled = self.reconcile_vendor_capacity(allocations, failed)
+            if all(reconciled[name] == allocations[name] for name in failed):
+                logger.info("No spare vendor capacity left to share out.")
+                break
+            allocations, pending = reconciled, failed
+
+        failed = [name for name, result in self.region_results.items() if result.status != 1]
+        if failed:
+            logger.warning(f"Regions {', '.join(failed)} cannot meet demand, solving them with the profit maximiser.")
+            self.solve_regions(failed, allocations, loose=True)
+        logger.info(f"Solved {len(self.regions)} regions in {time.time() - start_time}.")
+
+    def get_region_vendors(self, warehouse_regions: dict[str, str]) -> dict[str, set[str]]:
+        '''
+        The vendors with a route to each region. Routes to a warehouse that is not in the warehouse table are skipped.
+        '''
+        region_vendors = {name: set() for name in self.regions}
+        unknown_warehouses = set()
+        for d in self.supplier_warehouse_distance:
+            v, w = d.route_tuple
+            if w in warehouse_regions:
+                region_vendors[warehouse_regions[w]].add(v)
+            else:
+                unknown_warehouses.add(w)
+        if unknown_warehouses:
+            logger.warning(f"Supplier distances to {len(unknown_warehouses)} warehouses not in the warehouse table are skipped, e.g. {', '.join(sorted(unknown_warehouses)[:10])}.")
+        return region_vendors
+
+    def get_initial_allocations(self) -> dict[str, dict[str, float]]:
+        allocations = {name: {} for name in self.regions}
+        for v in self.vendors:
+            for name, amount in self.share_out(float(v.capacity), self.get_vendor_weights(v, self.regions)).items():
+                allocations[name][v.name] = amount
+        return allocations
+
+    def get_vendor_weights(self, vendor: Vendor, names: List[str]) -> dict[str, float]:
+        '''
+        Weights for sharing out a vendor's capacity, the demand of each region that has a route from the vendor.
+        '''
+        return {name: self.region_demand[name] if vendor.name in self.region_vendors[name] else 0.0 for name in names}
+
+    @staticmethod
+    def share_out(amount: float, weights: dict[str, float]) -> dict[str, float]:
+        '''
+        Splits an amount in proportion to the weights in whole units with the largest remainder method, so fractional
+        capacities do not make the regional MIPs harder than the national one. Any fraction of the amount goes to the largest weight.
+        '''
+        total_weight = sum(weights.values())
+        if not total_weight:
+            return {name: 0.0 for name in weights}
+        whole = math.floor(amount)
+        exact = {name: whole * weight / total_weight for name, weight in weights.items()}
+        shares = {name: float(math.floor(value)) for name, value in exact.items()}
+        remainders = sorted(weights, key=lambda name: shares[name] - exact[name])
+        for name in remainders[:int(whole - sum(shares.values()))]:
+            shares[name] += 1
+        shares[max(weights, key=weights.get)] += amount - whole
+        return shares
+
+    def reconcile_vendor_capacity(self, allocations: dict[str, dict[str, float]], failed: List[str]) -> dict[str, dict[str, float]]:
+        '''
+        Solved regions keep the vendor capacity they used, the rest of each vendor's capacity is shared among the failed regions it can reach by demand.
+        '''
+        solved = [name for name in self.regions if name not in failed]
+        reconciled = {name: {} for name in self.regions}
+        for v in self.vendors:
+            used = 0
+            for name in solved:
+                reconciled[name][v.name] = self.region_results[name].vendor_usage.get(v.name, 0)
+                used += reconciled[name][v.name]
+            spare = max(float(v.capacity) - used, 0)
+            for name, amount in self.share_out(spare, self.get_vendor_weights(v, failed)).items():
+                reconciled[name][v.name] = amount
+        return reconciled
+
+    def solve_regions(self, names: List[str], allocations: dict[str, dict[str, float]], loose: bool = False):
+        workers = min(self.max_workers, len(names))
+        # the cores are shared between the workers, so each solver gets its share of the threads
+        solver_config = replace(self.solver_config, threads=max(1, (self.solver_config.threads or 1) // workers))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(solve_region, self.build_region(name, allocations[name]), self.cost_co2_split, solver_config, self.model_backend, self.solve_mode, loose) for name in names]
+            for future in futures:
+                result = future.result()
+                self.region_results[result.name] = result
+
+    def build_region(self, name: str, allocation: dict[str, float]) -> Region:
+        '''
+        Vendors get the region's share of their capacity. Vehicle availability is split by demand and rounded up,
+        so the regions together still use at least the number available.
+        '''
+        warehouses, restaurants = self.regions[name]
+        warehouse_names = {w.name for w in warehouses}
+        restaurant_names = {r.name for r in restaurants}
+        demand_share = self.region_demand[name] / (sum(self.region_demand.values()) or 1)
+        return Region(name=name,
+                      vendors=[replace(v, capacity=allocation.get(v.name, 0)) for v in self.vendors],
+                      warehouses=warehouses,
+                      restaurants=restaurants,
+                      vehicles=[replace(ve, number_available=math.ceil(ve.number_available * demand_share)) for ve in self.vehicles],
+                      supplier_warehouse_distances=[d for d in self.supplier_warehouse_distance if d.route_tuple[1] in warehouse_names],
+                      warehouse_restaurant_distances=[d for d in self.warehouse_restaurant_distance if d.route_tuple[0] in warehouse_names and d.route_tuple[1] in restaurant_names])
+
+    def create_output(self, output_file=None):
+        logger.info("Building output.")
+        supply_chains = []
+        for name, result in self.region_results.items():
+            if result.supply_chain is not None:
+                supply_chains.append(result.supply_chain)
+            else:
+                logger.warning(f"Region {name} has no plan.")
+        self.supply_chain = SupplyChain.concatenate(supply_chains)
+        self.create_json_output(output_file)
@@ -0,0 +1,100 @@
+import logging
+from optimisers.multi_period import MultiPeriodModel, PeriodPlan
+from optimisers.solvers import SolverConfig
+from output.outputter import OptimisationOutputter, JSONOutputter
+from output.output import SupplyChain
+from planners.cost_minimiser import CostMinimiserPlanner
+import time
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+class RollingHorizonPlanner(CostMinimiserPlanner):
+    '''
+    Plans several days ahead with warehouse inventory carried from day to day. Rather than one MIP over the whole
+    horizon, a short window of days is solved, its first day is kept, and the window rolls forward a day starting
+    from that day's closing inventory. Each window is warm started from the one before.
+    Warehouses not in onboarded_warehouses can only be used from their onboarding period on, if it is None every
+    warehouse is treated as onboarded.
+    '''
+    # kg a restaurant's delivery may fall short of its demand by before the period's plan is rejected
+    DEMAND_TOLERANCE = 1e-6
+
+    def __init__(self,
+                 cost_co2_split=0.5,
+                 n_periods=7,
+                 window=3,
+                 onboarded_warehouses: List[str] = None,
+                 initial_inventory: dict[str, float] = None,
+                 solver_config: SolverConfig = None,
+                 reduce_vehicles=False,
+                 nearest_warehouses=None):
+        super().__init__(cost_co2_split=cost_co2_split,
+                         solver_config=solver_config,
+                         reduce_vehicles=reduce_vehicles,
+                         nearest_warehouses=nearest_warehouses)
+        self.n_periods = n_periods
+        self.window = window
+        self.onboarded_warehouses = set(onboarded_warehouses) if onboarded_warehouses is not None else None
+        self.initial_inventory = initial_inventory or {}
+        self.period_plans: List[PeriodPlan] = []
+        self.period_inventory: List[dict[str, float]] = []
+        self.supply_chains: List[SupplyChain] = []
+        self.json_outputs: List[list] = []
+
+    def run(self):
+        self.get_data()
+        self.optimise()
+        self.create_output()
+
+    def optimise(self):
+        '''
+        Stops rolling at the first window without a feasible plan, keeping the days planned before it.
+        '''
+        start_time = time.time()
+        # the single day optimiser holds the arcs and objective coefficients every window shares
+        template = self.create_optimiser(self.nearest_warehouses)
+        inventory = {w.name: float(self.initial_inventory.get(w.name, 0)) for w in self.warehouses}
+        previous: MultiPeriodModel = None
+        self.period_plans = []
+        self.period_inventory = []
+        for start in range(self.n_periods):
+            model = MultiPeriodModel(template, range(start, min(start + self.window, self.n_periods)), inventory, self.onboarded_warehouses)
+            model.build()
+            if previous:
+                model.set_warm_start(previous)
+            model.solve()
+            if not model.solve_stats.has_solution:
+                logger.warning(f"No feasible plan for the window from period {start}, planned {start} of {self.n_periods} periods.")
+                break
+            self.period_plans.append(model.get_period_plan(start))
+            inventory = model.get_closing_inventory(start)
+            self.period_inventory.append(inventory)
+            previous = model
+        logger.info(f"Planned {len(self.period_plans)} periods in {time.time() - start_time}.")
+
+    def create_output(self):
+        '''
+        Builds a plan for each period, the first period's plan is also the planner's supply chain.
+        '''
+        logger.info("Building output.")
+        self.supply_chains = []
+        self.json_outputs = []
+        for period_plan in self.period_plans:
+            self.supply_chain = OptimisationOutputter(optimiser=period_plan).create_table_output()
+            self.check_delivered(period_plan.period)
+            self.create_json_output()
+            self.supply_chains.append(self.supply_chain)
+            self.json_outputs.append(self.json_output)
+        if self.supply_chains:
+            self.supply_chain = self.supply_chains[0]
+            self.json_output = self.json_outputs[0]
+
+    def check_delivered(self, period: int):
+        '''
+        Every period's plan meets all restaurant demand, so a shortfall in the output means it was not read from the period's solution.
+        '''
+        delivered = self.supply_chain.get_site_amounts('distribution')
+        short = [r.name for r in self.restaurants if delivered.get(r.name, 0.0) < float(r.restaurant_demand) - self.DEMAND_TOLERANCE]
+        if short:
+            raise ValueError(f"The plan for period {period} does not meet the demand of {len(short)} restaurants, e.g. {', '.join(short[:10])}.")
@@ -1,6 +1,6 @@
 from connectors.connection import DbConnection
 from psycopg2 import extras
-from output.output import Edge, SupplyChain, TotalOutput
+from output.output import SupplyChain, TotalOutput
 from readers.reader import Reader
 
 
@@ -28,5 +28,5 @@ class SupplyChainReader(Reader):
     def read_query(self):
         supply_chain = self.connection.reader(self.query)
         metrics = [TotalOutput(**link['metrics']) for link in supply_chain[:1]]
-        self.data = SupplyChain([Edge(**link['properties']) for link in supply_chain])
+        self.data = SupplyChain.from_records([link['properties'] for link in supply_chain])
         self.data.metrics = metrics[0]
\ No newline at end of file